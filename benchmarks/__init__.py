@@ -0,0 +1 @@
+"""Benchmarks for the web interface, run against local fake upstream services."""
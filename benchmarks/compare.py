@@ -0,0 +1,62 @@
+"""
+Compare two benchmark reports::
+
+    python -m benchmarks.compare benchmarks/results/old.json benchmarks/results/new.json
+
+Prints throughput, p50/p95/p99 latency and peak RSS side by side for every
+scenario and concurrency level the two reports share, with the relative change.
+"""
+
+import argparse
+import json
+
+
+def load(path):
+    with open(path) as f:
+        report = json.load(f)
+    return report, {(result['scenario'], result['concurrency']): result for result in report['results']}
+
+
+def change(old, new):
+    if old in (None, 0) or new is None:
+        return ''
+    return f'{(new - old) / old * 100:+.1f}%'
+
+
+def metrics(result):
+    latency = result.get('latency_ms') or {}
+    rss = result.get('peak_rss_bytes')
+    return {
+        'req/s': result.get('throughput_rps'),
+        'p50 ms': latency.get('p50'),
+        'p95 ms': latency.get('p95'),
+        'p99 ms': latency.get('p99'),
+        'peak MiB': round(rss / 1024 / 1024, 1) if rss else None,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare two benchmark reports.")
+    parser.add_argument('baseline')
+    parser.add_argument('candidate')
+    args = parser.parse_args(argv)
+
+    old_report, old_results = load(args.baseline)
+    new_report, new_results = load(args.candidate)
+    print(f"baseline {old_report.get('commit')}  vs  candidate {new_report.get('commit')}")
+    if old_report.get('parameters', {}).get('upstreams') != new_report.get('parameters', {}).get('upstreams'):
+        print("warning: the runs used different upstream settings")
+
+    for key in sorted(set(old_results) & set(new_results)):
+        old, new = metrics(old_results[key]), metrics(new_results[key])
+        print(f"\n{key[0]} (concurrency {key[1]})")
+        for name in old:
+            print(f"  {name:9} {old[name] if old[name] is not None else '-':>10} -> "
+                  f"{new[name] if new[name] is not None else '-':>10}  {change(old[name], new[name])}")
+        failed = (old_results[key]['failed'], new_results[key]['failed'])
+        if any(failed):
+            print(f"  failed    {failed[0]:>10} -> {failed[1]:>10}")
+
+
+if __name__ == '__main__':
+    main()
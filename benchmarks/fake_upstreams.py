@@ -0,0 +1,426 @@
+"""
+Local stand-ins for the Compass index API, the Compass parser and Cohere.
+
+Each fake is a small threaded HTTP server that answers the endpoints the web
+interface calls, in the formats the SDKs expect. How they behave is set by an
+``UpstreamBehaviour``: added latency (with jitter), the size of the text in
+each returned chunk or answer, and the fraction of requests answered with a
+503. The Compass fake serves one synthetic index whose documents and chunks
+are generated up front, so responses cost the fake almost nothing to build.
+
+Run ``python -m benchmarks.fake_upstreams`` to start the fakes on their own and
+point a manually started web interface at them.
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+BENCH_INDEX = 'bench'
+
+WORDS = (
+    'compass', 'index', 'document', 'chunk', 'search', 'vector', 'parser', 'metadata',
+    'retrieval', 'context', 'answer', 'query', 'latency', 'throughput', 'model', 'token'
+)
+
+
+def filler_text(size, seed=0):
+    """Return deterministic filler text of about ``size`` characters."""
+    rng = random.Random(seed)
+    words = []
+    length = 0
+    while length < size:
+        word = rng.choice(WORDS)
+        words.append(word)
+        length += len(word) + 1
+    return ' '.join(words)[:size]
+
+
+class UpstreamBehaviour:
+    """How a fake upstream responds."""
+
+    def __init__(self, latency_ms=50.0, jitter=0.2, payload_bytes=1000, error_rate=0.0):
+        """
+        :param latency_ms: mean delay added to every response
+        :param jitter: relative spread of the delay (0.2 is +/- 20%)
+        :param payload_bytes: size of the text in each chunk, parsed chunk or answer
+        :param error_rate: fraction of requests answered with a 503
+        """
+        self.latency_ms = latency_ms
+        self.jitter = jitter
+        self.payload_bytes = payload_bytes
+        self.error_rate = error_rate
+
+    def delay(self):
+        if self.latency_ms > 0:
+            spread = self.latency_ms * self.jitter
+            time.sleep(max(0.0, random.uniform(self.latency_ms - spread, self.latency_ms + spread)) / 1000)
+
+    def should_fail(self):
+        return self.error_rate > 0 and random.random() < self.error_rate
+
+    def to_dict(self):
+        return {
+            'latency_ms': self.latency_ms,
+            'jitter': self.jitter,
+            'payload_bytes': self.payload_bytes,
+            'error_rate': self.error_rate,
+        }
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """Shared plumbing: keep-alive, JSON bodies, injected latency and errors."""
+
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are written separately; without TCP_NODELAY, Nagle's
+    # algorithm and delayed ACKs add ~40 ms to every keep-alive response
+    disable_nagle_algorithm = True
+    behaviour = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length) if length else b''
+
+    def read_json(self):
+        body = self.read_body()
+        return json.loads(body) if body else {}
+
+    def send_json(self, payload, status=200):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def handle_request(self):
+        raise NotImplementedError
+
+    def _dispatch(self):
+        self.server.counts[self.command] = self.server.counts.get(self.command, 0) + 1
+        self.behaviour.delay()
+        if self.behaviour.should_fail():
+            # Drain the body so the connection can be reused
+            self.read_body()
+            self.send_json({'message': 'injected upstream failure'}, status=503)
+            return
+        self.handle_request()
+
+    do_GET = do_POST = do_PUT = do_DELETE = _dispatch
+
+
+class FakeCompassHandler(_Handler):
+    """Compass index API: index listing, search, direct search with scrolls, uploads and inserts."""
+
+    documents = 200
+    chunks_per_document = 3
+
+    @classmethod
+    def prepare(cls):
+        text = filler_text(cls.behaviour.payload_bytes)
+        cls.chunks = [
+            {
+                'chunk_id': f'doc-{d}-chunk-{c}',
+                'sort_id': c,
+                'parent_document_id': f'doc-{d}',
+                'document_id': f'doc-{d}',
+                'path': f'/bench/document-{d}.pdf',
+                'content': {'text': text},
+                'score': 1.0 / (1 + d),
+            }
+            for d in range(cls.documents)
+            for c in range(cls.chunks_per_document)
+        ]
+        cls.scrolls = {}
+        cls.scrolls_lock = threading.Lock()
+
+    def handle_request(self):
+        path = urlparse(self.path).path.rstrip('/')
+        parts = path.split('/')
+        if path == '/api/v1/indexes' and self.command == 'GET':
+            self.send_json({'indexes': [{
+                'name': BENCH_INDEX,
+                'count': len(self.chunks),
+                'parent_doc_count': self.documents,
+            }]})
+        elif path.endswith('/documents/_search'):
+            self.search(self.read_json())
+        elif path.endswith('/_direct_search/scroll'):
+            self.scroll(self.read_json())
+        elif path.endswith('/_direct_search'):
+            self.direct_search(self.read_json())
+        elif path.endswith('/documents/upload'):
+            self.read_body()
+            self.send_json({'upload_id': str(uuid.uuid4())})
+        elif path.endswith('/documents') and self.command == 'PUT':
+            self.read_body()
+            self.send_json({})
+        elif len(parts) == 5 and self.command == 'PUT':
+            # create_index
+            self.read_body()
+            self.send_json({})
+        else:
+            self.read_body()
+            self.send_json({'message': f'{self.command} {path} is not faked'}, status=404)
+
+    def search(self, data):
+        top_k = int(data.get('top_k', 10))
+        # Vary the hits with the query so cached and uncached searches differ
+        offset = sum(map(ord, data.get('query', ''))) % self.documents
+        hits = []
+        for d in range(top_k):
+            document = (offset + d) % self.documents
+            chunks = self.chunks[document * self.chunks_per_document:(document + 1) * self.chunks_per_document]
+            hits.append({
+                'document_id': f'doc-{document}',
+                'path': chunks[0]['path'],
+                'parent_document_id': f'doc-{document}',
+                'content': {},
+                'chunks': [
+                    {key: chunk[key] for key in ('chunk_id', 'sort_id', 'parent_document_id', 'content', 'score')}
+                    for chunk in chunks
+                ],
+                'score': 1.0 / (1 + d),
+            })
+        self.send_json({'hits': hits})
+
+    def direct_search(self, data):
+        size = int(data.get('size', 100))
+        scroll_id = None
+        if data.get('scroll'):
+            scroll_id = str(uuid.uuid4())
+            with self.scrolls_lock:
+                self.scrolls[scroll_id] = size
+        self.send_json({'hits': self.chunks[:size], 'scroll_id': scroll_id})
+
+    def scroll(self, data):
+        scroll_id = data.get('scroll_id')
+        with self.scrolls_lock:
+            offset = self.scrolls.get(scroll_id)
+            if offset is None:
+                hits = []
+            else:
+                hits = self.chunks[offset:offset + 500]
+                self.scrolls[scroll_id] = offset + len(hits)
+        self.send_json({'hits': hits, 'scroll_id': scroll_id})
+
+
+class FakeParserHandler(_Handler):
+    """Compass parser: every file parses into one document of a few chunks."""
+
+    chunks_per_document = 3
+
+    def handle_request(self):
+        if urlparse(self.path).path != '/v1/process_file':
+            self.read_body()
+            self.send_json({'message': 'not faked'}, status=404)
+            return
+        body = self.read_body()
+        # The multipart form is not parsed; the file name is enough
+        marker = b'filename="'
+        start = body.find(marker)
+        filename = body[start + len(marker):body.find(b'"', start + len(marker))].decode() if start >= 0 else 'file'
+        document_id = str(uuid.uuid4())
+        text = filler_text(self.behaviour.payload_bytes)
+        self.send_json({'docs': [{
+            'filebytes': '',
+            'metadata': {'doc_id': document_id, 'filename': filename, 'meta': [], 'parent_doc_id': document_id},
+            'content': {'text': text},
+            'content_type': 'text/plain',
+            'elements': [],
+            'chunks': [
+                {
+                    'chunk_id': f'{document_id}-{c}',
+                    'sort_id': str(c),
+                    'doc_id': document_id,
+                    'parent_doc_id': document_id,
+                    'content': {'text': text},
+                    'origin': None,
+                    'assets': None,
+                }
+                for c in range(self.chunks_per_document)
+            ],
+            'index_fields': [],
+            'errors': [],
+            'ignore_metadata_errors': True,
+            'markdown': None,
+        }]})
+
+
+class FakeCohereHandler(_Handler):
+    """Cohere: v2 chat (blocking and streamed) and the v1 model listing."""
+
+    # Streamed answers are split into this many content-delta events
+    stream_tokens = 20
+    models = [
+        {
+            'name': name,
+            'endpoints': ['chat', 'generate'],
+            'finetuned': False,
+            'context_length': context_length,
+            'features': ['tools', 'json_mode'],
+        }
+        for name, context_length in (('command-a-03-2025', 256000), ('command-r-plus', 128000), ('command-r', 128000))
+    ]
+
+    def handle_request(self):
+        parsed = urlparse(self.path)
+        if parsed.path == '/v1/models':
+            endpoint = parse_qs(parsed.query).get('endpoint', [None])[0]
+            models = [model for model in self.models if endpoint is None or endpoint in model['endpoints']]
+            self.send_json({'models': models, 'next_page_token': None})
+        elif parsed.path == '/v2/chat':
+            data = self.read_json()
+            if data.get('stream'):
+                self.chat_stream(data)
+            else:
+                self.send_json({
+                    'id': str(uuid.uuid4()),
+                    'finish_reason': 'COMPLETE',
+                    'message': {
+                        'role': 'assistant',
+                        'content': [{'type': 'text', 'text': filler_text(self.behaviour.payload_bytes)}],
+                    },
+                    'usage': self.usage(data),
+                })
+        else:
+            self.read_body()
+            self.send_json({'message': 'not faked'}, status=404)
+
+    def usage(self, data):
+        input_tokens = len(json.dumps(data)) // 4
+        output_tokens = self.behaviour.payload_bytes // 4
+        return {
+            'billed_units': {'input_tokens': input_tokens, 'output_tokens': output_tokens},
+            'tokens': {'input_tokens': input_tokens, 'output_tokens': output_tokens},
+        }
+
+    def chat_stream(self, data):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+        def send_event(payload):
+            event = f"event: {payload['type']}\ndata: {json.dumps(payload)}\n\n".encode('utf-8')
+            self.wfile.write(f'{len(event):x}\r\n'.encode() + event + b'\r\n')
+            self.wfile.flush()
+
+        message_id = str(uuid.uuid4())
+        send_event({'type': 'message-start', 'id': message_id, 'delta': {'message': {'role': 'assistant'}}})
+        send_event({'type': 'content-start', 'index': 0, 'delta': {'message': {'content': {'type': 'text', 'text': ''}}}})
+        text = filler_text(self.behaviour.payload_bytes)
+        step = max(1, len(text) // self.stream_tokens)
+        # The configured latency is the time to first token; later tokens
+        # arrive spread over the same amount of time again
+        token_delay = self.behaviour.latency_ms / 1000 / self.stream_tokens
+        for start in range(0, len(text), step):
+            send_event({'type': 'content-delta', 'index': 0, 'delta': {'message': {'content': {'text': text[start:start + step]}}}})
+            time.sleep(token_delay)
+        send_event({'type': 'content-end', 'index': 0})
+        send_event({'type': 'message-end', 'delta': {'finish_reason': 'COMPLETE', 'usage': self.usage(data)}})
+        self.wfile.write(b'0\r\n\r\n')
+
+
+class FakeServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 256
+
+    def __init__(self, address, handler):
+        super().__init__(address, handler)
+        self.counts = {}
+
+
+def _start_server(handler_class, behaviour, host, port):
+    handler = type(handler_class.__name__, (handler_class,), {'behaviour': behaviour})
+    if hasattr(handler, 'prepare'):
+        handler.prepare()
+    server = FakeServer((host, port), handler)
+    threading.Thread(target=server.serve_forever, name=f'{handler_class.__name__}-server', daemon=True).start()
+    return server
+
+
+class FakeUpstreams:
+    """The three fake services, each on its own port."""
+
+    def __init__(self, compass, parser, cohere):
+        self.servers = {'compass': compass, 'parser': parser, 'cohere': cohere}
+
+    def url(self, name):
+        host, port = self.servers[name].server_address[:2]
+        return f'http://{host}:{port}'
+
+    def environ(self):
+        """Environment variables pointing the web interface at the fakes."""
+        return {
+            'COMPASS_API_URL': self.url('compass'),
+            'COMPASS_API_BEARER_TOKEN': 'bench',
+            'COMPASS_PARSER_URL': self.url('parser'),
+            'COMPASS_PARSER_BEARER_TOKEN': 'bench',
+            # Read by the Cohere SDK when it is imported
+            'CO_API_URL': self.url('cohere'),
+            'COHERE_API_KEY': 'bench',
+        }
+
+    def request_counts(self):
+        return {name: dict(server.counts) for name, server in self.servers.items()}
+
+    def shutdown(self):
+        for server in self.servers.values():
+            server.shutdown()
+            server.server_close()
+
+
+def start_fake_upstreams(compass=None, parser=None, cohere=None, host='127.0.0.1', documents=200):
+    """
+    Start the fake Compass, parser and Cohere servers on free ports.
+
+    Each argument is the ``UpstreamBehaviour`` for that service (defaults apply
+    when omitted); ``documents`` is the number of documents in the fake index.
+    """
+    compass_handler = type('FakeCompassHandler', (FakeCompassHandler,), {'documents': documents})
+    return FakeUpstreams(
+        _start_server(compass_handler, compass or UpstreamBehaviour(), host, 0),
+        _start_server(FakeParserHandler, parser or UpstreamBehaviour(latency_ms=200), host, 0),
+        _start_server(FakeCohereHandler, cohere or UpstreamBehaviour(latency_ms=500), host, 0),
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--latency-ms', type=float, default=50, help='Compass latency')
+    parser.add_argument('--parser-latency-ms', type=float, default=200)
+    parser.add_argument('--cohere-latency-ms', type=float, default=500)
+    parser.add_argument('--payload-bytes', type=int, default=1000)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--documents', type=int, default=200)
+    args = parser.parse_args()
+
+    def behaviour(latency_ms):
+        return UpstreamBehaviour(latency_ms=latency_ms, payload_bytes=args.payload_bytes, error_rate=args.error_rate)
+
+    upstreams = start_fake_upstreams(
+        behaviour(args.latency_ms),
+        behaviour(args.parser_latency_ms),
+        behaviour(args.cohere_latency_ms),
+        documents=args.documents
+    )
+    print("Fake upstreams running; start the web interface with:")
+    for name, value in upstreams.environ().items():
+        print(f"  export {name}={value}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        upstreams.shutdown()
+
+
+if __name__ == '__main__':
+    main()
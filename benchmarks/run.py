@@ -0,0 +1,436 @@
+"""
+Benchmark the web interface against local fake upstreams.
+
+Starts the fake Compass, parser and Cohere servers, launches the web interface
+in a subprocess pointed at them, then drives each scenario at every requested
+concurrency level and writes a JSON report with throughput, latency
+percentiles and the server's peak RSS per scenario::
+
+    python -m benchmarks.run --concurrency 1,8,32 --requests 200
+
+Reports are named after the commit they measured, so two runs can be compared
+with ``python -m benchmarks.compare``.
+"""
+
+import argparse
+import json
+import math
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+import requests
+
+from benchmarks.fake_upstreams import BENCH_INDEX, UpstreamBehaviour, start_fake_upstreams
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(ROOT, 'benchmarks', 'results')
+
+# Marker the HTML pages render when a route caught an error
+HTML_ERROR_MARKER = '<strong>Error:</strong>'
+
+
+class ScenarioError(Exception):
+    """A response that arrived but reports a failure."""
+
+
+# Each scenario sends one request and raises ScenarioError if the app reports
+# a failure; it may return extra timings (e.g. time to first token)
+
+def search_index(session, base_url, i, options):
+    response = session.post(
+        f'{base_url}/indexes/{BENCH_INDEX}/search',
+        data={'query': options.query(i), 'top_k': options.top_k}
+    )
+    check_html(response)
+
+
+def view_index(session, base_url, i, options):
+    response = session.get(f'{base_url}/indexes/{BENCH_INDEX}', params={'page': i % 5 + 1, 'per_page': 20})
+    check_html(response)
+
+
+def chat_generate(session, base_url, i, options):
+    response = session.post(f'{base_url}/indexes/{BENCH_INDEX}/chat-generate', json={'prompt': options.query(i)})
+    check_json(response)
+
+
+def chat_stream(session, base_url, i, options):
+    started = time.perf_counter()
+    first_token_ms = None
+    event = None
+    with session.post(
+        f'{base_url}/indexes/{BENCH_INDEX}/chat-stream', json={'prompt': options.query(i)}, stream=True
+    ) as response:
+        if response.status_code >= 400:
+            raise ScenarioError(f'HTTP {response.status_code}')
+        for line in response.iter_lines(decode_unicode=True):
+            if line.startswith('event: '):
+                event = line[len('event: '):]
+                if event == 'token' and first_token_ms is None:
+                    first_token_ms = (time.perf_counter() - started) * 1000
+                elif event == 'error':
+                    raise ScenarioError('error event')
+    if event != 'done':
+        raise ScenarioError('stream ended early')
+    return {'time_to_first_token_ms': first_token_ms}
+
+
+def upload_document(session, base_url, i, options):
+    started = time.perf_counter()
+    response = session.post(
+        f'{base_url}/indexes/{BENCH_INDEX}/upload',
+        files={'document': (f'bench-{i}.txt', options.upload_bytes, 'text/plain')},
+        data={'advanced_settings': 'on'} if options.parse_uploads else {},
+        headers={'Accept': 'application/json'}
+    )
+    if response.status_code != 202:
+        raise ScenarioError(f'HTTP {response.status_code}')
+    accepted_ms = (time.perf_counter() - started) * 1000
+    if not options.wait_for_jobs:
+        return {'accepted_ms': accepted_ms}
+    # Follow the job so the report covers parsing and inserting too
+    status_url = base_url + response.json()['status_url']
+    while True:
+        job = session.get(status_url).json()
+        if job.get('status') in ('succeeded', 'failed'):
+            break
+        time.sleep(options.poll_interval)
+    if job['status'] == 'failed':
+        raise ScenarioError(job.get('error') or 'job failed')
+    return {'accepted_ms': accepted_ms}
+
+
+def api_call(session, base_url, i, options):
+    response = session.post(f'{base_url}/api/call', json={
+        'client_type': 'compass',
+        'method': 'search_documents',
+        'params': {'index_name': BENCH_INDEX, 'query': options.query(i), 'top_k': options.top_k}
+    })
+    check_json(response)
+
+
+def check_html(response):
+    if response.status_code >= 400:
+        raise ScenarioError(f'HTTP {response.status_code}')
+    if HTML_ERROR_MARKER in response.text:
+        raise ScenarioError('error rendered in page')
+
+
+def check_json(response):
+    if response.status_code >= 400:
+        raise ScenarioError(f'HTTP {response.status_code}')
+    body = response.json()
+    if body.get('error') or body.get('success') is False:
+        raise ScenarioError(str(body.get('error')))
+
+
+SCENARIOS = {
+    'search_index': search_index,
+    'view_index': view_index,
+    'chat_generate': chat_generate,
+    'chat_stream': chat_stream,
+    'upload_document': upload_document,
+    'api_call': api_call,
+}
+
+
+class ScenarioOptions:
+    """Request parameters shared by the scenarios."""
+
+    def __init__(self, distinct_queries=50, top_k=10, upload_bytes=4096, parse_uploads=False,
+                 wait_for_jobs=True, poll_interval=0.05):
+        self.distinct_queries = distinct_queries
+        self.top_k = top_k
+        self.upload_bytes = b'x' * upload_bytes
+        self.parse_uploads = parse_uploads
+        self.wait_for_jobs = wait_for_jobs
+        self.poll_interval = poll_interval
+        # Queries are unique to this run so earlier runs' cache entries never hit
+        self.run_id = uuid.uuid4().hex[:8]
+
+    def query(self, i):
+        # A pool of distinct queries: repeated ones may be served from the caches
+        if self.distinct_queries:
+            i %= self.distinct_queries
+        return f'benchmark {self.run_id} question {i}'
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(fraction * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def summarize(values):
+    values = sorted(value for value in values if value is not None)
+    if not values:
+        return None
+    return {
+        'p50': round(percentile(values, 0.50), 2),
+        'p95': round(percentile(values, 0.95), 2),
+        'p99': round(percentile(values, 0.99), 2),
+        'mean': round(sum(values) / len(values), 2),
+        'max': round(values[-1], 2),
+    }
+
+
+def read_proc_status(pid, field):
+    """Return a ``/proc/<pid>/status`` memory field in bytes, or None off Linux."""
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def reset_peak_rss(pid):
+    """Reset the kernel's peak RSS counter so the next reading covers one scenario."""
+    try:
+        with open(f'/proc/{pid}/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def run_scenario(name, base_url, concurrency, total_requests, options, server_pid=None, warmup=5):
+    """Send ``total_requests`` requests from ``concurrency`` threads and summarize them."""
+    func = SCENARIOS[name]
+    sessions = [requests.Session() for _ in range(concurrency)]
+    for i in range(min(warmup, total_requests)):
+        try:
+            func(sessions[0], base_url, -1 - i, options)
+        except Exception:
+            pass
+
+    peak_reset = server_pid is not None and reset_peak_rss(server_pid)
+    latencies = []
+    extras = {}
+    errors = {}
+    counter = iter(range(total_requests))
+    lock = threading.Lock()
+
+    def worker(session):
+        while True:
+            with lock:
+                i = next(counter, None)
+            if i is None:
+                return
+            started = time.perf_counter()
+            try:
+                extra = func(session, base_url, i, options) or {}
+                error = None
+            except Exception as e:
+                extra = {}
+                error = f'{type(e).__name__}: {e}'[:200]
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            with lock:
+                if error is None:
+                    latencies.append(elapsed_ms)
+                    for key, value in extra.items():
+                        extras.setdefault(key, []).append(value)
+                else:
+                    errors[error] = errors.get(error, 0) + 1
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(session,)) for session in sessions]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    for session in sessions:
+        session.close()
+
+    result = {
+        'scenario': name,
+        'concurrency': concurrency,
+        'requests': total_requests,
+        'succeeded': len(latencies),
+        'failed': total_requests - len(latencies),
+        'errors': errors,
+        'elapsed_seconds': round(elapsed, 3),
+        'throughput_rps': round(len(latencies) / elapsed, 2) if elapsed else None,
+        'latency_ms': summarize(latencies),
+    }
+    for key, values in extras.items():
+        result[key] = summarize(values)
+    if server_pid is not None:
+        result['peak_rss_bytes'] = read_proc_status(server_pid, 'VmHWM')
+        result['rss_bytes'] = read_proc_status(server_pid, 'VmRSS')
+        # Without a reset the peak covers everything since the server started
+        result['peak_rss_scope'] = 'scenario' if peak_reset else 'process'
+    return result
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# Commands serving the web interface; {port} is filled in
+SERVERS = {
+    'flask': ['-m', 'flask', '--app', 'web_interface.app', 'run', '--host', '127.0.0.1', '--port', '{port}',
+              '--with-threads', '--no-reload', '--no-debugger'],
+    'asgi': ['-m', 'uvicorn', 'web_interface.asgi:app', '--host', '127.0.0.1', '--port', '{port}',
+             '--no-access-log'],
+}
+
+
+def start_app(environ, port, workdir, server='flask'):
+    """Launch the web interface with the chosen server and wait until it answers."""
+    env = dict(os.environ, **environ)
+    env.update({
+        'JOBS_DIR': os.path.join(workdir, 'jobs'),
+        'UPLOADS_DIR': os.path.join(workdir, 'uploads'),
+        'SETTINGS_FILE': os.path.join(workdir, 'settings.pkl'),
+        'PROFILING_ENABLED': 'false',
+    })
+    process = subprocess.Popen(
+        [sys.executable] + [arg.format(port=port) for arg in SERVERS[server]],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    base_url = f'http://127.0.0.1:{port}'
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"The web interface exited with code {process.returncode}")
+        try:
+            requests.get(f'{base_url}/health', timeout=1)
+            return process, base_url
+        except requests.RequestException:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError("The web interface did not start within 30 seconds")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the web interface against fake upstreams.")
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help='comma-separated scenario names')
+    parser.add_argument('--concurrency', default='1,8,32', help='comma-separated concurrency levels')
+    parser.add_argument('--requests', type=int, default=200, help='requests per scenario and concurrency level')
+    parser.add_argument('--compass-latency-ms', type=float, default=50)
+    parser.add_argument('--parser-latency-ms', type=float, default=200)
+    parser.add_argument('--cohere-latency-ms', type=float, default=500)
+    parser.add_argument('--payload-bytes', type=int, default=1000, help='text per chunk and per answer')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of upstream requests failing with 503')
+    parser.add_argument('--documents', type=int, default=200, help='documents in the fake index')
+    parser.add_argument('--top-k', type=int, default=10)
+    parser.add_argument('--distinct-queries', type=int, default=50,
+                        help='size of the query pool (0 makes every query unique)')
+    parser.add_argument('--parse-uploads', action='store_true', help='upload with parsing (parser + insert_docs)')
+    parser.add_argument('--no-wait-for-jobs', action='store_true',
+                        help='time upload requests only, not the jobs they start')
+    parser.add_argument('--server', choices=sorted(SERVERS), default='flask',
+                        help="serve with Flask's threaded server or the asyncio (ASGI) mode")
+    parser.add_argument('--app-url', help='benchmark an already running web interface instead of starting one')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--output', help=f'report path (default: {os.path.relpath(RESULTS_DIR, ROOT)}/<time>-<commit>.json)')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    scenarios = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    unknown = [name for name in scenarios if name not in SCENARIOS]
+    if unknown:
+        sys.exit(f"Unknown scenarios: {', '.join(unknown)} (choose from {', '.join(SCENARIOS)})")
+    levels = [int(level) for level in args.concurrency.split(',')]
+
+    def behaviour(latency_ms):
+        return UpstreamBehaviour(latency_ms=latency_ms, payload_bytes=args.payload_bytes, error_rate=args.error_rate)
+
+    upstream_behaviours = {
+        'compass': behaviour(args.compass_latency_ms),
+        'parser': behaviour(args.parser_latency_ms),
+        'cohere': behaviour(args.cohere_latency_ms),
+    }
+    options = ScenarioOptions(
+        distinct_queries=args.distinct_queries,
+        top_k=args.top_k,
+        parse_uploads=args.parse_uploads,
+        wait_for_jobs=not args.no_wait_for_jobs,
+    )
+
+    upstreams = start_fake_upstreams(documents=args.documents, **upstream_behaviours)
+    process = None
+    results = []
+    try:
+        with tempfile.TemporaryDirectory(prefix='compass-bench-') as workdir:
+            if args.app_url:
+                base_url = args.app_url.rstrip('/')
+                print("Using the running web interface; point it at the fake upstreams with:")
+                for name, value in upstreams.environ().items():
+                    print(f"  {name}={value}")
+            else:
+                process, base_url = start_app(upstreams.environ(), args.port, workdir, args.server)
+            server_pid = process.pid if process else None
+            for name in scenarios:
+                for concurrency in levels:
+                    result = run_scenario(name, base_url, concurrency, args.requests, options, server_pid)
+                    results.append(result)
+                    latency = result['latency_ms'] or {}
+                    print(
+                        f"{name:16} c={concurrency:<4} {result['throughput_rps'] or 0:8.1f} req/s  "
+                        f"p50 {latency.get('p50', 0):8.1f}  p95 {latency.get('p95', 0):8.1f}  "
+                        f"p99 {latency.get('p99', 0):8.1f} ms  failed {result['failed']}"
+                    )
+            if process is not None:
+                process.terminate()
+                process.wait(timeout=10)
+    finally:
+        if process is not None and process.poll() is None:
+            process.kill()
+        upstream_requests = upstreams.request_counts()
+        upstreams.shutdown()
+
+    commit = git_commit()
+    report = {
+        'commit': commit,
+        'started_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+        },
+        'parameters': {
+            'scenarios': scenarios,
+            'concurrency': levels,
+            'requests': args.requests,
+            'documents': args.documents,
+            'top_k': args.top_k,
+            'distinct_queries': args.distinct_queries,
+            'parse_uploads': args.parse_uploads,
+            'wait_for_jobs': options.wait_for_jobs,
+            'server': None if args.app_url else args.server,
+            'app_url': args.app_url,
+            'upstreams': {name: value.to_dict() for name, value in upstream_behaviours.items()},
+        },
+        'upstream_requests': upstream_requests,
+        'results': results,
+    }
+    output = args.output or os.path.join(RESULTS_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}-{commit or 'unknown'}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Report written to {output}")
+    return report
+
+
+if __name__ == '__main__':
+    main()
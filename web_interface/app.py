@@ -9,32 +9,89 @@ import sys
 import json
 import uuid
 import base64
-import pickle
+import hashlib
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 # Add the parent directory to Python path so we can find the cohere_compass package
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from flask import Flask, render_template, request, jsonify, redirect, url_for, session
+from flask import Flask, Response, g, render_template, request, jsonify, redirect, url_for, session, stream_with_context
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.utils import secure_filename
 import dotenv
-import cohere
 
-from cohere_compass.clients import CompassClient, CompassParserClient
+# Load environment variables (before importing modules that read them)
+dotenv.load_dotenv()
+
 from cohere_compass.models import ParserConfig, MetadataConfig, CompassDocument, PDFParsingStrategy
 from cohere_compass.models.config import IndexConfig
 
-# Load environment variables
-dotenv.load_dotenv()
+from web_interface.breakers import CircuitOpenError, breakers
+from web_interface.cache import LRUCache
+from web_interface.clients import registry
+from web_interface.context_builder import ContextBuilder
+from web_interface.documents import DocumentManifests
+from web_interface.index_cache import IndexCache
+from web_interface.ingest import collect_files, extract_archive, ingest_files, is_archive
+from web_interface.jobs import JobQueue, QueueFullError
+from web_interface.logs import configure as configure_logging, debug_dump, end_request, get_logger, preview, start_request
+from web_interface.metrics import (
+    CHAT_CONTEXT_PASSAGES_DROPPED, CHAT_CONTEXT_TOKENS, CHAT_STREAM_DURATION, CHAT_TIME_TO_FIRST_TOKEN, HTTP_ERRORS, HTTP_IN_FLIGHT, HTTP_LATENCY, HTTP_REQUESTS,
+    UPSTREAM_LATENCY, SharedMetrics, metrics
+)
+from web_interface.model_catalogue import ModelCatalogue
+from web_interface.profiling import ProfilerMiddleware
+from web_interface.result_sets import CursorError, ResultSets
+from web_interface.retrieval import extract_hits, search_indexes
+from web_interface.retries import call_with_retry, carry_deadline, has_error_result, is_retryable, retry_budget
+from web_interface.settings_store import SettingsStore
+from web_interface.shared_cache import InvalidationListener, SharedCache, SharedStore
+from web_interface.snippets import ChunkTexts, highlight_html
+from web_interface.uploads import ChunkedUploads, UploadError
+
+configure_logging()
+log = get_logger(__name__)
 
 app = Flask(__name__)
 app.config['COHERE_API_KEY'] = os.getenv('COHERE_API_KEY')
 app.secret_key = os.getenv('FLASK_SECRET_KEY', 'compass-secret-key')
 
+# Opt-in request profiling; the middleware is only installed when enabled
+if os.getenv('PROFILING_ENABLED', 'false').lower() in ('1', 'true', 'yes', 'on'):
+    if os.getenv('PROFILING_TOKEN'):
+        app.wsgi_app = ProfilerMiddleware(
+            app.wsgi_app,
+            token=os.getenv('PROFILING_TOKEN'),
+            output_dir=os.getenv('PROFILING_DIR', os.path.join(os.path.dirname(__file__), 'profiles')),
+            mode=os.getenv('PROFILING_MODE', 'sample'),
+            sample_interval=float(os.getenv('PROFILING_SAMPLE_INTERVAL', 0.005))
+        )
+    else:
+        log.warning("PROFILING_ENABLED is set but PROFILING_TOKEN is empty; profiling stays off")
+
+# With several worker processes (gunicorn.conf.py sets SHARED_CACHE_PATH), caches
+# live in a SQLite database shared by all of them; otherwise they are in memory
+SHARED_CACHE_PATH = os.getenv('SHARED_CACHE_PATH')
+shared_store = SharedStore(SHARED_CACHE_PATH) if SHARED_CACHE_PATH else None
+
+def new_cache(namespace, max_entries, max_bytes, ttl):
+    """Return a cache shared between worker processes if enabled, else an in-memory LRU cache."""
+    if shared_store is not None:
+        return SharedCache(shared_store, namespace, max_entries=max_entries, max_bytes=max_bytes, ttl=ttl)
+    return LRUCache(max_entries=max_entries, max_bytes=max_bytes, ttl=ttl)
+
 # Settings file path
-SETTINGS_FILE = os.path.join(os.path.dirname(__file__), 'settings.pkl')
+SETTINGS_FILE = os.getenv('SETTINGS_FILE', os.path.join(os.path.dirname(__file__), 'settings.pkl'))
+settings_store = SettingsStore(
+    SETTINGS_FILE,
+    check_interval=float(os.getenv('SETTINGS_RELOAD_INTERVAL', 2))
+)
 
 # Configure clients
-def get_compass_client():
-    """Create and return a CompassClient instance."""
+def compass_credentials():
+    """Return the Compass API URL and bearer token (from settings if available)."""
     api_url = os.getenv("COMPASS_API_URL")
     if not api_url:
         raise ValueError("COMPASS_API_URL environment variable is not set")
@@ -43,53 +100,296 @@ def get_compass_client():
     settings = load_settings()
     bearer_token = settings.get('compass_api_bearer_token') or os.getenv("COMPASS_API_BEARER_TOKEN")
     
-    return CompassClient(index_url=api_url, bearer_token=bearer_token)
+    return api_url, bearer_token
+
+def get_compass_client():
+    """Return the shared CompassClient instance."""
+    return registry.compass(*compass_credentials())
 
 def get_parser_client():
-    """Create and return a CompassParserClient instance."""
+    """Return the shared CompassParserClient instance."""
     parser_url = os.getenv("COMPASS_PARSER_URL")
     if not parser_url:
         raise ValueError("COMPASS_PARSER_URL environment variable is not set")
     
     bearer_token = os.getenv("COMPASS_PARSER_BEARER_TOKEN")
-    return CompassParserClient(
-        parser_url=parser_url, 
-        bearer_token=bearer_token,
-        parser_config=ParserConfig()
-    )
+    return registry.parser(parser_url, bearer_token)
 
 def get_cohere_client():
-    """Create and return a Cohere client instance."""
+    """Return the shared Cohere client instance."""
     settings = load_settings()
     api_key = settings.get('cohere_api_key') or os.getenv("COHERE_API_KEY")
     
     if not api_key:
         raise ValueError("Cohere API key not found in settings or environment variables")
     
-    return cohere.Client(api_key=api_key)
+    return registry.cohere(api_key)
 
 # Settings functions
 def load_settings():
-    """Load settings from file."""
-    try:
-        if os.path.exists(SETTINGS_FILE):
-            with open(SETTINGS_FILE, 'rb') as f:
-                return pickle.load(f)
-    except Exception as e:
-        print(f"Error loading settings: {e}")
-    
-    return {}
+    """Load settings from the in-memory store (reloaded when the file changes)."""
+    return settings_store.get()
 
 def save_settings(settings):
-    """Save settings to file."""
+    """Save settings to file atomically."""
     try:
-        with open(SETTINGS_FILE, 'wb') as f:
-            pickle.dump(settings, f)
+        settings_store.save(settings)
+        if shared_store is not None:
+            shared_store.publish('settings')
         return True
-    except Exception as e:
-        print(f"Error saving settings: {e}")
+    except Exception:
+        log.exception('Error saving settings')
         return False
 
+# Index metadata cache
+def _load_indexes():
+    """Fetch the list of indexes from Compass."""
+    response = call_with_retry(
+        get_compass_client().list_indexes,
+        upstream='compass',
+        retry_on_result=has_error_result
+    )
+    if response.error:
+        raise RuntimeError(response.error)
+    return response.result.get("indexes", [])
+
+# SDK methods (callable from the API explorer) that change index metadata
+INDEX_MUTATING_METHODS = {
+    'create_index', 'delete_index', 'insert_doc', 'insert_docs',
+    'upload_document', 'delete_document'
+}
+
+index_cache = IndexCache(
+    _load_indexes,
+    ttl=float(os.getenv('INDEX_CACHE_TTL', 30)),
+    stale_ttl=float(os.getenv('INDEX_CACHE_STALE_TTL', 300)),
+    shared=SharedCache(shared_store, 'indexes', max_entries=1) if shared_store is not None else None
+)
+
+# Per-index document ID manifests used to paginate view_index
+document_manifests = DocumentManifests(
+    scan_batch_size=int(os.getenv('DOCUMENT_SCAN_BATCH_SIZE', 500)),
+    ttl=float(os.getenv('DOCUMENT_MANIFEST_TTL', 600)),
+    max_batches_per_page=int(os.getenv('DOCUMENT_SCAN_MAX_BATCHES_PER_PAGE', 4))
+)
+
+# Search hits keyed by (index, normalized query, top_k)
+retrieval_cache = new_cache(
+    'retrieval',
+    max_entries=int(os.getenv('RETRIEVAL_CACHE_MAX_ENTRIES', 1024)),
+    max_bytes=int(os.getenv('RETRIEVAL_CACHE_MAX_BYTES', 64 * 1024 * 1024)),
+    ttl=float(os.getenv('RETRIEVAL_CACHE_TTL', 300))
+)
+
+def normalize_query(query):
+    """Normalize a query for cache lookups (case and whitespace insensitive)."""
+    return ' '.join(query.casefold().split())
+
+def retrieval_cache_key(index_name, query, top_k):
+    return (index_name, normalize_query(query), top_k)
+
+def is_error_response(response):
+    """Return whether a search response reports an error instead of results."""
+    return bool((isinstance(response, dict) and response.get('error')) or getattr(response, 'error', None))
+
+def cached_search(index_name, query, top_k):
+    """Search an index, serving repeated (index, query, top_k) searches from the retrieval cache."""
+    key = retrieval_cache_key(index_name, query, top_k)
+    response = retrieval_cache.get(key)
+    if response is None:
+        try:
+            response = call_with_retry(
+                get_compass_client().search_documents,
+                upstream='compass',
+                index_name=index_name,
+                query=query,
+                top_k=top_k
+            )
+        except CircuitOpenError:
+            # Compass is down: an expired result beats no result
+            response = retrieval_cache.get_stale(key)
+            if response is None:
+                raise
+            log.warning('Serving stale search results while Compass is unavailable', index=index_name)
+            return response
+        # Never cache error responses
+        if not is_error_response(response):
+            retrieval_cache.set(key, response, tags=(index_name,))
+    return response
+
+# Search results beyond the first page, paged through by the search page's infinite scroll
+search_result_sets = ResultSets(
+    new_cache(
+        'result_sets',
+        max_entries=int(os.getenv('SEARCH_RESULT_SETS_MAX_ENTRIES', 256)),
+        max_bytes=int(os.getenv('SEARCH_RESULT_SETS_MAX_BYTES', 64 * 1024 * 1024)),
+        ttl=float(os.getenv('SEARCH_RESULT_SET_TTL', 600))
+    ),
+    page_size=int(os.getenv('SEARCH_PAGE_SIZE', 10))
+)
+
+# Full texts behind the snippets in search and chat payloads, fetched when a result is opened
+chunk_texts = ChunkTexts(
+    new_cache(
+        'chunk_texts',
+        max_entries=int(os.getenv('CHUNK_TEXT_MAX_ENTRIES', 2048)),
+        max_bytes=int(os.getenv('CHUNK_TEXT_MAX_BYTES', 128 * 1024 * 1024)),
+        ttl=float(os.getenv('CHUNK_TEXT_TTL', 3600))
+    ),
+    snippet_chars=int(os.getenv('SNIPPET_CHARS', 240))
+)
+app.add_template_filter(highlight_html, 'highlight')
+
+# Generated chat answers keyed by (model, normalized prompt, retrieved document IDs)
+answer_cache = new_cache(
+    'answers',
+    max_entries=int(os.getenv('ANSWER_CACHE_MAX_ENTRIES', 512)),
+    max_bytes=int(os.getenv('ANSWER_CACHE_MAX_BYTES', 16 * 1024 * 1024)),
+    ttl=float(os.getenv('ANSWER_CACHE_TTL', 3600))
+)
+
+def answer_cache_enabled(settings):
+    """Return whether the opt-in answer cache is switched on."""
+    enabled = settings.get('answer_cache_enabled')
+    if enabled is None:
+        return os.getenv('ANSWER_CACHE_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+    return bool(enabled)
+
+def answer_cache_key(chat_model, prompt, search_results):
+    """Build the answer cache key from the model, prompt and a fingerprint of the grounding documents."""
+    document_ids = '\n'.join(str(getattr(result, 'document_id', '')) for result in search_results)
+    fingerprint = hashlib.sha256(document_ids.encode('utf-8')).hexdigest()
+    return (chat_model, normalize_query(prompt), fingerprint)
+
+def invalidate_index_caches(index_name=None, manifests=True):
+    """
+    Drop cached data derived from an index (or from all indexes) after it
+    changes, in this and every other worker process.
+
+    :param manifests: also drop the index's document manifest in this process
+        (uploads add their documents to it instead)
+    """
+    index_cache.invalidate()
+    if manifests:
+        document_manifests.invalidate(index_name)
+    retrieval_cache.invalidate(index_name)
+    answer_cache.invalidate(index_name)
+    if shared_store is not None:
+        shared_store.publish('index', index_name)
+
+def apply_shared_invalidation(topic, tag):
+    """Drop what this process holds in memory after another worker invalidated it."""
+    if topic == 'index':
+        index_cache.invalidate(shared=False)
+        document_manifests.invalidate(tag)
+    elif topic == 'settings':
+        settings_store.invalidate()
+
+shared_invalidations = InvalidationListener(shared_store, apply_shared_invalidation) if shared_store is not None else None
+
+# With several worker processes, each publishes its metrics to the shared store
+# so that scraping any one of them reports all of them
+shared_metrics = SharedMetrics(
+    metrics, shared_store, publish_interval=float(os.getenv('METRICS_PUBLISH_INTERVAL', 5))
+) if shared_store is not None else None
+
+# Background jobs (document uploads), persisted so a restart resumes queued work
+job_queue = JobQueue(
+    os.getenv('JOBS_DIR', os.path.join(os.path.dirname(__file__), 'job_data')),
+    max_workers=int(os.getenv('JOB_WORKERS', 2)),
+    max_pending=int(os.getenv('JOB_MAX_PENDING', 100))
+)
+
+# Resumable chunked uploads, spooled to disk until they are handed to an upload job
+chunked_uploads = ChunkedUploads(
+    os.getenv('UPLOADS_DIR', os.path.join(os.path.dirname(__file__), 'upload_data')),
+    chunk_size=int(os.getenv('UPLOAD_CHUNK_SIZE', 8 * 1024 * 1024)),
+    max_chunk_size=int(os.getenv('UPLOAD_MAX_CHUNK_SIZE', 64 * 1024 * 1024)),
+    max_size=int(os.getenv('UPLOAD_MAX_SIZE', 2 * 1024 ** 3)),
+    ttl=float(os.getenv('UPLOAD_TTL_SECONDS', 24 * 3600))
+)
+
+# Bulk uploads: files parsed concurrently per job, documents per insert_docs call
+BULK_PARSE_WORKERS = int(os.getenv('BULK_PARSE_WORKERS', 4))
+BULK_MAX_PARSE_WORKERS = int(os.getenv('BULK_MAX_PARSE_WORKERS', 16))
+BULK_INSERT_BATCH_SIZE = int(os.getenv('BULK_INSERT_BATCH_SIZE', 50))
+BULK_MAX_INSERT_BATCH_SIZE = int(os.getenv('BULK_MAX_INSERT_BATCH_SIZE', 500))
+BULK_MAX_FILES = int(os.getenv('BULK_MAX_FILES', 1000))
+BULK_MAX_EXTRACTED_BYTES = int(os.getenv('BULK_MAX_EXTRACTED_BYTES', 2 * 1024 ** 3))
+
+@app.before_request
+def start_request_logging():
+    """Tag the request's log records with its route and request ID, and decide whether to sample them."""
+    start_request(request.url_rule.rule if request.url_rule else 'unmatched', request.headers.get('X-Request-ID'))
+
+@app.before_request
+def check_shared_invalidations():
+    """Apply cache invalidations published by other worker processes."""
+    if shared_invalidations is not None:
+        shared_invalidations.check()
+
+@app.before_request
+def publish_shared_metrics():
+    """Make sure this worker publishes its metrics for scrapes of the other workers."""
+    if shared_metrics is not None:
+        shared_metrics.start()
+
+@app.before_request
+def start_request_metrics():
+    """Count the request as in flight and start its latency timer."""
+    g.request_started = time.perf_counter()
+    HTTP_IN_FLIGHT.inc()
+
+@app.after_request
+def record_request_metrics(response):
+    """Record the request's count, status and latency, labelled by route template."""
+    started = g.get('request_started')
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        HTTP_REQUESTS.inc(route=route, method=request.method, status=response.status_code)
+        if response.status_code >= 500:
+            HTTP_ERRORS.inc(route=route, method=request.method)
+        # For streamed responses this is the time until streaming starts
+        HTTP_LATENCY.observe(time.perf_counter() - started, route=route, method=request.method)
+    return response
+
+@app.teardown_request
+def finish_request_metrics(error=None):
+    if g.pop('request_started', None) is not None:
+        HTTP_IN_FLIGHT.dec()
+
+@app.teardown_request
+def finish_request_logging(error=None):
+    end_request()
+
+def all_cache_stats():
+    """Return the statistics of every cache, by name."""
+    return {
+        'retrieval': retrieval_cache.stats(),
+        'answers': answer_cache.stats(),
+        'indexes': index_cache.stats(),
+        'result_sets': search_result_sets.cache.stats(),
+        'chunk_texts': chunk_texts.cache.stats(),
+        'model_catalogue': model_catalogue.stats(),
+    }
+
+@metrics.collector
+def collect_cache_metrics():
+    """Expose cache and breaker state at scrape time."""
+    caches = all_cache_stats()
+    yield ('compass_web_cache_hits_total', 'counter', 'Cache hits.',
+           [({'cache': name}, stats['hits']) for name, stats in caches.items()])
+    yield ('compass_web_cache_misses_total', 'counter', 'Cache misses.',
+           [({'cache': name}, stats['misses']) for name, stats in caches.items()])
+    yield ('compass_web_cache_hit_ratio', 'gauge', 'Cache hits divided by lookups.',
+           [({'cache': name}, stats['hit_ratio']) for name, stats in caches.items()])
+    yield ('compass_web_cache_entries', 'gauge', 'Entries held by a cache.',
+           [({'cache': name}, stats['entries']) for name, stats in caches.items()])
+    yield ('compass_web_cache_bytes', 'gauge', 'Approximate bytes held by a cache.',
+           [({'cache': name}, stats['bytes']) for name, stats in caches.items() if 'bytes' in stats])
+    yield ('compass_web_circuit_open', 'gauge', '1 if the upstream circuit is open or half-open.',
+           [({'upstream': name}, int(breaker.state != 'closed')) for name, breaker in breakers.items()])
+
 # Routes
 @app.route('/')
 def home():
@@ -100,13 +400,7 @@ def home():
 def list_indexes():
     """List all indexes."""
     try:
-        client = get_compass_client()
-        response = client.list_indexes()
-        
-        if response.error:
-            return render_template('indexes.html', error=response.error)
-        
-        indexes = response.result.get("indexes", [])
+        indexes = index_cache.list()
         return render_template('indexes.html', indexes=indexes)
     except Exception as e:
         return render_template('indexes.html', error=str(e))
@@ -124,7 +418,9 @@ def create_index():
             )
             
             client = get_compass_client()
-            response = client.create_index(
+            response = call_with_retry(
+                client.create_index,
+                upstream='compass',
                 index_name=index_name,
                 index_config=config
             )
@@ -132,6 +428,7 @@ def create_index():
             if response.error:
                 return render_template('create_index.html', error=response.error)
             
+            invalidate_index_caches(index_name)
             return redirect(url_for('list_indexes'))
         except Exception as e:
             return render_template('create_index.html', error=str(e))
@@ -144,93 +441,41 @@ def view_index(index_name):
     try:
         client = get_compass_client()
         
-        # Get index details (not directly supported by the API, so we list all and filter)
-        list_response = client.list_indexes()
-        if list_response.error:
-            return render_template('view_index.html', error=list_response.error)
-        
-        indexes = list_response.result.get("indexes", [])
-        index = next((idx for idx in indexes if idx['name'] == index_name), None)
+        # Get index details from the cached index listing
+        index = index_cache.get(index_name)
         
         if not index:
             return render_template('view_index.html', error=f"Index '{index_name}' not found")
         
-        # Initialize documents list
+        # Pagination parameters (per_page is capped at 100, see the API spec)
+        page = max(request.args.get('page', 1, type=int), 1)
+        per_page = min(max(request.args.get('per_page', 20, type=int), 1), 100)
+        
         documents = []
+        has_next = False
         
         # Get documents if the index has any (only if count > 0)
         if index.get('count', 0) > 0:
             try:
-                # Method 1: Try common words first - this might work for most text documents
-                common_queries = ["the", "a", "in", "to", "and", "of", "is", "for", "on", "with"]
-                
-                for query in common_queries:
-                    search_response = client.search_documents(
-                        index_name=index_name, 
-                        query=query, 
-                        top_k=100
-                    )
-                    
-                    # Extract documents from hits array
-                    if hasattr(search_response, 'hits') and search_response.hits:
-                        documents = search_response.hits
-                        print(f"Found {len(documents)} documents from hits attribute")
-                        break
-                    elif not search_response.error and search_response.result:
-                        if hasattr(search_response.result, 'hits'):
-                            documents = search_response.result.hits
-                            print(f"Found {len(documents)} documents from result.hits")
-                            break
-                        else:
-                            documents = search_response.result.get("documents", [])
-                            if documents:
-                                print(f"Found {len(documents)} documents from result.documents")
-                                break
-                
-                # Method 2: If no documents found, try a broader approach
-                if not documents:
-                    # Try a query using a space character - some APIs treat this as a wildcard
-                    search_response = client.search_documents(
-                        index_name=index_name, 
-                        query=" ", 
-                        top_k=100
-                    )
-                    
-                    if hasattr(search_response, 'hits') and search_response.hits:
-                        documents = search_response.hits
-                    elif not search_response.error and search_response.result:
-                        if hasattr(search_response.result, 'hits'):
-                            documents = search_response.result.hits
-                        else:
-                            documents = search_response.result.get("documents", [])
-                
-                # Method 3: If still no documents, try with model_dump
-                if not documents and hasattr(search_response, 'model_dump'):
-                    try:
-                        dump = search_response.model_dump()
-                        if 'hits' in dump:
-                            documents = dump.get('hits', [])
-                        elif 'result' in dump and isinstance(dump['result'], dict):
-                            if 'hits' in dump['result']:
-                                documents = dump['result']['hits']
-                            elif 'documents' in dump['result']:
-                                documents = dump['result']['documents']
-                    except Exception as dump_error:
-                        print(f"Error dumping model: {dump_error}")
-                
-                # Log status for debugging
-                print(f"Documents found for index {index_name}: {len(documents)}")
-                
-            except Exception as search_error:
+                documents, has_next = document_manifests.page(
+                    client,
+                    index_name,
+                    page=page,
+                    per_page=per_page
+                )
+            except Exception as list_error:
                 # Just log the error but don't fail the entire page
-                print(f"Error listing documents: {search_error}")
+                log.warning('Error listing documents', index=index_name, error=str(list_error))
                 # We'll continue with an empty documents list
         
         return render_template(
             'view_index.html', 
             index=index, 
             index_name=index_name, 
-            documents=documents
+            documents=documents,
+            page=page,
+            per_page=per_page,
+            has_next=has_next
         )
     except Exception as e:
         return render_template('view_index.html', error=str(e))
@@ -242,109 +487,237 @@ def search_index(index_name):
         try:
             query = request.form.get('query', '')
             top_k = int(request.form.get('top_k', 10))
+            log.debug('Searching index', index=index_name, query=preview(query), top_k=top_k)
             
-            # Debug information
-            print(f"Searching index '{index_name}' for query: '{query}' with top_k: {top_k}")
-            
-            client = get_compass_client()
-            response = client.search_documents(
-                index_name=index_name,
-                query=query,
-                top_k=top_k
-            )
-            
-            # Print response information for debugging
-            print(f"Response type: {type(response)}")
-            if hasattr(response, '__dict__'):
-                print(f"Response attributes: {vars(response)}")
-            elif isinstance(response, dict):
-                print(f"Response keys: {response.keys()}")
-            
-            # Handle different response formats
-            if isinstance(response, dict) and response.get('error'):
-                return render_template(
-                    'search.html', 
-                    index_name=index_name, 
-                    error=response.get('error')
-                )
-            elif hasattr(response, 'error') and response.error:
-                return render_template(
-                    'search.html', 
-                    index_name=index_name, 
-                    error=response.error
-                )
-            
-            # Extract documents from the response using all possible patterns
-            documents = []
-            
-            # Primary extraction: from hits array
-            if hasattr(response, 'hits') and response.hits:
-                documents = response.hits
-                print(f"Extracted {len(documents)} documents from response.hits")
-            # Try all possible ways to extract documents
-            elif isinstance(response, dict):
-                if 'hits' in response:
-                    documents = response.get('hits', [])
-                elif 'documents' in response:
-                    documents = response.get('documents', [])
-                elif 'result' in response and isinstance(response['result'], dict):
-                    result = response['result']
-                    if 'documents' in result:
-                        documents = result.get('documents', [])
-                    elif 'hits' in result:
-                        documents = result.get('hits', [])
-            elif hasattr(response, 'result'):
-                if response.result:
-                    if isinstance(response.result, dict) and 'documents' in response.result:
-                        documents = response.result.get('documents', [])
-                    elif isinstance(response.result, dict) and 'hits' in response.result:
-                        documents = response.result.get('hits', [])
-                    elif hasattr(response.result, 'documents'):
-                        documents = response.result.documents
-                    elif hasattr(response.result, 'hits'):
-                        documents = response.result.hits
-            elif hasattr(response, 'documents'):
-                documents = response.documents
-            
-            # Additional attempt for nested structures
-            elif hasattr(response, 'results') and hasattr(response.results, 'documents'):
-                documents = response.results.documents
-            
-            # Debug document extraction
-            print(f"Found {len(documents)} documents in search results")
-            if not documents and hasattr(response, 'model_dump'):
-                # For Pydantic models, try using model_dump to see the structure
-                try:
-                    dump = response.model_dump()
-                    print(f"Response model dump: {dump}")
-                    # Try extraction from dumped model
-                    if 'hits' in dump:
-                        documents = dump.get('hits', [])
-                    elif 'documents' in dump:
-                        documents = dump.get('documents', [])
-                    elif 'result' in dump and isinstance(dump['result'], dict):
-                        if 'documents' in dump['result']:
-                            documents = dump['result'].get('documents', [])
-                        elif 'hits' in dump['result']:
-                            documents = dump['result'].get('hits', [])
-                except Exception as dump_error:
-                    print(f"Error dumping model: {dump_error}")
-            
-            return render_template(
-                'search.html', 
-                index_name=index_name, 
-                query=query, 
-                documents=documents
-            )
+            response = cached_search(index_name, query, top_k)
+            return render_search_results(index_name, query, response)
         except Exception as e:
-            print(f"Search error: {str(e)}")
+            log.warning('Search error', index=index_name, error=str(e))
             return render_template('search.html', index_name=index_name, error=str(e))
     
     return render_template('search.html', index_name=index_name)
 
+def render_search_results(index_name, query, response):
+    """Render the search page for a search response (shared with the async search route)."""
+    # Error responses
+    if isinstance(response, dict) and response.get('error'):
+        return render_template(
+            'search.html', 
+            index_name=index_name, 
+            error=response.get('error')
+        )
+    elif hasattr(response, 'error') and response.error:
+        return render_template(
+            'search.html', 
+            index_name=index_name, 
+            error=response.error
+        )
+    
+    documents = extract_hits(response)
+    log.debug('Search results', index=index_name, hits=len(documents))
+    if not documents:
+        debug_dump(log, 'Search response without hits', response, index=index_name)
+    
+    # Only the first page is rendered; the page fetches the rest as it scrolls
+    page = search_result_sets.first_page(index_name, query, chunk_texts.format_hits(documents, query))
+    return render_template(
+        'search.html', 
+        index_name=index_name, 
+        query=query, 
+        documents=page['results'],
+        next_cursor=page['next_cursor'],
+        total=page['total']
+    )
+
+@app.route('/indexes/<index_name>/search/results')
+def search_results_page(index_name):
+    """API endpoint returning the next page of a search's results."""
+    cursor = request.args.get('cursor')
+    if not cursor:
+        return jsonify({'success': False, 'error': 'A cursor is required'}), 400
+    try:
+        page = search_result_sets.next_page(index_name, cursor, request.args.get('limit', type=int))
+    except CursorError as e:
+        return jsonify({'success': False, 'error': str(e)}), e.status_code
+    
+    response = jsonify(dict(page, success=True))
+    # A cursor always names the same page of the same result set
+    response.headers['Cache-Control'] = 'private, max-age=60'
+    return response
+
+@app.route('/chunks/<handle>')
+def chunk_text(handle):
+    """API endpoint returning the full text behind a search or chat result's handle."""
+    text = chunk_texts.get(handle)
+    if text is None:
+        return jsonify({'success': False, 'error': 'This result has expired; please search again'}), 404
+    
+    response = jsonify({'success': True, 'handle': handle, 'text': text})
+    # A handle always names the same text
+    response.set_etag(handle)
+    response.headers['Cache-Control'] = f"private, max-age={int(chunk_texts.cache.ttl)}"
+    return response.make_conditional(request)
+
+def build_parser_config(pdf_parsing_strategy, chunk_size, chunk_overlap):
+    """Build the parser config for the parsing strategy and chunking chosen on the upload form."""
+    if pdf_parsing_strategy == 'image_to_markdown':
+        return ParserConfig(
+            pdf_parsing_strategy=PDFParsingStrategy.ImageToMarkdown,
+            num_tokens_per_chunk=chunk_size,
+            num_tokens_overlap=chunk_overlap
+        )
+    elif pdf_parsing_strategy == 'text_extraction':
+        return ParserConfig(
+            pdf_parsing_strategy=PDFParsingStrategy.QuickText,  # QuickText is the text extraction option
+            num_tokens_per_chunk=chunk_size,
+            num_tokens_overlap=chunk_overlap
+        )
+    # Default option
+    return ParserConfig(
+        num_tokens_per_chunk=chunk_size,
+        num_tokens_overlap=chunk_overlap
+    )
+
+@job_queue.handler('upload')
+def run_upload_job(job):
+    """Parse (optionally) and insert an uploaded document in the background."""
+    params = job.params
+    index_name = params['index_name']
+    filename = params['filename']
+    content_type = params['content_type']
+    document_id = params['document_id']
+    spooled_path = os.path.join(job.workspace, params['spooled_name'])
+    
+    with open(spooled_path, 'rb') as spooled_file:
+        file_bytes = spooled_file.read()
+    
+    if params['advanced_settings']:
+        parser_config = build_parser_config(
+            params['pdf_parsing_strategy'],
+            params['chunk_size'],
+            params['chunk_overlap']
+        )
+        
+        # Use the shared parser client and pass our custom config per call
+        parser_client = get_parser_client()
+        
+        job.progress('parsing')
+        parse_started = time.perf_counter()
+        
+        # Parse only this upload, straight from the bytes already spooled to the
+        # job's own workspace (which the job queue removes when the job ends)
+        try:
+            parsed_docs = call_with_retry(
+                parser_client.process_file_bytes,
+                upstream='parser',
+                filename=filename,
+                file_bytes=file_bytes,
+                # The job's document ID, so a job resumed after a restart (or a
+                # retried insert) puts the same documents instead of duplicates
+                file_id=document_id,
+                # Let the parser detect the type when the browser didn't know it
+                content_type=None if content_type == 'application/octet-stream' else content_type,
+                parser_config=parser_config
+            )
+        except Exception as parser_error:
+            parse_ms = (time.perf_counter() - parse_started) * 1000
+            log.warning('Failed to parse upload', filename=filename, error=str(parser_error))
+            job.file_result(filename, 'failed', error=str(parser_error), parse=parse_ms)
+            raise RuntimeError(f"Parser error: {parser_error}")
+        parse_ms = (time.perf_counter() - parse_started) * 1000
+        
+        if not parsed_docs:
+            job.file_result(filename, 'failed', error="No documents were parsed", parse=parse_ms)
+            raise RuntimeError("No documents were successfully parsed")
+        
+        # Upload using insert_docs
+        job.progress('inserting', documents=len(parsed_docs))
+        insert_started = time.perf_counter()
+        client = get_compass_client()
+        # Re-inserting on a retry is safe: documents are put by ID
+        errors = call_with_retry(
+            lambda: client.insert_docs(index_name=index_name, docs=iter(parsed_docs)),
+            upstream='compass',
+            operation='insert_docs',
+            retry_on_result=bool
+        )
+        insert_ms = (time.perf_counter() - insert_started) * 1000
+        
+        log.info('Document uploaded', index=index_name, filename=filename, documents=len(parsed_docs), errors=preview(errors))
+        if errors:
+            job.file_result(filename, 'failed', error=str(errors), parse=parse_ms, insert=insert_ms)
+            raise RuntimeError(f"Failed to insert documents: {errors}")
+        job.file_result(filename, 'succeeded', parse=parse_ms, insert=insert_ms)
+        
+        uploaded_docs = [
+            {
+                'document_id': doc.metadata.document_id,
+                'path': doc.metadata.filename,
+                'chunks': len(doc.chunks)
+            }
+            for doc in parsed_docs
+        ]
+    else:
+        # Use standard upload_document
+        job.progress('uploading')
+        upload_started = time.perf_counter()
+        client = get_compass_client()
+        response = call_with_retry(
+            client.upload_document,
+            upstream='compass',
+            index_name=index_name,
+            filename=filename,
+            filebytes=file_bytes,
+            content_type=content_type,
+            document_id=document_id
+        )
+        upload_ms = (time.perf_counter() - upload_started) * 1000
+        
+        # Check for error in response - handling both object and dictionary formats
+        error = None
+        if isinstance(response, dict) and response.get('error'):
+            error = response.get('error')
+        elif hasattr(response, 'error') and response.error:
+            error = response.error
+        elif isinstance(response, str):
+            # upload_document returns the error message as a string on failure
+            error = response
+        if error:
+            job.file_result(filename, 'failed', error=str(error), upload=upload_ms)
+            raise RuntimeError(error)
+        job.file_result(filename, 'succeeded', upload=upload_ms)
+        
+        uploaded_docs = [{'document_id': document_id, 'path': filename}]
+    
+    # Document counts and search results have changed
+    invalidate_index_caches(index_name, manifests=False)
+    document_manifests.add(index_name, uploaded_docs)
+    
+    return {'documents': uploaded_docs}
+
+def wants_json():
+    """Return whether the client prefers a JSON response over HTML."""
+    best = request.accept_mimetypes.best_match(['application/json', 'text/html'])
+    return best == 'application/json' and request.accept_mimetypes[best] > request.accept_mimetypes['text/html']
+
+def upload_job_params(index_name, filename, content_type, options):
+    """Build an upload job's parameters from the upload form (or its JSON equivalent)."""
+    return {
+        'index_name': index_name,
+        'filename': filename,
+        'spooled_name': secure_filename(filename) or 'document',
+        'content_type': content_type or 'application/octet-stream',
+        'document_id': str(uuid.uuid4()),
+        # A checkbox in the form, a boolean in JSON
+        'advanced_settings': bool(options.get('advanced_settings')),
+        'pdf_parsing_strategy': options.get('pdf_parsing_strategy', 'default'),
+        'chunk_size': int(options.get('chunk_size', 1000)),
+        'chunk_overlap': int(options.get('chunk_overlap', 200))
+    }
+
 @app.route('/indexes/<index_name>/upload', methods=['GET', 'POST'])
 def upload_document(index_name):
-    """Upload a document to an index."""
+    """Queue a document upload to an index and return its job ID."""
     if request.method == 'POST':
         try:
             # Check if file was uploaded
@@ -363,141 +736,294 @@ def upload_document(index_name):
                     error="No file selected"
                 )
             
-            # Read the file
-            file_bytes = file.read()
-            filename = file.filename
-            content_type = file.content_type or 'application/octet-stream'
-            document_id = str(uuid.uuid4())
-            
-            # Check if advanced settings are enabled
-            use_advanced_settings = 'advanced_settings' in request.form
+            params = upload_job_params(index_name, file.filename, file.content_type, request.form)
             
-            if use_advanced_settings:
-                # Get parsing settings
-                pdf_parsing_strategy = request.form.get('pdf_parsing_strategy', 'default')
-                chunk_size = int(request.form.get('chunk_size', 1000))
-                chunk_overlap = int(request.form.get('chunk_overlap', 200))
-                
-                # Create temporary folder for the file
-                temp_dir = "/tmp/compass_uploads"
-                os.makedirs(temp_dir, exist_ok=True)
-                temp_file_path = os.path.join(temp_dir, filename)
-                with open(temp_file_path, 'wb') as temp_file:
-                    temp_file.write(file_bytes)
-                
-                # Setup parser config based on parsing strategy
-                if pdf_parsing_strategy == 'image_to_markdown':
-                    parser_config = ParserConfig(
-                        pdf_parsing_strategy=PDFParsingStrategy.ImageToMarkdown,
-                        num_tokens_per_chunk=chunk_size,
-                        num_tokens_overlap=chunk_overlap
-                    )
-                elif pdf_parsing_strategy == 'text_extraction':
-                    parser_config = ParserConfig(
-                        pdf_parsing_strategy=PDFParsingStrategy.QuickText,  # QuickText is the text extraction option
-                        num_tokens_per_chunk=chunk_size,
-                        num_tokens_overlap=chunk_overlap
-                    )
-                else:
-                    # Default option
-                    parser_config = ParserConfig(
-                        num_tokens_per_chunk=chunk_size,
-                        num_tokens_overlap=chunk_overlap
-                    )
-                
-                try:
-                    # Create a new parser client with our custom config
-                    parser_client = CompassParserClient(
-                        parser_url=os.getenv("COMPASS_PARSER_URL"),
-                        bearer_token=os.getenv("COMPASS_PARSER_BEARER_TOKEN"),
-                        parser_config=parser_config
-                    )
-                    
-                    # Process files in the directory (since the SDK doesn't seem to have a direct process_file method)
-                    # Create a temporary folder and place our file there
-                    parsed_docs = []
-                    
-                    # Use process_folder since that's what's used in the create_index.py example
-                    response = parser_client.process_folder(folder_path=temp_dir)
-                    
-                    for doc in response:
-                        if isinstance(doc, tuple):
-                            # This is an error tuple (filename, exception)
-                            filename, ex = doc
-                            print(f"Failed to parse {filename}: {ex}")
-                        else:
-                            # This is a valid CompassDocument
-                            parsed_docs.append(doc)
-                    
-                    # Clean up temp directory
-                    if os.path.exists(temp_file_path):
-                        os.remove(temp_file_path)
-                    
-                    if not parsed_docs:
-                        return render_template(
-                            'upload.html',
-                            index_name=index_name,
-                            error="No documents were successfully parsed"
-                        )
-                    
-                    # Upload using insert_docs
-                    client = get_compass_client()
-                    response = client.insert_docs(
-                        index_name=index_name,
-                        docs=iter(parsed_docs)
-                    )
-                    
-                    print(f"Document uploaded with advanced parsing. Response: {response}")
-                    
-                except Exception as parser_error:
-                    # Log the full error for debugging
-                    import traceback
-                    print(f"Parser error: {str(parser_error)}")
-                    print(traceback.format_exc())
-                    
-                    # Try to clean up temp file if it exists
-                    try:
-                        if os.path.exists(temp_file_path):
-                            os.remove(temp_file_path)
-                    except:
-                        pass
-                    
-                    return render_template(
-                        'upload.html',
-                        index_name=index_name,
-                        error=f"Parser error: {str(parser_error)}"
-                    )
-            else:
-                # Use standard upload_document
-                client = get_compass_client()
-                response = client.upload_document(
-                    index_name=index_name,
-                    filename=filename,
-                    filebytes=file_bytes,
-                    content_type=content_type,
-                    document_id=document_id
-                )
-            
-            # Check for error in response - handling both object and dictionary formats
-            if isinstance(response, dict) and response.get('error'):
-                return render_template(
-                    'upload.html', 
-                    index_name=index_name, 
-                    error=response.get('error')
-                )
-            elif hasattr(response, 'error') and response.error:
-                return render_template(
-                    'upload.html', 
-                    index_name=index_name, 
-                    error=response.error
-                )
+            # Spool the upload to the job's workspace so it survives a restart
+            job_id = job_queue.create('upload', params)
+            try:
+                file.save(os.path.join(job_queue.workspace(job_id), params['spooled_name']))
+            except Exception:
+                # Don't leave a queued job behind without its input
+                job_queue.discard(job_id)
+                raise
+            job_queue.enqueue(job_id)
             
-            return redirect(url_for('view_index', index_name=index_name))
+            if wants_json():
+                return jsonify({
+                    'job_id': job_id,
+                    'status_url': url_for('job_status', job_id=job_id)
+                }), 202
+            return render_template('upload.html', index_name=index_name, job_id=job_id)
+        except QueueFullError as e:
+            return render_template('upload.html', index_name=index_name, error=str(e)), 503
         except Exception as e:
             return render_template('upload.html', index_name=index_name, error=str(e))
     
     return render_template('upload.html', index_name=index_name)
 
+@job_queue.handler('bulk_upload')
+def run_bulk_upload_job(job):
+    """Parse many uploaded files (and archive contents) in parallel and insert them in batches."""
+    params = job.params
+    index_name = params['index_name']
+    files_dir = os.path.join(job.workspace, 'files')
+    
+    # Unpack archives next to the plain files, each into its own folder. The
+    # limits are checked before each archive is extracted; plain files are the
+    # ones directly in files_dir (archives unpack into subfolders)
+    job.progress('extracting')
+    remaining_files = BULK_MAX_FILES - sum(
+        1 for entry in os.scandir(files_dir) if entry.is_file()
+    )
+    remaining_bytes = BULK_MAX_EXTRACTED_BYTES
+    for archive_name in params['archives']:
+        extracted_files, extracted_bytes = extract_archive(
+            os.path.join(job.workspace, 'archives', archive_name),
+            os.path.join(files_dir, archive_name),
+            max_files=max(remaining_files, 0),
+            max_bytes=remaining_bytes
+        )
+        remaining_files -= extracted_files
+        remaining_bytes -= extracted_bytes
+    
+    files = collect_files(files_dir)
+    if not files:
+        raise RuntimeError("No files to upload")
+    if len(files) > BULK_MAX_FILES:
+        raise RuntimeError(f"Too many files: {len(files)} (the limit is {BULK_MAX_FILES})")
+    
+    parser_client = get_parser_client()
+    client = get_compass_client()
+    parser_config = build_parser_config(
+        params['pdf_parsing_strategy'],
+        params['chunk_size'],
+        params['chunk_overlap']
+    )
+    
+    def parse(path):
+        with open(path, 'rb') as f:
+            file_bytes = f.read()
+        filename = os.path.relpath(path, files_dir)
+        return call_with_retry(
+            parser_client.process_file_bytes,
+            upstream='parser',
+            filename=filename,
+            file_bytes=file_bytes,
+            # Stable per job and file, so a job resumed after a restart
+            # re-inserts the same documents instead of duplicating them
+            file_id=str(uuid.uuid5(uuid.NAMESPACE_URL, f'{job.id}/{filename}')),
+            parser_config=parser_config
+        )
+    
+    uploaded_docs = []
+    
+    def insert(docs):
+        errors = call_with_retry(
+            lambda: client.insert_docs(index_name=index_name, docs=iter(docs)),
+            upstream='compass',
+            operation='insert_docs',
+            retry_on_result=bool
+        )
+        failed_ids = {document_id for error in errors or [] for document_id in error}
+        uploaded_docs.extend(
+            {
+                'document_id': doc.metadata.document_id,
+                'path': doc.metadata.filename,
+                'chunks': len(doc.chunks)
+            }
+            for doc in docs if doc.metadata.document_id not in failed_ids
+        )
+        return errors
+    
+    try:
+        manifest, stats = ingest_files(
+            files,
+            parse,
+            insert,
+            workers=params['workers'],
+            batch_size=params['batch_size'],
+            on_progress=lambda stats: job.progress('ingesting', **stats)
+        )
+    finally:
+        # Whatever was inserted before a failure is already searchable
+        if uploaded_docs:
+            invalidate_index_caches(index_name)
+            document_manifests.add(index_name, uploaded_docs)
+    
+    job.file_results(
+        {
+            'filename': os.path.relpath(path, files_dir),
+            'status': entry['status'],
+            'error': entry['error'],
+            'documents': entry['documents'],
+            'parse': entry['parse_ms']
+        }
+        for path, entry in manifest.items()
+    )
+    log.info('Bulk upload finished', index=index_name, **stats)
+    
+    if not stats['documents_inserted']:
+        raise RuntimeError("No documents were successfully uploaded")
+    return stats
+
+@app.route('/indexes/<index_name>/bulk-upload', methods=['POST'])
+def bulk_upload_documents(index_name):
+    """Queue a bulk upload of many files and/or zip/tar archives to an index."""
+    # Parsing stops at this many form parts (the files plus a few other fields),
+    # so an upload with too many files is turned away before the rest are spooled
+    request.max_form_parts = BULK_MAX_FILES + 16
+    try:
+        try:
+            files = [f for f in request.files.getlist('documents') if f.filename]
+        except RequestEntityTooLarge:
+            files = None
+        if files is None or len(files) > BULK_MAX_FILES:
+            error = f"Too many files (the limit is {BULK_MAX_FILES})"
+            if wants_json():
+                return jsonify({"error": error}), 413
+            return render_template('upload.html', index_name=index_name, error=error), 413
+        if not files:
+            error = "No files selected"
+            if wants_json():
+                return jsonify({"error": error}), 400
+            return render_template('upload.html', index_name=index_name, error=error)
+        
+        # Give every upload a unique, safe name in the job's workspace
+        spooled_names = []
+        for i, file in enumerate(files):
+            name = secure_filename(file.filename) or f'document-{i}'
+            if name in spooled_names:
+                name = f'{i}-{name}'
+            spooled_names.append(name)
+        
+        workers = int(request.form.get('workers', BULK_PARSE_WORKERS))
+        batch_size = int(request.form.get('batch_size', BULK_INSERT_BATCH_SIZE))
+        params = {
+            'index_name': index_name,
+            'archives': [name for name in spooled_names if is_archive(name)],
+            'workers': max(1, min(workers, BULK_MAX_PARSE_WORKERS)),
+            'batch_size': max(1, min(batch_size, BULK_MAX_INSERT_BATCH_SIZE)),
+            'pdf_parsing_strategy': request.form.get('pdf_parsing_strategy', 'default'),
+            'chunk_size': int(request.form.get('chunk_size', 1000)),
+            'chunk_overlap': int(request.form.get('chunk_overlap', 200))
+        }
+        
+        # Spool plain files and archives separately; archives are unpacked by the job
+        job_id = job_queue.create('bulk_upload', params)
+        workspace = job_queue.workspace(job_id)
+        try:
+            for folder in ('files', 'archives'):
+                os.makedirs(os.path.join(workspace, folder), exist_ok=True)
+            for file, name in zip(files, spooled_names):
+                folder = 'archives' if is_archive(name) else 'files'
+                file.save(os.path.join(workspace, folder, name))
+        except Exception:
+            # Don't leave a queued job behind without its input
+            job_queue.discard(job_id)
+            raise
+        job_queue.enqueue(job_id)
+        
+        if wants_json():
+            return jsonify({
+                'job_id': job_id,
+                'status_url': url_for('job_status', job_id=job_id)
+            }), 202
+        return render_template('upload.html', index_name=index_name, job_id=job_id)
+    except QueueFullError as e:
+        if wants_json():
+            return jsonify({"error": str(e)}), 503
+        return render_template('upload.html', index_name=index_name, error=str(e)), 503
+    except Exception as e:
+        if wants_json():
+            return jsonify({"error": str(e)}), 500
+        return render_template('upload.html', index_name=index_name, error=str(e))
+
+@app.route('/indexes/<index_name>/uploads', methods=['POST'])
+def start_chunked_upload(index_name):
+    """Start a resumable upload; the file is then sent in chunks and completed."""
+    data = request.get_json(silent=True) or {}
+    try:
+        status = chunked_uploads.create(
+            data.get('filename'),
+            data.get('size', 0),
+            content_type=data.get('content_type'),
+            chunk_size=data.get('chunk_size'),
+            sha256=data.get('sha256'),
+            index_name=index_name
+        )
+    except UploadError as e:
+        return jsonify({"error": str(e)}), e.status_code
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": f"Invalid upload: {e}"}), 400
+    return jsonify(status), 201
+
+@app.route('/uploads/<upload_id>')
+def chunked_upload_status(upload_id):
+    """Report which chunks of a resumable upload have been received."""
+    try:
+        return jsonify(chunked_uploads.status(upload_id))
+    except UploadError as e:
+        return jsonify({"error": str(e)}), e.status_code
+
+@app.route('/uploads/<upload_id>/chunks/<int:index>', methods=['PUT'])
+def upload_chunk(upload_id, index):
+    """Receive one chunk as the raw request body, checked against X-Chunk-SHA256."""
+    if request.content_length and request.content_length > chunked_uploads.max_chunk_size:
+        return jsonify({"error": "Chunk is too large"}), 413
+    try:
+        status = chunked_uploads.write_chunk(
+            upload_id,
+            index,
+            request.stream,
+            sha256=request.headers.get('X-Chunk-SHA256')
+        )
+    except UploadError as e:
+        return jsonify({"error": str(e)}), e.status_code
+    return jsonify(status)
+
+@app.route('/uploads/<upload_id>/complete', methods=['POST'])
+def complete_chunked_upload(upload_id):
+    """Hand a fully received upload to a background upload job."""
+    try:
+        # Holds the upload's lock, so a concurrent completion of the same
+        # upload waits and then gets a 404 instead of a second job
+        with chunked_uploads.complete(upload_id) as (record, data_path):
+            params = upload_job_params(
+                record['index_name'],
+                record['filename'],
+                record['content_type'],
+                request.get_json(silent=True) or {}
+            )
+            job_id = job_queue.create('upload', params)
+            try:
+                # Move (not copy) the assembled file into the job's workspace
+                shutil.move(data_path, os.path.join(job_queue.workspace(job_id), params['spooled_name']))
+            except Exception:
+                # The upload is kept, so completing it can be retried
+                job_queue.discard(job_id)
+                raise
+    except UploadError as e:
+        return jsonify({"error": str(e)}), e.status_code
+    except QueueFullError as e:
+        return jsonify({"error": str(e)}), 503
+    except Exception as e:
+        log.exception('Error completing chunked upload', upload_id=upload_id)
+        return jsonify({"error": str(e)}), 500
+    
+    job_queue.enqueue(job_id)
+    return jsonify({
+        'job_id': job_id,
+        'status_url': url_for('job_status', job_id=job_id)
+    }), 202
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    """API endpoint reporting a background job's status, progress, per-file results and timings."""
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({"error": f"Job '{job_id}' not found"}), 404
+    return jsonify(job)
+
 @app.route('/api-explorer')
 def api_explorer():
     """Render the API explorer page."""
@@ -609,75 +1135,159 @@ def api_explorer():
     
     return render_template('api_explorer.html', api_methods=api_methods)
 
+def execute_api_call(call):
+    """
+    Run one API explorer call (``client_type``, ``method``, ``params`` and
+    ``max_retries``) and return ``(result, error, status_code)``.
+    """
+    client_type = call.get('client_type')
+    method_name = call.get('method')
+    params = call.get('params', {})
+    # Retries follow the shared backoff policy; callers can only lower the count
+    # (sleep_retry_seconds is accepted for compatibility but ignored)
+    max_retries = max(0, int(call.get('max_retries', 3)))
+    
+    if not client_type or not method_name:
+        return None, "Missing client_type or method", 400
+    
+    # Get the appropriate client
+    if client_type == 'compass':
+        client = get_compass_client()
+    elif client_type == 'parser':
+        client = get_parser_client()
+    else:
+        return None, f"Unknown client type: {client_type}", 400
+    
+    # Get the method from the client
+    if not hasattr(client, method_name):
+        return None, f"Method '{method_name}' not found on {client_type} client", 400
+    
+    method = getattr(client, method_name)
+    
+    # Call the method with retries
+    try:
+        result = call_with_retry(
+            lambda: method(**params),
+            upstream=client_type,
+            operation=method_name,
+            max_attempts=max_retries + 1
+        )
+    except CircuitOpenError as e:
+        return None, str(e), 503
+    except Exception as e:
+        return None, str(e), 500
+    
+    # Calls that change indexes invalidate the cached index listing
+    if method_name in INDEX_MUTATING_METHODS:
+        invalidate_index_caches(params.get('index_name'))
+    
+    # Convert the result to a JSON-serializable format
+    if hasattr(result, 'model_dump'):
+        # For Pydantic models
+        result_dict = result.model_dump()
+    elif hasattr(result, '__dict__'):
+        # For other objects
+        result_dict = result.__dict__
+    else:
+        # For primitive types
+        result_dict = result
+    
+    return result_dict, None, 200
+
+# Batched API calls share one bounded pool so a large batch cannot exhaust threads
+API_BATCH_MAX_WORKERS = int(os.getenv('API_BATCH_MAX_WORKERS', 8))
+API_BATCH_MAX_CALLS = int(os.getenv('API_BATCH_MAX_CALLS', 100))
+api_batch_executor = ThreadPoolExecutor(max_workers=API_BATCH_MAX_WORKERS, thread_name_prefix='api-batch')
+
+def run_batch_call(index, call):
+    """Run one call of a batch and return its result entry serialized as JSON."""
+    started = time.perf_counter()
+    try:
+        result, error, status = execute_api_call(call if isinstance(call, dict) else {})
+    except Exception as e:
+        result, error, status = None, str(e), 500
+    entry = {
+        'index': index,
+        'status': status,
+        'result': result,
+        'error': error,
+        'elapsed_ms': round((time.perf_counter() - started) * 1000, 1)
+    }
+    try:
+        return app.json.dumps(entry)
+    except TypeError as e:
+        entry.update(result=None, error=f"Result is not JSON serializable: {e}", status=500)
+        return app.json.dumps(entry)
+
+def api_call_batch(calls, stream=False):
+    """Run a batch of API calls concurrently, returning all results at once or as NDJSON."""
+    started = time.perf_counter()
+    # The calls share this request's deadline on the pool threads
+    run_call = carry_deadline(run_batch_call)
+    futures = [api_batch_executor.submit(run_call, i, call) for i, call in enumerate(calls)]
+    
+    if stream:
+        def generate():
+            # One line per call, in completion order, then a summary line
+            for future in as_completed(futures):
+                yield future.result() + '\n'
+            yield app.json.dumps({
+                'done': True,
+                'elapsed_ms': round((time.perf_counter() - started) * 1000, 1)
+            }) + '\n'
+        return Response(generate(), mimetype='application/x-ndjson')
+    
+    # Results in request order; entries are already serialized
+    lines = [future.result() for future in futures]
+    elapsed_ms = round((time.perf_counter() - started) * 1000, 1)
+    body = '{"results": [' + ', '.join(lines) + '], "elapsed_ms": ' + json.dumps(elapsed_ms) + '}'
+    return Response(body, mimetype='application/json')
+
 @app.route('/api/call', methods=['POST'])
 def api_call():
-    """Make a dynamic API call based on user input."""
+    """Make a dynamic API call (or a batch of calls) based on user input."""
     try:
         data = request.get_json()
         if not data:
             return jsonify({"error": "Invalid request"}), 400
         
-        client_type = data.get('client_type')
-        method_name = data.get('method')
-        params = data.get('params', {})
-        max_retries = data.get('max_retries', 3)
-        sleep_retry_seconds = data.get('sleep_retry_seconds', 1)
-        
-        if not client_type or not method_name:
-            return jsonify({"error": "Missing client_type or method"}), 400
-        
-        # Get the appropriate client
-        if client_type == 'compass':
-            client = get_compass_client()
-        elif client_type == 'parser':
-            client = get_parser_client()
-        else:
-            return jsonify({"error": f"Unknown client type: {client_type}"}), 400
-        
-        # Get the method from the client
-        if not hasattr(client, method_name):
-            return jsonify({"error": f"Method '{method_name}' not found on {client_type} client"}), 400
-        
-        method = getattr(client, method_name)
-        
-        # Function to call the method with retries
-        def call_with_retries(method, params, max_retries, sleep_seconds):
-            import time
-            retry_count = 0
-            last_error = None
-            
-            while retry_count <= max_retries:
-                try:
-                    return method(**params), None
-                except Exception as e:
-                    last_error = e
-                    retry_count += 1
-                    if retry_count <= max_retries:
-                        time.sleep(sleep_seconds)
-            
-            return None, str(last_error)
-        
-        # Call the method with retries
-        result, error = call_with_retries(method, params, max_retries, sleep_retry_seconds)
+        if 'calls' in data:
+            calls = data['calls']
+            if not isinstance(calls, list) or not calls:
+                return jsonify({"error": "'calls' must be a non-empty list"}), 400
+            if len(calls) > API_BATCH_MAX_CALLS:
+                return jsonify({"error": f"Too many calls: {len(calls)} (the limit is {API_BATCH_MAX_CALLS})"}), 400
+            return api_call_batch(calls, stream=bool(data.get('stream')))
         
+        result, error, status = execute_api_call(data)
         if error:
-            return jsonify({"error": error}), 500
-        
-        # Convert the result to a JSON-serializable format
-        if hasattr(result, 'model_dump'):
-            # For Pydantic models
-            result_dict = result.model_dump()
-        elif hasattr(result, '__dict__'):
-            # For other objects
-            result_dict = result.__dict__
-        else:
-            # For primitive types
-            result_dict = result
-        
-        return jsonify({"result": result_dict})
+            return jsonify({"error": error}), status
+        return jsonify({"result": result})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@app.route('/metrics')
+def prometheus_metrics():
+    """Expose request, upstream, chat and cache metrics in the Prometheus text format."""
+    families = shared_metrics.families() if shared_metrics is not None else None
+    return Response(metrics.render(families), mimetype='text/plain; version=0.0.4')
+
+@app.route('/health')
+def health():
+    """Report the circuit breaker state of each upstream and the retry budget."""
+    upstreams = {name: breaker.stats() for name, breaker in breakers.items()}
+    degraded = any(stats['state'] != 'closed' for stats in upstreams.values())
+    return jsonify({
+        'status': 'degraded' if degraded else 'ok',
+        'upstreams': upstreams,
+        'retry_budget': retry_budget.stats()
+    })
+
+@app.route('/api/cache/stats')
+def cache_stats():
+    """API endpoint reporting cache hit/miss statistics (of this worker process)."""
+    return jsonify(all_cache_stats())
+
 @app.route('/docs')
 def documentation():
     """Render the documentation page."""
@@ -687,13 +1297,7 @@ def documentation():
 def chat_home():
     """Render the chat interface with index selection."""
     try:
-        client = get_compass_client()
-        response = client.list_indexes()
-        
-        if response.error:
-            return render_template('chat.html', error=response.error, indexes=[])
-        
-        indexes = response.result.get("indexes", [])
+        indexes = index_cache.list()
         settings = load_settings()
         return render_template('chat.html', indexes=indexes, settings=settings)
     except Exception as e:
@@ -704,14 +1308,8 @@ def chat_with_index(index_name):
     """Render the chat interface for a specific index."""
     try:
         # Check if the index exists
-        client = get_compass_client()
-        list_response = client.list_indexes()
-        
-        if list_response.error:
-            return render_template('chat.html', index_name=index_name, error=list_response.error, indexes=[])
-        
-        indexes = list_response.result.get("indexes", [])
-        index = next((idx for idx in indexes if idx['name'] == index_name), None)
+        indexes = index_cache.list()
+        index = index_cache.get(index_name)
         
         if not index:
             return render_template('chat.html', error=f"Index '{index_name}' not found", indexes=indexes)
@@ -721,6 +1319,252 @@ def chat_with_index(index_name):
     except Exception as e:
         return render_template('chat.html', index_name=index_name, error=str(e), indexes=[])
 
+# Chat helpers
+DEFAULT_CHAT_MODEL = "command-a-03-2025"
+
+# Cohere's SDK retries on its own by default; calls wrapped in call_with_retry
+# turn that off so the shared policy is the only one retrying
+NO_SDK_RETRIES = {'max_retries': 0}
+
+# Chat retrieval over-fetches; the context builder then keeps the best,
+# non-duplicate passages that fit the model's token budget
+CHAT_RETRIEVAL_TOP_K = int(os.getenv('CHAT_RETRIEVAL_TOP_K', 20))
+context_builder = ContextBuilder(
+    max_tokens=int(os.getenv('CHAT_CONTEXT_MAX_TOKENS', 6000)),
+    response_tokens=int(os.getenv('CHAT_RESPONSE_TOKENS', 2048)),
+    default_context_length=int(os.getenv('CHAT_DEFAULT_CONTEXT_LENGTH', 128000)),
+    duplicate_threshold=float(os.getenv('CHAT_DUPLICATE_THRESHOLD', 0.8)),
+    chars_per_token=float(os.getenv('CHAT_CHARS_PER_TOKEN', 3.5))
+)
+
+def chat_api_key(settings):
+    """Return the Cohere API key for chat (settings first, then the environment), or None."""
+    return settings.get('cohere_api_key') or app.config.get('COHERE_API_KEY')
+
+def get_chat_client(settings):
+    """Return the shared Cohere v2 client for chat, or None if no API key is configured."""
+    cohere_api_key = chat_api_key(settings)
+    if not cohere_api_key:
+        return None
+    return registry.cohere_v2(cohere_api_key)
+
+def search_index_hits(index_name, prompt, top_k=CHAT_RETRIEVAL_TOP_K):
+    """Search a single index with the chat prompt and return its hits."""
+    return extract_hits(cached_search(index_name, prompt, top_k))
+
+def search_for_chat(index_names, prompt, top_k=CHAT_RETRIEVAL_TOP_K):
+    """Search one or more indexes in parallel and return the merged hits used as context."""
+    return search_indexes(
+        lambda index_name: search_index_hits(index_name, prompt, top_k),
+        index_names,
+        top_k
+    )
+
+def requested_index_names(data):
+    """Return the index names from a chat request (``index_names`` list or ``index_name``)."""
+    index_names = data.get('index_names') or [data.get('index_name')]
+    if isinstance(index_names, str):
+        index_names = [index_names]
+    # De-duplicate while keeping the requested order
+    return list(dict.fromkeys(name for name in index_names if isinstance(name, str) and name))
+
+def chat_context(api_key, chat_model, prompt, search_results):
+    """Pack the retrieved hits into the chat model's context budget and record its size."""
+    # Never wait for the model listing; until it is loaded the default context length applies
+    model = model_catalogue.peek(api_key, chat_model)
+    context = context_builder.build(search_results, prompt, context_length=model['context_length'] if model else None)
+    CHAT_CONTEXT_TOKENS.observe(context.tokens)
+    if context.duplicates:
+        CHAT_CONTEXT_PASSAGES_DROPPED.inc(context.duplicates, reason='duplicate')
+    if context.over_budget:
+        CHAT_CONTEXT_PASSAGES_DROPPED.inc(context.over_budget, reason='over_budget')
+    log.debug(
+        'Chat context', model=chat_model, budget=context.budget, tokens=context.tokens,
+        passages=len(context.passages), candidates=context.candidates,
+        duplicates=context.duplicates, over_budget=context.over_budget
+    )
+    return context
+
+def format_search_results(search_results, prompt):
+    """Format search hits for a JSON response as snippets with handles for their full text."""
+    return chunk_texts.format_hits(search_results, prompt)
+
+def generate_chat(prompt, index_names):
+    """Run retrieval and a blocking chat generation, returning the JSON response."""
+    # Get settings
+    settings = load_settings()
+    
+    co = get_chat_client(settings)
+    if co is None:
+        return jsonify({
+            'success': False, 
+            'error': 'Cohere API Key is not configured. Please configure it in Settings.'
+        }), 500
+    
+    # Get the model from settings or use default
+    chat_model = settings.get('chat_model') or DEFAULT_CHAT_MODEL
+    
+    # Search the indexes with the prompt and pack the hits into the model's budget
+    search_results = search_for_chat(index_names, prompt)
+    context = chat_context(chat_api_key(settings), chat_model, prompt, search_results)
+    documents = context.documents
+    
+    # Serve repeated prompts over unchanged context from the answer cache
+    use_answer_cache = answer_cache_enabled(settings)
+    cache_key = answer_cache_key(chat_model, prompt, search_results)
+    answer = answer_cache.get(cache_key) if use_answer_cache else None
+    cached = answer is not None
+    
+    if not cached:
+        # Generate response using Cohere chat API V2 with search results as context
+        chat_response = call_with_retry(
+            co.chat,
+            upstream='cohere',
+            model=chat_model,
+            messages=[{"role": "user", "content": prompt}],
+            documents=documents if documents else None,
+            request_options=NO_SDK_RETRIES
+        )
+        answer = chat_response.message.content[0].text
+        if use_answer_cache:
+            answer_cache.set(cache_key, answer, tags=index_names)
+    
+    return jsonify({
+        'success': True,
+        'response': answer,
+        'search_results': format_search_results(context.hits, prompt),
+        'model_used': chat_model,
+        'context_tokens': context.tokens,
+        'cached': cached
+    })
+
+def sse_event(event, data):
+    """Format a Server-Sent Event with a JSON payload."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def first_token_ms(started):
+    """Record the time to first token of a chat stream started at ``started`` and return it in ms."""
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    CHAT_TIME_TO_FIRST_TOKEN.observe(elapsed_ms / 1000)
+    return elapsed_ms
+
+def chat_stream_done_event(index_names, chat_model, started, retrieval_ms, time_to_first_token_ms, cached,
+                           context_tokens):
+    """Record a finished chat stream's timings and return its ``done`` event."""
+    total_ms = (time.perf_counter() - started) * 1000
+    CHAT_STREAM_DURATION.observe(total_ms / 1000)
+    log.info(
+        'Chat stream finished', indexes=index_names, retrieval_ms=round(retrieval_ms),
+        time_to_first_token_ms=round(time_to_first_token_ms or 0), total_ms=round(total_ms),
+        context_tokens=context_tokens
+    )
+    return sse_event('done', {
+        'success': True,
+        'model_used': chat_model,
+        'context_tokens': context_tokens,
+        'retrieval_ms': round(retrieval_ms, 1),
+        'time_to_first_token_ms': round(time_to_first_token_ms, 1) if time_to_first_token_ms is not None else None,
+        'total_ms': round(total_ms, 1),
+        'cached': cached
+    })
+
+def stream_chat(prompt, index_names):
+    """
+    Run retrieval and a streaming chat generation as Server-Sent Events.
+    
+    Events, in order: ``search_results`` (the retrieved context), any number of
+    ``token`` events, then ``done`` with timings, including time to first token.
+    An ``error`` event replaces the remaining events if something fails.
+    """
+    settings = load_settings()
+    
+    co = get_chat_client(settings)
+    if co is None:
+        return jsonify({
+            'success': False, 
+            'error': 'Cohere API Key is not configured. Please configure it in Settings.'
+        }), 500
+    
+    chat_model = settings.get('chat_model') or DEFAULT_CHAT_MODEL
+    api_key = chat_api_key(settings)
+    use_answer_cache = answer_cache_enabled(settings)
+    
+    def generate():
+        started = time.perf_counter()
+        try:
+            search_results = search_for_chat(index_names, prompt)
+            retrieval_ms = (time.perf_counter() - started) * 1000
+            context = chat_context(api_key, chat_model, prompt, search_results)
+            
+            yield sse_event('search_results', {
+                'search_results': format_search_results(context.hits, prompt),
+                'model_used': chat_model
+            })
+            
+            cache_key = answer_cache_key(chat_model, prompt, search_results)
+            answer = answer_cache.get(cache_key) if use_answer_cache else None
+            cached = answer is not None
+            
+            time_to_first_token_ms = None
+            if cached:
+                time_to_first_token_ms = first_token_ms(started)
+                yield sse_event('token', {'text': answer})
+            else:
+                documents = context.documents
+                
+                # Streams are not retried, but still go through Cohere's breaker
+                breaker = breakers['cohere']
+                breaker.before_call()
+                stream_started = time.perf_counter()
+                parts = []
+                try:
+                    stream = co.chat_stream(
+                        model=chat_model,
+                        messages=[{"role": "user", "content": prompt}],
+                        documents=documents if documents else None
+                    )
+                    for event in stream:
+                        if event.type != 'content-delta':
+                            continue
+                        if time_to_first_token_ms is None:
+                            time_to_first_token_ms = first_token_ms(started)
+                        text = event.delta.message.content.text
+                        parts.append(text)
+                        yield sse_event('token', {'text': text})
+                except Exception as stream_error:
+                    breaker.record_error(stream_error, is_retryable)
+                    UPSTREAM_LATENCY.observe(
+                        time.perf_counter() - stream_started,
+                        upstream='cohere', operation='chat_stream', outcome='error'
+                    )
+                    raise
+                except BaseException:
+                    # The client went away mid-stream; the outcome is unknown, so give
+                    # the reserved call back rather than hold a half-open probe slot
+                    breaker.release()
+                    raise
+                breaker.record_success()
+                UPSTREAM_LATENCY.observe(
+                    time.perf_counter() - stream_started,
+                    upstream='cohere', operation='chat_stream', outcome='success'
+                )
+                
+                if use_answer_cache:
+                    answer_cache.set(cache_key, ''.join(parts), tags=index_names)
+            
+            yield chat_stream_done_event(
+                index_names, chat_model, started, retrieval_ms, time_to_first_token_ms, cached, context.tokens
+            )
+        except Exception as e:
+            log.exception('Chat stream failed', indexes=index_names)
+            yield sse_event('error', {'success': False, 'error': str(e)})
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
 @app.route('/indexes/<index_name>/chat-generate', methods=['POST'])
 def generate_chat_response(index_name):
     """Generate a response using Cohere Chat API with Compass search context for a specific index."""
@@ -735,173 +1579,62 @@ def generate_chat_response(index_name):
                 'error': 'Prompt is required'
             }), 400
         
-        # Get settings
-        settings = load_settings()
-        
-        # Initialize Cohere client
-        cohere_api_key = settings.get('cohere_api_key') or app.config.get('COHERE_API_KEY')
-        if not cohere_api_key:
-            return jsonify({
-                'success': False, 
-                'error': 'Cohere API Key is not configured. Please configure it in Settings.'
-            }), 500
-        
-        co = cohere.ClientV2(cohere_api_key)
-        
-        # Search the index with the prompt to get relevant context
-        client = get_compass_client()
-        search_response = client.search_documents(
-            index_name=index_name,
-            query=prompt,
-            top_k=5
-        )
-        
-        # Extract documents from the search results
-        search_results = []
-        if hasattr(search_response, 'hits') and search_response.hits:
-            search_results = search_response.hits
-        elif hasattr(search_response, 'result') and hasattr(search_response.result, 'hits'):
-            search_results = search_response.result.hits
-        
-        # Create a list of documents to send to Cohere
-        documents = []
-        for result in search_results:
-            if hasattr(result, 'text'):
-                documents.append({"data": {"text": result.text}})
-            elif hasattr(result, 'content'):
-                documents.append({"data": {"text": result.content}})
-        
-        # Get the model from settings or use default
-        chat_model = settings.get('chat_model') or "command-a-03-2025"
-        
-        # Generate response using Cohere chat API V2 with search results as context
-        chat_response = co.chat(
-            model=chat_model,
-            messages=[{"role": "user", "content": prompt}],
-            documents=documents if documents else None
-        )
-        
-        # Format search results for the response
-        formatted_search_results = []
-        for result in search_results:
-            formatted_result = {}
-            
-            if hasattr(result, 'text'):
-                formatted_result['text'] = result.text
-            elif hasattr(result, 'content'):
-                formatted_result['text'] = result.content
-            
-            if hasattr(result, 'document_id'):
-                formatted_result['document_id'] = result.document_id
-            
-            if hasattr(result, 'score'):
-                formatted_result['score'] = result.score
-            
-            formatted_search_results.append(formatted_result)
-        
-        return jsonify({
-            'success': True,
-            'response': chat_response.message.content[0].text,
-            'search_results': formatted_search_results,
-            'model_used': chat_model
-        })
+        return generate_chat(prompt, [index_name])
         
     except Exception as e:
-        import traceback
-        traceback.print_exc()
+        log.exception('Chat failed')
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@app.route('/indexes/<index_name>/chat-stream', methods=['POST'])
+def stream_chat_response(index_name):
+    """Stream a response for a specific index as Server-Sent Events."""
+    data = request.get_json(silent=True) or {}
+    prompt = data.get('prompt')
+    
+    if not prompt:
+        return jsonify({
+            'success': False, 
+            'error': 'Prompt is required'
+        }), 400
+    
+    return stream_chat(prompt, [index_name])
+
 @app.route('/chat/generate', methods=['POST'])
 def generate_chat_response_any_index():
-    """Generate a response using Cohere Chat API with Compass search context for any index."""
+    """Generate a response using Cohere Chat API with Compass search context for one or more indexes."""
     try:
         # Get request data
         data = request.json
         prompt = data.get('prompt')
-        index_name = data.get('index_name')
+        index_names = requested_index_names(data)
         
-        if not prompt or not index_name:
+        if not prompt or not index_names:
             return jsonify({
                 'success': False, 
                 'error': 'Prompt and index name are required'
             }), 400
         
-        # Get settings
-        settings = load_settings()
-        
-        # Initialize Cohere client
-        cohere_api_key = settings.get('cohere_api_key') or app.config.get('COHERE_API_KEY')
-        if not cohere_api_key:
-            return jsonify({
-                'success': False, 
-                'error': 'Cohere API Key is not configured. Please configure it in Settings.'
-            }), 500
-        
-        co = cohere.ClientV2(cohere_api_key)
-        
-        # Search the index with the prompt to get relevant context
-        client = get_compass_client()
-        search_response = client.search_documents(
-            index_name=index_name,
-            query=prompt,
-            top_k=5
-        )
-        
-        # Extract documents from the search results
-        search_results = []
-        if hasattr(search_response, 'hits') and search_response.hits:
-            search_results = search_response.hits
-        elif hasattr(search_response, 'result') and hasattr(search_response.result, 'hits'):
-            search_results = search_response.result.hits
-        
-        # Create a list of documents to send to Cohere
-        documents = []
-        for result in search_results:
-            if hasattr(result, 'text'):
-                documents.append({"data": {"text": result.text}})
-            elif hasattr(result, 'content'):
-                documents.append({"data": {"text": result.content}})
-        
-        # Get the model from settings or use default
-        chat_model = settings.get('chat_model') or "command-a-03-2025"
-        
-        # Generate response using Cohere chat API V2 with search results as context
-        chat_response = co.chat(
-            model=chat_model,
-            messages=[{"role": "user", "content": prompt}],
-            documents=documents if documents else None
-        )
-        
-        # Format search results for the response
-        formatted_search_results = []
-        for result in search_results:
-            formatted_result = {}
-            
-            if hasattr(result, 'text'):
-                formatted_result['text'] = result.text
-            elif hasattr(result, 'content'):
-                formatted_result['text'] = result.content
-            
-            if hasattr(result, 'document_id'):
-                formatted_result['document_id'] = result.document_id
-            
-            if hasattr(result, 'score'):
-                formatted_result['score'] = result.score
-            
-            formatted_search_results.append(formatted_result)
-        
-        return jsonify({
-            'success': True,
-            'response': chat_response.message.content[0].text,
-            'search_results': formatted_search_results,
-            'model_used': chat_model
-        })
+        return generate_chat(prompt, index_names)
         
     except Exception as e:
-        import traceback
-        traceback.print_exc()
+        log.exception('Chat failed')
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@app.route('/chat/stream', methods=['POST'])
+def stream_chat_response_any_index():
+    """Stream a response for one or more indexes as Server-Sent Events."""
+    data = request.get_json(silent=True) or {}
+    prompt = data.get('prompt')
+    index_names = requested_index_names(data)
+    
+    if not prompt or not index_names:
+        return jsonify({
+            'success': False, 
+            'error': 'Prompt and index name are required'
+        }), 400
+    
+    return stream_chat(prompt, index_names)
+
 @app.route('/settings', methods=['GET', 'POST'])
 def settings():
     """Render and process the settings page."""
@@ -910,53 +1643,75 @@ def settings():
     success_message = None
     
     if request.method == 'POST':
+        previous_credentials = (settings.get('compass_api_bearer_token'), settings.get('cohere_api_key'))
+        
         # Update settings from form
         settings['compass_api_bearer_token'] = request.form.get('compass_api_bearer_token')
         settings['cohere_api_key'] = request.form.get('cohere_api_key')
         settings['chat_model'] = request.form.get('chat_model')
+        settings['answer_cache_enabled'] = 'answer_cache_enabled' in request.form
         
         # Save settings
         if save_settings(settings):
             success_message = "Settings saved successfully!"
+            
+            # Rebuild pooled clients only when a token or key actually changed
+            if previous_credentials != (settings.get('compass_api_bearer_token'), settings.get('cohere_api_key')):
+                registry.reset()
         else:
             error = "Failed to save settings."
     
     return render_template('settings.html', settings=settings, error=error, success_message=success_message)
 
+def _load_chat_models(api_key):
+    """Fetch every chat model available to an API key, following pagination."""
+    client = registry.cohere(api_key)
+    models = []
+    page_token = None
+    while True:
+        response = call_with_retry(
+            client.models.list,
+            upstream='cohere',
+            operation='models.list',
+            endpoint='chat',
+            page_size=1000,
+            page_token=page_token,
+            request_options=NO_SDK_RETRIES
+        )
+        models.extend(response.models)
+        page_token = response.next_page_token
+        if not page_token:
+            return models
+
+# Chat models per API key; they change rarely, so keep them for a long time
+model_catalogue = ModelCatalogue(
+    _load_chat_models,
+    ttl=float(os.getenv('MODEL_CATALOGUE_TTL', 7 * 24 * 3600)),
+    refresh_after=float(os.getenv('MODEL_CATALOGUE_REFRESH_SECONDS', 3600))
+)
+
 @app.route('/api/models')
 def list_models():
-    """API endpoint to list Cohere models."""
+    """API endpoint to list Cohere chat models, with ETag support."""
     api_key = request.args.get('api_key') or load_settings().get('cohere_api_key')
     
     if not api_key:
         return jsonify({"error": "API key is required"})
     
     try:
-        # Create Cohere client with provided API key
-        client = cohere.Client(api_key=api_key)
-        
-        # Get list of models
-        response = client.models.list()
-        
-        # Filter chat models and convert to serializable dictionaries
-        chat_models = []
-        for model in response.models:
-            if 'chat' in model.endpoints:
-                # Create a serializable dictionary from the model object
-                model_dict = {
-                    'name': model.name,
-                    'description': getattr(model, 'description', ''),
-                    'endpoints': model.endpoints,
-                    'context_length': getattr(model, 'context_length', 0)
-                }
-                chat_models.append(model_dict)
-        
-        return jsonify({"models": chat_models})
+        catalogue = model_catalogue.get(api_key)
+        response = Response(catalogue.body, mimetype='application/json')
+        response.set_etag(catalogue.etag)
+        # Let the browser keep the listing but check it each time (cheap when unchanged)
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response.make_conditional(request)
     except Exception as e:
-        import traceback
-        print(f"Error fetching models: {str(e)}")
-        print(traceback.format_exc())
+        log.exception('Error fetching models')
         return jsonify({"error": str(e)})
 
 if __name__ == '__main__':
+    # Development server; serve with gunicorn (see gunicorn.conf.py) in production.
+    # The debug reloader runs this module twice; only the serving process runs jobs
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        job_queue.start()
     app.run(debug=True, host='0.0.0.0', port=int(os.getenv('PORT', 8080))) 
\ No newline at end of file
@@ -0,0 +1,619 @@
+"""
+Asyncio serving mode.
+
+With the threaded Flask server every chat holds a worker thread for the whole
+Compass search and Cohere generation, so concurrent chats are capped by the
+thread count. This ASGI application serves the slow routes (both chat
+endpoints, both streaming chat endpoints, search and single API explorer calls)
+as coroutines, using httpx for Compass searches and Cohere's async client. A
+waiting chat then costs a coroutine instead of a thread, and one process can
+keep hundreds of chats in flight. Every other route, including all pages, is
+handed to the Flask app on a bounded thread pool, so templates and URLs behave
+exactly as before. What still blocks in the async routes (cache lookups, which
+may hit the shared SQLite store, and template rendering) runs on a thread with
+``asyncio.to_thread`` so it never stalls the event loop.
+
+Run it with an ASGI server, e.g.::
+
+    uvicorn web_interface.asgi:app --host 0.0.0.0 --port 8080
+
+To run several processes, use gunicorn with uvicorn's worker class (see
+``gunicorn.conf.py``); caches are then shared between the processes.
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+from flask import render_template
+from flask.ctx import RequestContext
+from werkzeug.exceptions import HTTPException
+from werkzeug.routing import Map, Rule
+
+from web_interface.app import (
+    CHAT_RETRIEVAL_TOP_K, DEFAULT_CHAT_MODEL, NO_SDK_RETRIES, answer_cache, answer_cache_enabled, answer_cache_key, api_batch_executor,
+    app as flask_app, chat_api_key, chat_context, chat_stream_done_event, compass_credentials, execute_api_call,
+    first_token_ms, format_search_results, is_error_response, job_queue, load_settings, render_search_results,
+    requested_index_names, retrieval_cache, retrieval_cache_key, shared_invalidations, shared_metrics, sse_event
+)
+from web_interface.breakers import CircuitOpenError, breakers
+from web_interface.clients import AsyncClientRegistry
+from web_interface.logs import end_request, get_logger, preview, start_request
+from web_interface.metrics import HTTP_ERRORS, HTTP_IN_FLIGHT, HTTP_LATENCY, HTTP_REQUESTS, UPSTREAM_LATENCY
+from web_interface.retrieval import extract_hits, search_indexes_async
+from web_interface.retries import async_call_with_retry, carry_deadline, deadline_after, is_retryable
+
+# Threads running the Flask routes that are not served natively
+ASYNC_WSGI_THREADS = int(os.getenv('ASYNC_WSGI_THREADS', 32))
+# Chats in flight before new ones are turned away with a 503
+ASYNC_MAX_INFLIGHT_CHATS = int(os.getenv('ASYNC_MAX_INFLIGHT_CHATS', 500))
+# Request bodies larger than this are spooled to disk before Flask reads them
+ASYNC_MAX_BODY_IN_MEMORY = int(os.getenv('ASYNC_MAX_BODY_IN_MEMORY', 1024 * 1024))
+
+log = get_logger(__name__)
+
+async_clients = AsyncClientRegistry()
+
+
+class _Disconnected(Exception):
+    """The client went away while a Flask response was being streamed to it."""
+
+
+def build_environ(scope, body):
+    """Build a WSGI environ for an ASGI HTTP scope and its (file-like) body."""
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': (scope.get('client') or ('', 0))[0],
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        key = name if name in ('CONTENT_TYPE', 'CONTENT_LENGTH') else f'HTTP_{name}'
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+async def read_body(receive):
+    """Read the whole request body, spooling large bodies to a temporary file."""
+    body = tempfile.SpooledTemporaryFile(max_size=ASYNC_MAX_BODY_IN_MEMORY)
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            break
+        body.write(message.get('body', b''))
+        if not message.get('more_body'):
+            break
+    body.seek(0)
+    return body
+
+
+class WsgiBridge:
+    """Runs a WSGI app on a bounded thread pool and streams its responses to ASGI."""
+
+    def __init__(self, wsgi_app, max_workers):
+        self.wsgi_app = wsgi_app
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='wsgi')
+
+    async def __call__(self, scope, body, send):
+        loop = asyncio.get_running_loop()
+        # A small queue so a slow client holds back the thread producing the response
+        queue = asyncio.Queue(maxsize=8)
+        disconnected = threading.Event()
+
+        def put(message):
+            future = asyncio.run_coroutine_threadsafe(queue.put(message), loop)
+            while True:
+                try:
+                    return future.result(timeout=0.5)
+                except FutureTimeoutError:
+                    if disconnected.is_set():
+                        future.cancel()
+                        raise _Disconnected()
+
+        def run():
+            response = {}
+            started = False
+
+            def emit(data, more_body=True):
+                nonlocal started
+                if not started:
+                    started = True
+                    put({
+                        'type': 'http.response.start',
+                        'status': response['status'],
+                        'headers': [
+                            (name.lower().encode('latin-1'), value.encode('latin-1'))
+                            for name, value in response['headers']
+                        ],
+                    })
+                put({'type': 'http.response.body', 'body': data, 'more_body': more_body})
+
+            def start_response(status, headers, exc_info=None):
+                if exc_info and started:
+                    raise exc_info[1].with_traceback(exc_info[2])
+                response['status'] = int(status.split(' ', 1)[0])
+                response['headers'] = headers
+                return emit
+
+            try:
+                iterable = self.wsgi_app(build_environ(scope, body), start_response)
+                try:
+                    for chunk in iterable:
+                        if chunk:
+                            emit(chunk)
+                    emit(b'', more_body=False)
+                finally:
+                    if hasattr(iterable, 'close'):
+                        iterable.close()
+            except _Disconnected:
+                pass
+            except Exception:
+                log.exception('Unhandled error in WSGI route', path=scope['path'])
+                if not started:
+                    response.update(status=500, headers=[('Content-Type', 'text/plain')])
+                    emit(b'Internal Server Error', more_body=False)
+            finally:
+                body.close()
+                if not disconnected.is_set():
+                    put(None)
+
+        future = loop.run_in_executor(self.executor, run)
+        try:
+            while True:
+                message = await queue.get()
+                if message is None:
+                    break
+                await send(message)
+        except BaseException:
+            # Let the worker thread stop producing and close the Flask response
+            disconnected.set()
+            raise
+        await future
+
+
+# Native async routes
+
+def json_dumps(payload):
+    return flask_app.json.dumps(payload).encode('utf-8')
+
+
+async def send_body(send, body, status=200, content_type='application/json', headers=()):
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [
+            (b'content-type', content_type.encode('latin-1')),
+            (b'content-length', str(len(body)).encode('latin-1')),
+            *headers,
+        ],
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def send_json(send, payload, status=200, headers=()):
+    await send_body(send, json_dumps(payload), status, 'application/json', headers)
+
+
+async def send_html(send, html, status=200):
+    await send_body(send, html.encode('utf-8'), status, 'text/html; charset=utf-8')
+
+
+async def cached_search_async(index_name, query, top_k, deadline):
+    """Async counterpart of ``cached_search``, sharing its retrieval cache."""
+    key = retrieval_cache_key(index_name, query, top_k)
+    response = await asyncio.to_thread(retrieval_cache.get, key)
+    if response is not None:
+        return response
+    client = async_clients.compass(*compass_credentials())
+    try:
+        response = await async_call_with_retry(
+            client.search_documents,
+            upstream='compass',
+            deadline=deadline,
+            index_name=index_name,
+            query=query,
+            top_k=top_k
+        )
+    except CircuitOpenError:
+        # Compass is down: an expired result beats no result
+        response = await asyncio.to_thread(retrieval_cache.get_stale, key)
+        if response is None:
+            raise
+        log.warning('Serving stale search results while Compass is unavailable', index=index_name)
+        return response
+    if not is_error_response(response):
+        await asyncio.to_thread(retrieval_cache.set, key, response, tags=(index_name,))
+    return response
+
+
+async def search_for_chat_async(index_names, prompt, deadline, top_k=CHAT_RETRIEVAL_TOP_K):
+    """Search one or more indexes concurrently and return the merged hits used as context."""
+    async def search(index_name):
+        return extract_hits(await cached_search_async(index_name, prompt, top_k, deadline))
+    return await search_indexes_async(search, index_names, top_k)
+
+
+class ChatLimiter:
+    """Counts chats in flight and turns new ones away beyond the limit."""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.in_flight = 0
+
+    def try_acquire(self):
+        # Only touched from the event loop thread, so no lock is needed
+        if self.in_flight >= self.limit:
+            return False
+        self.in_flight += 1
+        return True
+
+    def release(self):
+        self.in_flight -= 1
+
+
+chat_limiter = ChatLimiter(ASYNC_MAX_INFLIGHT_CHATS)
+
+
+async def send_chat_rejected(send):
+    await send_json(
+        send,
+        {'success': False, 'error': 'Too many chats in progress, please try again shortly'},
+        status=503,
+        headers=[(b'retry-after', b'1')]
+    )
+
+
+def chat_request(request, index_name=None):
+    """Return ``(prompt, index_names, error)`` for a chat request body."""
+    data = request.get_json(silent=True) or {}
+    prompt = data.get('prompt')
+    index_names = [index_name] if index_name else requested_index_names(data)
+    if not prompt or not index_names:
+        error = 'Prompt is required' if index_name else 'Prompt and index name are required'
+        return prompt, index_names, error
+    return prompt, index_names, None
+
+
+async def chat_generate(request, send, index_name=None):
+    """Async ``/chat/generate`` and ``/indexes/<index_name>/chat-generate``."""
+    prompt, index_names, error = chat_request(request, index_name)
+    if error:
+        await send_json(send, {'success': False, 'error': error}, status=400)
+        return
+    if not chat_limiter.try_acquire():
+        await send_chat_rejected(send)
+        return
+    try:
+        settings = load_settings()
+        api_key = chat_api_key(settings)
+        if not api_key:
+            await send_json(send, {
+                'success': False,
+                'error': 'Cohere API Key is not configured. Please configure it in Settings.'
+            }, status=500)
+            return
+        co = async_clients.cohere_v2(api_key)
+        deadline = deadline_after()
+
+        search_results = await search_for_chat_async(index_names, prompt, deadline)
+        chat_model = settings.get('chat_model') or DEFAULT_CHAT_MODEL
+        context = chat_context(api_key, chat_model, prompt, search_results)
+        documents = context.documents
+
+        use_answer_cache = answer_cache_enabled(settings)
+        cache_key = answer_cache_key(chat_model, prompt, search_results)
+        answer = await asyncio.to_thread(answer_cache.get, cache_key) if use_answer_cache else None
+        cached = answer is not None
+
+        if not cached:
+            chat_response = await async_call_with_retry(
+                co.chat,
+                upstream='cohere',
+                deadline=deadline,
+                model=chat_model,
+                messages=[{"role": "user", "content": prompt}],
+                documents=documents if documents else None,
+                request_options=NO_SDK_RETRIES
+            )
+            answer = chat_response.message.content[0].text
+            if use_answer_cache:
+                await asyncio.to_thread(answer_cache.set, cache_key, answer, tags=index_names)
+
+        # Registering the chunk texts writes to the shared cache
+        formatted_results = await asyncio.to_thread(format_search_results, context.hits, prompt)
+        await send_json(send, {
+            'success': True,
+            'response': answer,
+            'search_results': formatted_results,
+            'model_used': chat_model,
+            'context_tokens': context.tokens,
+            'cached': cached
+        })
+    except Exception as e:
+        log.exception('Chat failed', indexes=index_names)
+        await send_json(send, {'success': False, 'error': str(e)}, status=500)
+    finally:
+        chat_limiter.release()
+
+
+async def stream_chat_events(prompt, index_names, api_key, co, chat_model, use_answer_cache):
+    """Async counterpart of the ``stream_chat`` generator: yields the same SSE events."""
+    started = time.perf_counter()
+    try:
+        search_results = await search_for_chat_async(index_names, prompt, deadline_after())
+        retrieval_ms = (time.perf_counter() - started) * 1000
+        context = chat_context(api_key, chat_model, prompt, search_results)
+
+        yield sse_event('search_results', {
+            'search_results': await asyncio.to_thread(format_search_results, context.hits, prompt),
+            'model_used': chat_model
+        })
+
+        cache_key = answer_cache_key(chat_model, prompt, search_results)
+        answer = await asyncio.to_thread(answer_cache.get, cache_key) if use_answer_cache else None
+        cached = answer is not None
+
+        time_to_first_token_ms = None
+        if cached:
+            time_to_first_token_ms = first_token_ms(started)
+            yield sse_event('token', {'text': answer})
+        else:
+            documents = context.documents
+
+            # Streams are not retried, but still go through Cohere's breaker
+            breaker = breakers['cohere']
+            breaker.before_call()
+            stream_started = time.perf_counter()
+            parts = []
+            try:
+                stream = co.chat_stream(
+                    model=chat_model,
+                    messages=[{"role": "user", "content": prompt}],
+                    documents=documents if documents else None
+                )
+                async for event in stream:
+                    if event.type != 'content-delta':
+                        continue
+                    if time_to_first_token_ms is None:
+                        time_to_first_token_ms = first_token_ms(started)
+                    text = event.delta.message.content.text
+                    parts.append(text)
+                    yield sse_event('token', {'text': text})
+            except Exception as stream_error:
+                breaker.record_error(stream_error, is_retryable)
+                UPSTREAM_LATENCY.observe(
+                    time.perf_counter() - stream_started,
+                    upstream='cohere', operation='chat_stream', outcome='error'
+                )
+                raise
+            except BaseException:
+                # The client went away mid-stream; the outcome is unknown, so give
+                # the reserved call back rather than hold a half-open probe slot
+                breaker.release()
+                raise
+            breaker.record_success()
+            UPSTREAM_LATENCY.observe(
+                time.perf_counter() - stream_started,
+                upstream='cohere', operation='chat_stream', outcome='success'
+            )
+
+            if use_answer_cache:
+                await asyncio.to_thread(answer_cache.set, cache_key, ''.join(parts), tags=index_names)
+
+        yield chat_stream_done_event(
+            index_names, chat_model, started, retrieval_ms, time_to_first_token_ms, cached, context.tokens
+        )
+    except Exception as e:
+        log.exception('Chat stream failed', indexes=index_names)
+        yield sse_event('error', {'success': False, 'error': str(e)})
+
+
+async def chat_stream(request, send, index_name=None):
+    """Async ``/chat/stream`` and ``/indexes/<index_name>/chat-stream`` (Server-Sent Events)."""
+    prompt, index_names, error = chat_request(request, index_name)
+    if error:
+        await send_json(send, {'success': False, 'error': error}, status=400)
+        return
+    settings = load_settings()
+    api_key = chat_api_key(settings)
+    if not api_key:
+        await send_json(send, {
+            'success': False,
+            'error': 'Cohere API Key is not configured. Please configure it in Settings.'
+        }, status=500)
+        return
+    if not chat_limiter.try_acquire():
+        await send_chat_rejected(send)
+        return
+
+    events = stream_chat_events(
+        prompt,
+        index_names,
+        api_key,
+        async_clients.cohere_v2(api_key),
+        settings.get('chat_model') or DEFAULT_CHAT_MODEL,
+        answer_cache_enabled(settings)
+    )
+    try:
+        await send({
+            'type': 'http.response.start',
+            'status': 200,
+            'headers': [
+                (b'content-type', b'text/event-stream; charset=utf-8'),
+                (b'cache-control', b'no-cache'),
+                (b'x-accel-buffering', b'no'),
+            ],
+        })
+        async for event in events:
+            await send({'type': 'http.response.body', 'body': event.encode('utf-8'), 'more_body': True})
+        await send({'type': 'http.response.body', 'body': b''})
+    finally:
+        # Stops the Cohere stream too if the client went away
+        await events.aclose()
+        chat_limiter.release()
+
+
+def render_for(request, render, *args, **kwargs):
+    """Call a rendering function for a request parsed by an async route."""
+    # Templates need a request context (url_for, request.form); reuse the
+    # parsed request since its body has already been read
+    with RequestContext(flask_app, request.environ, request=request):
+        return render(*args, **kwargs)
+
+
+async def search_index(request, send, index_name):
+    """Async POST ``/indexes/<index_name>/search``, rendering the same search page."""
+    query = request.form.get('query', '')
+    try:
+        top_k = int(request.form.get('top_k', 10))
+        log.debug('Searching index', index=index_name, query=preview(query), top_k=top_k)
+        response = await cached_search_async(index_name, query, top_k, deadline_after())
+        html = await asyncio.to_thread(render_for, request, render_search_results, index_name, query, response)
+    except Exception as e:
+        log.warning('Search error', index=index_name, error=str(e))
+        html = await asyncio.to_thread(render_for, request, render_template, 'search.html', index_name=index_name, error=str(e))
+    await send_html(send, html)
+
+
+async def api_call(request, send):
+    """Async single ``/api/call``: the SDK call runs on the API explorer's thread pool."""
+    data = request.get_json(silent=True)
+    if not data:
+        await send_json(send, {"error": "Invalid request"}, status=400)
+        return
+    loop = asyncio.get_running_loop()
+    try:
+        result, error, status = await loop.run_in_executor(
+            api_batch_executor, carry_deadline(execute_api_call, deadline=deadline_after()), data
+        )
+    except Exception as e:
+        await send_json(send, {"error": str(e)}, status=500)
+        return
+    if error:
+        await send_json(send, {"error": error}, status=status)
+        return
+    await send_json(send, {"result": result})
+
+
+def _is_batch_call(request):
+    data = request.get_json(silent=True)
+    return isinstance(data, dict) and 'calls' in data
+
+
+# Routes served on the event loop; the rule strings match the Flask routes so
+# metrics are labelled the same way. ``defer`` hands a request back to Flask.
+ASYNC_ROUTES = Map([
+    Rule('/indexes/<index_name>/search', methods=['POST'], endpoint=search_index),
+    Rule('/indexes/<index_name>/chat-generate', methods=['POST'], endpoint=chat_generate),
+    Rule('/indexes/<index_name>/chat-stream', methods=['POST'], endpoint=chat_stream),
+    Rule('/chat/generate', methods=['POST'], endpoint=chat_generate),
+    Rule('/chat/stream', methods=['POST'], endpoint=chat_stream),
+    Rule('/api/call', methods=['POST'], endpoint=api_call),
+])
+DEFERRED = {api_call: _is_batch_call}
+
+
+class AsyncApp:
+    """ASGI application: native async routes, everything else on Flask."""
+
+    def __init__(self, flask_app, wsgi_threads=ASYNC_WSGI_THREADS):
+        self.flask_app = flask_app
+        self.wsgi = WsgiBridge(flask_app, wsgi_threads)
+        self.routes = ASYNC_ROUTES.bind('localhost')
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                job_queue.start()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await async_clients.aclose()
+                self.wsgi.executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            return
+
+        try:
+            rule, args = self.routes.match(scope['path'], method=scope['method'], return_rule=True)
+        except HTTPException:
+            rule = None
+        body = await read_body(receive)
+        if rule is None:
+            await self.wsgi(scope, body, send)
+            return
+
+        request = self.flask_app.request_class(build_environ(scope, body))
+        defer = DEFERRED.get(rule.endpoint)
+        if defer is not None and defer(request):
+            body.seek(0)
+            await self.wsgi(scope, body, send)
+            return
+
+        try:
+            await self.handle(rule, args, request, send)
+        finally:
+            body.close()
+
+    async def handle(self, rule, args, request, send):
+        """Run an async route, recording the same request metrics as the Flask hooks."""
+        started = time.perf_counter()
+        method = request.method
+        recorded = False
+
+        async def send_with_metrics(message):
+            nonlocal recorded
+            if message['type'] == 'http.response.start' and not recorded:
+                recorded = True
+                status = message['status']
+                HTTP_REQUESTS.inc(route=rule.rule, method=method, status=status)
+                if status >= 500:
+                    HTTP_ERRORS.inc(route=rule.rule, method=method)
+                # For streamed responses this is the time until streaming starts
+                HTTP_LATENCY.observe(time.perf_counter() - started, route=rule.rule, method=method)
+            await send(message)
+
+        start_request(rule.rule, request.headers.get('X-Request-ID'))
+        if shared_invalidations is not None and shared_invalidations.due():
+            await asyncio.to_thread(shared_invalidations.check)
+        if shared_metrics is not None:
+            shared_metrics.start()
+        HTTP_IN_FLIGHT.inc()
+        try:
+            await rule.endpoint(request, send_with_metrics, **args)
+        except Exception:
+            log.exception('Unhandled error in async route')
+            if not recorded:
+                await send_json(send_with_metrics, {'error': 'Internal Server Error'}, status=500)
+        finally:
+            request.close()
+            HTTP_IN_FLIGHT.dec()
+            end_request()
+
+
+app = AsyncApp(flask_app)
@@ -0,0 +1,179 @@
+"""
+Circuit breakers for the upstream services.
+
+Each upstream (the Compass index API, the Compass parser and Cohere) has its own
+breaker. While closed, calls pass through and consecutive failures are counted;
+after ``failure_threshold`` failures in a row the breaker opens and calls fail
+immediately with ``CircuitOpenError`` instead of waiting on a service that is
+down. After ``reset_timeout`` seconds it goes half-open and lets a limited
+number of probe calls through: a success closes it again, a failure reopens it.
+A call interrupted before its outcome is known, such as a chat stream whose
+client disconnected, gives its probe slot back.
+"""
+
+import os
+import threading
+import time
+
+from web_interface.logs import get_logger
+
+log = get_logger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling an upstream whose circuit is open."""
+
+    def __init__(self, name, retry_after):
+        super().__init__(f"{name} is unavailable (circuit open); retry in {retry_after:.1f}s")
+        self.name = name
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """Closed / open / half-open breaker for one upstream service."""
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=30.0, half_open_max_calls=1):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_max_calls = half_open_max_calls
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probes = 0
+        self.last_error = None
+        self.times_opened = 0
+        self.rejected = 0
+
+    @property
+    def state(self):
+        with self._lock:
+            self._update_state()
+            return self._state
+
+    def _update_state(self):
+        if self._state == OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+            self._state = HALF_OPEN
+            self._probes = 0
+
+    def before_call(self):
+        """Reserve a call, raising ``CircuitOpenError`` if the circuit is open."""
+        with self._lock:
+            self._update_state()
+            if self._state == CLOSED:
+                return
+            if self._state == HALF_OPEN and self._probes < self.half_open_max_calls:
+                self._probes += 1
+                return
+            self.rejected += 1
+            retry_after = max(0.0, self.reset_timeout - (time.monotonic() - self._opened_at))
+        raise CircuitOpenError(self.name, retry_after)
+
+    def record_success(self):
+        with self._lock:
+            self._state = CLOSED
+            self._failures = 0
+
+    def record_failure(self, error):
+        with self._lock:
+            self.last_error = str(error)
+            self._failures += 1
+            if self._state == HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != OPEN:
+                    self.times_opened += 1
+                    log.warning('Circuit opened', upstream=self.name, failures=self._failures, error=str(error))
+                self._state = OPEN
+                self._opened_at = time.monotonic()
+
+    def release(self):
+        """Give back a reserved call that ended without an outcome, e.g. a stream the client abandoned."""
+        with self._lock:
+            if self._state == HALF_OPEN and self._probes > 0:
+                self._probes -= 1
+
+    def record_error(self, error, is_failure=None):
+        """Record a call that raised, as a failure only if ``is_failure`` says the upstream is at fault."""
+        if is_failure is None or is_failure(error):
+            self.record_failure(error)
+        else:
+            # The service answered, so it is up
+            self.record_success()
+
+    def _record_result(self, result, failure_result):
+        if failure_result is not None and failure_result(result):
+            self.record_failure(getattr(result, 'error', None) or result)
+        else:
+            self.record_success()
+
+    def call(self, func, *args, is_failure=None, failure_result=None, **kwargs):
+        """
+        Call ``func`` through the breaker.
+
+        :param is_failure: predicate deciding whether an exception counts as an
+            upstream failure (e.g. not 4xx errors); by default every exception does
+        :param failure_result: optional predicate marking a returned value as a failure
+        """
+        self.before_call()
+        try:
+            result = func(*args, **kwargs)
+        except Exception as e:
+            self.record_error(e, is_failure)
+            raise
+        except BaseException:
+            # Interrupted, not failed: don't keep a half-open probe slot forever
+            self.release()
+            raise
+        self._record_result(result, failure_result)
+        return result
+
+    async def call_async(self, func, *args, is_failure=None, failure_result=None, **kwargs):
+        """Await the coroutine function ``func`` through the breaker; see ``call``."""
+        self.before_call()
+        try:
+            result = await func(*args, **kwargs)
+        except Exception as e:
+            self.record_error(e, is_failure)
+            raise
+        except BaseException:
+            # Cancelled, not failed
+            self.release()
+            raise
+        self._record_result(result, failure_result)
+        return result
+
+    def stats(self):
+        with self._lock:
+            self._update_state()
+            return {
+                'state': self._state,
+                'consecutive_failures': self._failures,
+                'times_opened': self.times_opened,
+                'rejected': self.rejected,
+                'last_error': self.last_error,
+                'retry_after': (
+                    round(max(0.0, self.reset_timeout - (time.monotonic() - self._opened_at)), 1)
+                    if self._state == OPEN else None
+                ),
+            }
+
+
+def _breaker(name, env_prefix):
+    return CircuitBreaker(
+        name,
+        failure_threshold=int(os.getenv(f'{env_prefix}_FAILURE_THRESHOLD', os.getenv('BREAKER_FAILURE_THRESHOLD', 5))),
+        reset_timeout=float(os.getenv(f'{env_prefix}_RESET_SECONDS', os.getenv('BREAKER_RESET_SECONDS', 30))),
+        half_open_max_calls=int(os.getenv('BREAKER_HALF_OPEN_MAX_CALLS', 1)),
+    )
+
+
+# One breaker per upstream service
+breakers = {
+    'compass': _breaker('compass', 'COMPASS_BREAKER'),
+    'parser': _breaker('parser', 'PARSER_BREAKER'),
+    'cohere': _breaker('cohere', 'COHERE_BREAKER'),
+}
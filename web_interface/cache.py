@@ -0,0 +1,130 @@
+"""
+Bounded in-memory caches.
+
+``LRUCache`` evicts least recently used entries once either the entry count or
+the approximate byte size of the cached values exceeds its limits, and treats
+entries older than the TTL as misses (``get_stale`` still returns them until
+they are evicted). Entries can carry tags (for example the index names they
+were derived from) so everything derived from one index can be dropped at once.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+
+def approximate_size(value):
+    """
+    Roughly estimate the memory held by a value, counting string payloads.
+
+    Nested containers and objects (such as SDK response models, through their
+    ``__dict__``) are walked to any depth; an object reached twice is counted
+    once, so shared and cyclic references are safe.
+    """
+    size = 0
+    seen = set()
+    stack = [value]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, (str, bytes, bytearray)):
+            size += 49 + len(item)
+            continue
+        if item is None or isinstance(item, (bool, int, float)):
+            size += 32
+            continue
+        if id(item) in seen:
+            continue
+        seen.add(id(item))
+        if isinstance(item, dict):
+            size += 64
+            stack.extend(item.keys())
+            stack.extend(item.values())
+        elif isinstance(item, (list, tuple, set, frozenset)):
+            size += 56
+            stack.extend(item)
+        elif hasattr(item, '__dict__'):
+            size += 64
+            stack.append(vars(item))
+        else:
+            size += 32
+    return size
+
+
+class LRUCache:
+    """Thread-safe LRU cache with TTL, entry-count and byte-size limits."""
+
+    def __init__(self, max_entries=1024, max_bytes=64 * 1024 * 1024, ttl=300.0, sizeof=approximate_size):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.sizeof = sizeof
+        self._lock = threading.Lock()
+        # key -> (value, size, tags, expires_at)
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _remove(self, key):
+        _, size, _, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    def get(self, key, default=None):
+        """Return the cached value for ``key``, or ``default`` on a miss."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[3] <= time.monotonic():
+                # Expired entries stay until evicted, for get_stale
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def get_stale(self, key, default=None):
+        """Return the value for ``key`` even if it has expired, e.g. while its source is down."""
+        with self._lock:
+            entry = self._entries.get(key)
+            return default if entry is None else entry[0]
+
+    def set(self, key, value, tags=(), ttl=None):
+        """Cache ``value`` under ``key``, evicting older entries as needed."""
+        size = self.sizeof(value)
+        if size > self.max_bytes:
+            # Never worth evicting the whole cache for one oversized value
+            return
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, size, frozenset(tags), expires_at)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate(self, tag=None):
+        """Drop every entry with the given tag, or every entry if no tag is given."""
+        with self._lock:
+            if tag is None:
+                self._entries.clear()
+                self._bytes = 0
+                return
+            for key in [key for key, entry in self._entries.items() if tag in entry[2]]:
+                self._remove(key)
+
+    def stats(self):
+        """Return hit/miss counters and current usage."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+            }
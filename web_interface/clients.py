@@ -0,0 +1,294 @@
+"""
+Long-lived client registry for the web interface.
+
+Routes used to build a new Compass, Parser or Cohere client (and with it a new
+HTTP session) on every request. The registry below keeps one client per set of
+credentials for the lifetime of the process so keep-alive connections are
+reused across requests. Clients are only rebuilt when their credentials change.
+
+``AsyncClientRegistry`` does the same for the asyncio serving mode, with
+httpx-based async clients for Compass search and Cohere chat.
+
+None of the clients has a fixed timeout. Requests made by an attempt of
+``call_with_retry`` have their connect and read timeouts capped to the time
+left before the call's deadline instead, and chat streams, which are not
+retried, may run as long as the answer takes.
+"""
+
+import os
+import threading
+
+import cohere
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from tenacity import stop_after_attempt
+
+from cohere_compass.clients import CompassClient, CompassParserClient
+from cohere_compass.exceptions import CompassAuthError, CompassClientError, CompassError
+from cohere_compass.models import ParserConfig
+from cohere_compass.models.search import SearchDocumentsResponse, SearchInput
+
+from web_interface.retries import attempt_timeout
+
+# Connection pool sizes (per host) for the upstream HTTP sessions
+COMPASS_POOL_SIZE = int(os.getenv('COMPASS_HTTP_POOL_SIZE', 10))
+PARSER_POOL_SIZE = int(os.getenv('COMPASS_PARSER_HTTP_POOL_SIZE', 4))
+COHERE_POOL_SIZE = int(os.getenv('COHERE_HTTP_POOL_SIZE', 20))
+COHERE_KEEPALIVE_SECONDS = float(os.getenv('COHERE_HTTP_KEEPALIVE_SECONDS', 30))
+
+# Async pools can be much larger: a waiting request costs a coroutine, not a thread.
+# Idle connections are capped separately because httpcore scans every pooled
+# connection on each request, which gets expensive with hundreds kept alive.
+ASYNC_COMPASS_POOL_SIZE = int(os.getenv('ASYNC_COMPASS_HTTP_POOL_SIZE', 100))
+ASYNC_COHERE_POOL_SIZE = int(os.getenv('ASYNC_COHERE_HTTP_POOL_SIZE', 500))
+ASYNC_KEEPALIVE_POOL_SIZE = int(os.getenv('ASYNC_HTTP_KEEPALIVE_POOL_SIZE', 32))
+
+
+def _capped(timeout, remaining):
+    if timeout is None or isinstance(timeout, (int, float)):
+        return remaining if timeout is None else min(timeout, remaining)
+    # A (connect, read) pair
+    return tuple(_capped(part, remaining) for part in timeout)
+
+
+class DeadlineSession(requests.Session):
+    """A session whose requests time out by the deadline of the upstream call attempt in progress."""
+
+    def request(self, method, url, **kwargs):
+        remaining = attempt_timeout()
+        if remaining is not None:
+            kwargs['timeout'] = _capped(kwargs.get('timeout'), remaining)
+        return super().request(method, url, **kwargs)
+
+
+def _cap_httpx_timeout(request):
+    remaining = attempt_timeout()
+    if remaining is not None:
+        timeout = request.extensions.get('timeout') or dict.fromkeys(('connect', 'read', 'write', 'pool'))
+        request.extensions['timeout'] = {phase: _capped(value, remaining) for phase, value in timeout.items()}
+
+
+async def _cap_httpx_timeout_async(request):
+    _cap_httpx_timeout(request)
+
+
+def new_http_session(pool_size):
+    """Create a requests session with a keep-alive connection pool of the given size."""
+    session = DeadlineSession()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+class _PooledSessionMixin:
+    """Give the SDK's per-thread sessions a sized connection pool.
+
+    The Compass SDK lazily creates one ``requests.Session`` per thread; this
+    mixin makes those sessions use the configured pool size instead of the
+    library defaults.
+    """
+
+    pool_size = 10
+
+    def _get_session(self):
+        if not hasattr(self._thread_local, 'session'):
+            self._thread_local.session = new_http_session(self.pool_size)
+        return self._thread_local.session
+
+
+class PooledCompassClient(_PooledSessionMixin, CompassClient):
+    pool_size = COMPASS_POOL_SIZE
+
+
+class PooledCompassParserClient(_PooledSessionMixin, CompassParserClient):
+    pool_size = PARSER_POOL_SIZE
+
+    # The SDK retries this call on its own, three times 5 s apart; a single
+    # attempt leaves retrying to the shared policy in retries.py
+    process_file_bytes = CompassParserClient.process_file_bytes.retry_with(
+        stop=stop_after_attempt(1), reraise=True
+    )
+
+
+class ClientRegistry:
+    """Thread-safe cache of upstream clients keyed by their credentials."""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._clients = {}
+        self._cohere_http = None
+
+    def _get_or_create(self, kind, key, factory):
+        slot = self._clients.get(kind)
+        if slot is not None and slot[0] == key:
+            return slot[1]
+
+        with self._lock:
+            slot = self._clients.get(kind)
+            if slot is not None and slot[0] == key:
+                return slot[1]
+            client = factory()
+            self._clients[kind] = (key, client)
+            return client
+
+    def _cohere_http_client(self):
+        # One shared httpx pool for every Cohere client, whatever the API key
+        if self._cohere_http is None:
+            with self._lock:
+                if self._cohere_http is None:
+                    self._cohere_http = httpx.Client(
+                        timeout=None,
+                        event_hooks={'request': [_cap_httpx_timeout]},
+                        limits=httpx.Limits(
+                            max_connections=COHERE_POOL_SIZE,
+                            max_keepalive_connections=COHERE_POOL_SIZE,
+                            keepalive_expiry=COHERE_KEEPALIVE_SECONDS,
+                        ),
+                    )
+        return self._cohere_http
+
+    def compass(self, api_url, bearer_token):
+        """Return the shared CompassClient for the given URL and token."""
+        return self._get_or_create(
+            'compass',
+            (api_url, bearer_token),
+            lambda: PooledCompassClient(
+                index_url=api_url,
+                bearer_token=bearer_token,
+                # A single attempt per call: retries follow the shared policy in retries.py
+                default_max_retries=1,
+                default_sleep_retry_seconds=0,
+            ),
+        )
+
+    def parser(self, parser_url, bearer_token):
+        """Return the shared CompassParserClient for the given URL and token.
+
+        Per-upload parser settings should be passed to the processing methods
+        (``parser_config=...``) rather than by building a new client.
+        """
+        return self._get_or_create(
+            'parser',
+            (parser_url, bearer_token),
+            lambda: PooledCompassParserClient(
+                parser_url=parser_url,
+                bearer_token=bearer_token,
+                parser_config=ParserConfig(),
+            ),
+        )
+
+    def cohere(self, api_key):
+        """Return the shared Cohere v1 client for the given API key."""
+        return self._get_or_create(
+            'cohere',
+            api_key,
+            lambda: cohere.Client(api_key=api_key, httpx_client=self._cohere_http_client()),
+        )
+
+    def cohere_v2(self, api_key):
+        """Return the shared Cohere v2 client for the given API key."""
+        return self._get_or_create(
+            'cohere_v2',
+            api_key,
+            lambda: cohere.ClientV2(api_key=api_key, httpx_client=self._cohere_http_client()),
+        )
+
+    def reset(self, *kinds):
+        """Drop cached clients so they are rebuilt on next use.
+
+        With no arguments every client is dropped. Connection pools owned by
+        dropped clients are released once in-flight requests finish with them.
+        """
+        with self._lock:
+            for kind in (kinds or list(self._clients)):
+                self._clients.pop(kind, None)
+
+
+# Process-wide registry shared by all routes
+registry = ClientRegistry()
+
+
+class AsyncCompassClient:
+    """
+    Minimal asyncio client for the Compass calls made by the async routes.
+
+    The SDK client is synchronous (requests), so searches are sent with httpx
+    instead, using the same endpoint, payload and error types as the SDK.
+    """
+
+    def __init__(self, index_url, bearer_token, http):
+        self.index_url = index_url.rstrip('/')
+        self.bearer_token = bearer_token
+        self.http = http
+
+    async def search_documents(self, *, index_name, query, top_k=10, filters=None, rerank_model=None):
+        data = SearchInput(query=query, top_k=top_k, filters=filters, rerank_model=rerank_model)
+        headers = {'Authorization': f'Bearer {self.bearer_token}'} if self.bearer_token else None
+        response = await self.http.post(
+            f'{self.index_url}/api/v1/indexes/{index_name}/documents/_search',
+            json=data.model_dump(mode='json', exclude_none=True),
+            headers=headers
+        )
+        if response.status_code == 401:
+            raise CompassAuthError(message=f"Unauthorized: {response.text}")
+        if 400 <= response.status_code < 500:
+            raise CompassClientError(message=f"Client error occurred: {response.text}", code=response.status_code)
+        if response.status_code >= 500:
+            raise CompassError(f"Server error {response.status_code}: {response.text}")
+        return SearchDocumentsResponse.model_validate(response.json())
+
+
+class AsyncClientRegistry:
+    """
+    Async clients keyed by their credentials, for use on a single event loop.
+
+    Connection pools are bound to the loop that first uses them, so the
+    registry belongs to one serving process and is closed with ``aclose``.
+    """
+
+    def __init__(self):
+        self._clients = {}
+        self._http = {}
+
+    def _get_or_create(self, kind, key, factory):
+        slot = self._clients.get(kind)
+        if slot is None or slot[0] != key:
+            slot = self._clients[kind] = (key, factory())
+        return slot[1]
+
+    def _http_client(self, kind, pool_size):
+        if kind not in self._http:
+            self._http[kind] = httpx.AsyncClient(
+                timeout=None,
+                event_hooks={'request': [_cap_httpx_timeout_async]},
+                limits=httpx.Limits(
+                    max_connections=pool_size,
+                    max_keepalive_connections=min(pool_size, ASYNC_KEEPALIVE_POOL_SIZE),
+                    keepalive_expiry=COHERE_KEEPALIVE_SECONDS,
+                ),
+            )
+        return self._http[kind]
+
+    def compass(self, api_url, bearer_token):
+        """Return the shared async Compass client for the given URL and token."""
+        return self._get_or_create(
+            'compass',
+            (api_url, bearer_token),
+            lambda: AsyncCompassClient(api_url, bearer_token, self._http_client('compass', ASYNC_COMPASS_POOL_SIZE)),
+        )
+
+    def cohere_v2(self, api_key):
+        """Return the shared async Cohere v2 client for the given API key."""
+        return self._get_or_create(
+            'cohere_v2',
+            api_key,
+            lambda: cohere.AsyncClientV2(api_key=api_key, httpx_client=self._http_client('cohere', ASYNC_COHERE_POOL_SIZE)),
+        )
+
+    async def aclose(self):
+        self._clients.clear()
+        for http in self._http.values():
+            await http.aclose()
+        self._http.clear()
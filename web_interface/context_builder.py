@@ -0,0 +1,165 @@
+"""
+Token-budgeted grounding context for chat.
+
+Retrieval over-fetches, and ``ContextBuilder`` then picks what the chat model
+actually reads:
+
+1. Hits are split into passages, one per matching chunk (a hit without chunks
+   is one passage), each keeping its own score.
+2. Passages are taken best score first.
+3. A passage whose words mostly appear in a passage already taken is dropped,
+   e.g. overlapping neighbouring chunks or the same text in two indexes.
+4. Passages are packed until the token budget is spent. A passage that does
+   not fit is skipped, so a shorter one further down can still be used; only
+   if the best passage alone exceeds the budget is it cut to fit.
+
+The budget is the model's context length minus the prompt and a reserve for
+the answer, capped at ``max_tokens``: a large context window is no reason to
+fill it on every chat. Tokenizing is a remote call, so tokens are estimated
+from the character count, erring on the high side.
+"""
+
+import math
+import re
+from collections import Counter
+
+from web_interface.snippets import hit_text
+
+WORD = re.compile(r'\w+')
+
+
+def _field(item, name):
+    if isinstance(item, dict):
+        return item.get(name)
+    return getattr(item, name, None)
+
+
+class Passage:
+    """One candidate piece of context: a chunk of a hit, with its score and size."""
+
+    __slots__ = ('hit', 'text', 'score', 'tokens')
+
+    def __init__(self, hit, text, score, tokens):
+        self.hit = hit
+        self.text = text
+        self.score = score
+        self.tokens = tokens
+
+
+class ChatContext:
+    """The passages packed for one chat, and what was left out."""
+
+    def __init__(self, passages, budget, candidates, duplicates, over_budget):
+        self.passages = passages
+        self.budget = budget
+        self.candidates = candidates
+        self.duplicates = duplicates
+        self.over_budget = over_budget
+        self.tokens = sum(passage.tokens for passage in passages)
+
+    @property
+    def documents(self):
+        """The ``documents`` argument for Cohere's chat API."""
+        return [{'data': {'text': passage.text}} for passage in self.passages]
+
+    @property
+    def hits(self):
+        """The hits that contributed at least one passage, best first."""
+        seen = set()
+        hits = []
+        for passage in self.passages:
+            if id(passage.hit) not in seen:
+                seen.add(id(passage.hit))
+                hits.append(passage.hit)
+        return hits
+
+
+class ContextBuilder:
+    """Deduplicates search hits and packs them into a chat model's token budget."""
+
+    def __init__(self, max_tokens=6000, response_tokens=2048, default_context_length=128000,
+                 duplicate_threshold=0.8, chars_per_token=3.5, shingle_size=5):
+        """
+        :param max_tokens: most context tokens sent, whatever the model's context length
+        :param response_tokens: tokens of the context length kept free for the answer
+        :param default_context_length: used when the model's context length is not known
+        :param duplicate_threshold: share of a passage's word shingles found in an
+            already packed passage above which it counts as a duplicate
+        :param chars_per_token: characters per token assumed by the estimate
+        :param shingle_size: words per shingle when comparing passages
+        """
+        self.max_tokens = max_tokens
+        self.response_tokens = response_tokens
+        self.default_context_length = default_context_length
+        self.duplicate_threshold = duplicate_threshold
+        self.chars_per_token = chars_per_token
+        self.shingle_size = shingle_size
+
+    def estimate_tokens(self, text):
+        return math.ceil(len(text) / self.chars_per_token)
+
+    def budget(self, prompt, context_length=None):
+        """Return the context tokens available for a prompt on a model with this context length."""
+        available = (context_length or self.default_context_length) - self.estimate_tokens(prompt or '')
+        return max(0, min(self.max_tokens, available - self.response_tokens))
+
+    def passages(self, hits):
+        """Split hits into passages, best score first."""
+        passages = []
+        for hit in hits:
+            hit_score = _field(hit, 'score') or 0.0
+            chunks = _field(hit, 'chunks') or [hit]
+            for chunk in chunks:
+                text = hit_text(chunk)
+                if text:
+                    score = _field(chunk, 'score')
+                    passages.append(Passage(
+                        hit, text, hit_score if score is None else score, self.estimate_tokens(text)
+                    ))
+        # Stable, so equal scores keep retrieval order
+        passages.sort(key=lambda passage: passage.score, reverse=True)
+        return passages
+
+    def _shingles(self, text):
+        words = WORD.findall(text.casefold())
+        size = self.shingle_size
+        if len(words) <= size:
+            return {tuple(words)}
+        return set(zip(*(words[i:] for i in range(size))))
+
+    def _truncate(self, passage, tokens):
+        text = passage.text[:int(tokens * self.chars_per_token)]
+        if ' ' in text:
+            text = text[:text.rindex(' ')]
+        return Passage(passage.hit, text, passage.score, self.estimate_tokens(text))
+
+    def build(self, hits, prompt, context_length=None):
+        """Return the ``ChatContext`` for the hits of a chat's retrieval."""
+        budget = self.budget(prompt, context_length)
+        candidates = self.passages(hits)
+        packed = []
+        # Shingle -> position in ``packed`` of the first passage containing it, so
+        # a passage is only compared with the packed passages it shares words with
+        owners = {}
+        remaining = budget
+        duplicates = over_budget = 0
+        for passage in candidates:
+            # Size is checked first: it is cheap, and most passages fail it once the budget is spent
+            if passage.tokens > remaining:
+                if packed or remaining <= 0:
+                    over_budget += 1
+                    continue
+                # Rather than send no context, send the start of the best passage
+                passage = self._truncate(passage, remaining)
+            shingles = self._shingles(passage.text)
+            shared = Counter(owners[shingle] for shingle in shingles if shingle in owners)
+            # Only the candidate's own shingles count: a long passage that merely
+            # contains a short packed one (e.g. its heading) is not a duplicate
+            if any(count >= self.duplicate_threshold * len(shingles) for count in shared.values()):
+                duplicates += 1
+                continue
+            for shingle in shingles:
+                owners.setdefault(shingle, len(packed))
+            packed.append(passage)
+            remaining -= passage.tokens
+        return ChatContext(packed, budget, len(candidates), duplicates, over_budget)
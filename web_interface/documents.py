@@ -0,0 +1,183 @@
+"""
+Paginated document listing backed by per-index document manifests.
+
+Compass has no "list documents" call, so each index gets a manifest: an ordered
+map of document IDs (with path and chunk count) built lazily by scrolling a
+``match_all`` direct search in bounded batches. A page only scans as far as it
+needs to, and at most ``max_batches_per_page`` batches per request, so turning
+to the next page usually costs a single bounded call, and pages that have
+already been scanned cost none. A document's chunks can turn up anywhere in the
+scan, so chunk counts are marked ``partial`` until the scan is complete.
+Uploads add their documents to the manifest so it stays current without
+rescanning.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from itertools import islice
+
+from cohere_compass.exceptions import CompassError
+
+from web_interface.logs import get_logger
+from web_interface.retries import call_with_retry
+
+log = get_logger(__name__)
+
+
+class DocumentManifest:
+    """Ordered document IDs for a single index, built incrementally."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.documents = OrderedDict()
+        self.scroll_id = None
+        self.started = False
+        self.complete = False
+        self.created_at = time.monotonic()
+
+    def add_chunk(self, chunk):
+        entry = self.documents.get(chunk.document_id)
+        if entry is None:
+            self.documents[chunk.document_id] = {
+                'document_id': chunk.document_id,
+                'path': chunk.path,
+                'chunks': 1,
+                'source': 'scan',
+            }
+        elif entry['source'] == 'scan':
+            entry['chunks'] += 1
+
+    def restart_scan(self):
+        """Forget the scanned documents, keeping uploads the next scan may not see yet (still indexing)."""
+        self.documents = OrderedDict(
+            (document_id, entry) for document_id, entry in self.documents.items() if entry['source'] == 'upload'
+        )
+        self.started = False
+        self.scroll_id = None
+
+
+class DocumentManifests:
+    """Per-index document manifests with page/per_page access."""
+
+    def __init__(self, scan_batch_size=500, scroll='5m', ttl=600.0, max_indexes=32, max_batches_per_page=4):
+        """
+        :param scan_batch_size: chunks fetched per direct search call
+        :param max_batches_per_page: most scan calls one page request makes;
+            a page further into the index fills in over later requests
+        :param scroll: how long Compass keeps a scroll cursor alive between pages
+        :param ttl: seconds before a manifest is discarded and rebuilt
+        :param max_indexes: number of index manifests to keep in memory
+        """
+        self.scan_batch_size = scan_batch_size
+        self.scroll = scroll
+        self.ttl = ttl
+        self.max_indexes = max_indexes
+        self.max_batches_per_page = max_batches_per_page
+        self._lock = threading.Lock()
+        self._manifests = OrderedDict()
+
+    def _manifest(self, index_name, create=True):
+        with self._lock:
+            manifest = self._manifests.get(index_name)
+            if manifest is not None and time.monotonic() - manifest.created_at >= self.ttl:
+                manifest = None
+            if manifest is None:
+                if not create:
+                    return None
+                manifest = DocumentManifest()
+                self._manifests[index_name] = manifest
+            self._manifests.move_to_end(index_name)
+            while len(self._manifests) > self.max_indexes:
+                self._manifests.popitem(last=False)
+            return manifest
+
+    def _scan_batch(self, client, index_name, manifest):
+        """Fetch one bounded batch of chunks and fold them into the manifest."""
+        if not manifest.started:
+            response = call_with_retry(
+                client.direct_search,
+                upstream='compass',
+                index_name=index_name,
+                query={"match_all": {}},
+                size=self.scan_batch_size,
+                scroll=self.scroll
+            )
+            manifest.started = True
+        else:
+            # Not retried: a repeated scroll call could skip a page; page()
+            # rescans from the start if the scroll fails
+            response = client.direct_search_scroll_with_index(
+                scroll_id=manifest.scroll_id,
+                index_name=index_name,
+                scroll=self.scroll
+            )
+
+        for chunk in response.hits:
+            manifest.add_chunk(chunk)
+
+        manifest.scroll_id = response.scroll_id
+        if len(response.hits) < self.scan_batch_size or not response.scroll_id:
+            manifest.complete = True
+
+    def page(self, client, index_name, page=1, per_page=20):
+        """
+        Return one page of documents for an index.
+
+        Each document has a ``partial`` flag, set while its chunk count may
+        still grow because the index has not been scanned to the end. If the
+        page lies beyond what ``max_batches_per_page`` scans reach, it comes
+        back short (or empty) with ``has_next`` set.
+
+        :returns: a tuple ``(documents, has_next)``
+        """
+        offset = (page - 1) * per_page
+        # One extra document tells us whether there is a next page
+        needed = offset + per_page + 1
+
+        manifest = self._manifest(index_name)
+        with manifest.lock:
+            batches = 0
+            while len(manifest.documents) < needed and not manifest.complete and batches < self.max_batches_per_page:
+                batches += 1
+                try:
+                    self._scan_batch(client, index_name, manifest)
+                except CompassError:
+                    if not manifest.started or manifest.scroll_id is None:
+                        raise
+                    # The scroll cursor most likely expired; start over once
+                    log.info('Document scroll expired, rescanning', index=index_name)
+                    manifest.restart_scan()
+                    self._scan_batch(client, index_name, manifest)
+
+            partial = not manifest.complete
+            documents = [
+                dict(document, partial=partial and document['source'] == 'scan')
+                for document in islice(manifest.documents.values(), offset, offset + per_page)
+            ]
+            has_next = len(manifest.documents) > offset + per_page or not manifest.complete
+
+        return documents, has_next
+
+    def add(self, index_name, documents):
+        """Record newly uploaded documents in the index's manifest, if it has one."""
+        manifest = self._manifest(index_name, create=False)
+        if manifest is None:
+            # Nothing cached yet; the first listing will scan the new documents
+            return
+        with manifest.lock:
+            for doc in documents:
+                manifest.documents[doc['document_id']] = {
+                    'document_id': doc['document_id'],
+                    'path': doc.get('path', ''),
+                    'chunks': doc.get('chunks'),
+                    'source': 'upload',
+                }
+
+    def invalidate(self, index_name=None):
+        """Drop the manifest for one index, or for all indexes."""
+        with self._lock:
+            if index_name is None:
+                self._manifests.clear()
+            else:
+                self._manifests.pop(index_name, None)
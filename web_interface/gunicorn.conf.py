@@ -0,0 +1,69 @@
+"""
+Gunicorn configuration for serving the web interface in production.
+
+    gunicorn -c web_interface/gunicorn.conf.py web_interface.app:app
+
+Runs ``WEB_CONCURRENCY`` preforked worker processes with ``WEB_THREADS``
+threads each. The workers share their caches through a SQLite database at
+``SHARED_CACHE_PATH`` and pass invalidations (e.g. after ``create_index``) to
+each other through it; they also publish their metrics there, so ``/metrics``
+on any worker reports all of them. For the async serving mode, set
+``WEB_WORKER_CLASS=uvicorn.workers.UvicornWorker`` and serve
+``web_interface.asgi:app`` instead.
+"""
+
+import multiprocessing
+import os
+import sys
+
+import dotenv
+
+dotenv.load_dotenv()
+
+bind = os.getenv('WEB_BIND', f"0.0.0.0:{os.getenv('PORT', 8080)}")
+workers = int(os.getenv('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+worker_class = os.getenv('WEB_WORKER_CLASS', 'gthread')
+threads = int(os.getenv('WEB_THREADS', 8))
+timeout = int(os.getenv('WEB_TIMEOUT', 120))
+graceful_timeout = int(os.getenv('WEB_GRACEFUL_TIMEOUT', 30))
+keepalive = int(os.getenv('WEB_KEEPALIVE', 5))
+# Restarting workers now and then bounds slow memory growth; 0 never restarts
+max_requests = int(os.getenv('WEB_MAX_REQUESTS', 0))
+max_requests_jitter = int(os.getenv('WEB_MAX_REQUESTS_JITTER', 0))
+accesslog = os.getenv('WEB_ACCESS_LOG', '-')
+
+# Each worker must import the app itself: clients, connection pools, SQLite
+# connections and background threads cannot be shared across a fork
+preload_app = False
+
+# Workers inherit the environment, so they all find the same shared cache
+if not os.getenv('SHARED_CACHE_PATH'):
+    os.environ['SHARED_CACHE_PATH'] = os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), 'cache_data', 'shared_cache.db'
+    )
+
+
+def on_starting(server):
+    """Start from an empty shared cache, so no entries pickled by an older release are read (and metrics start at zero)."""
+    path = os.environ['SHARED_CACHE_PATH']
+    for suffix in ('', '-wal', '-shm'):
+        try:
+            os.remove(path + suffix)
+        except FileNotFoundError:
+            pass
+
+
+def post_worker_init(worker):
+    """Start the job workers, resuming unfinished jobs, as soon as a worker is up rather than on its first request."""
+    app_module = sys.modules.get('web_interface.app')
+    job_queue = getattr(app_module, 'job_queue', None)
+    if job_queue is not None:
+        job_queue.start()
+
+
+def worker_exit(server, worker):
+    """Publish an exiting worker's final metrics, so its last requests stay in the totals."""
+    app_module = sys.modules.get('web_interface.app')
+    shared_metrics = getattr(app_module, 'shared_metrics', None)
+    if shared_metrics is not None:
+        shared_metrics.publish()
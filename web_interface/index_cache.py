@@ -0,0 +1,153 @@
+"""
+Index metadata cache with stale-while-revalidate refresh.
+
+Several pages need the list of indexes, or a single index looked up by name.
+Rather than calling ``list_indexes`` on every page view, the cache keeps the
+last listing in memory keyed by index name. Within ``ttl`` seconds the cached
+listing is served as-is; after that, and up to ``ttl + stale_ttl`` seconds, the
+stale listing is still served while a background thread fetches a fresh one.
+Older data is refreshed synchronously; if that fails (for example because
+Compass is down) the last listing that loaded is served instead of an error.
+
+With several worker processes, a ``shared`` cache lets a worker take a listing
+another worker has just loaded instead of calling Compass itself.
+"""
+
+import threading
+import time
+
+from web_interface.logs import get_logger
+
+log = get_logger(__name__)
+
+
+class IndexCache:
+    """Cache of index metadata keyed by index name."""
+
+    # Key of the listing in the shared cache
+    SHARED_KEY = 'indexes'
+
+    def __init__(self, loader, ttl=30.0, stale_ttl=300.0, miss_refresh_interval=1.0, shared=None):
+        """
+        :param loader: callable returning the list of index dicts; raises on error
+        :param ttl: seconds a listing is considered fresh
+        :param stale_ttl: extra seconds a listing may be served while refreshing
+        :param miss_refresh_interval: minimum age before a lookup miss forces a refresh
+        :param shared: optional ``SharedCache`` holding the listing for other processes
+        """
+        self.loader = loader
+        self.shared = shared
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.miss_refresh_interval = miss_refresh_interval
+        self._lock = threading.Lock()
+        # (indexes, indexes_by_name, loaded_at), swapped as a whole
+        self._snapshot = None
+        # Last successfully loaded snapshot, kept across invalidations as a fallback
+        self._last_good = None
+        self._generation = 0
+        self._refreshing = False
+        self.hits = 0
+        self.misses = 0
+
+    def _load_shared(self):
+        # Listings carry their wall-clock load time, which every process shares
+        shared = self.shared.get(self.SHARED_KEY)
+        if shared is None:
+            return None
+        indexes, loaded_at = shared
+        return indexes, time.monotonic() - max(0.0, time.time() - loaded_at)
+
+    def _refresh(self, fresh=False):
+        generation = self._generation
+        loaded = self._load_shared() if self.shared is not None and not fresh else None
+        if loaded is None:
+            loaded = (list(self.loader()), time.monotonic())
+            if self.shared is not None:
+                self.shared.set(self.SHARED_KEY, (loaded[0], time.time()), ttl=self.ttl)
+        indexes, loaded_at = loaded
+        snapshot = (indexes, {idx['name']: idx for idx in indexes}, loaded_at)
+        with self._lock:
+            # Don't let a refresh that started before an invalidation win
+            if generation == self._generation:
+                self._snapshot = snapshot
+            self._last_good = snapshot
+        return snapshot
+
+    def _refresh_or_last_good(self):
+        try:
+            return self._refresh()
+        except Exception as e:
+            last_good = self._last_good
+            if last_good is None:
+                raise
+            log.warning('Index refresh failed, serving the last loaded listing', error=str(e))
+            return last_good
+
+    def _refresh_in_background(self):
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+
+        def run():
+            try:
+                self._refresh()
+            except Exception as e:
+                log.warning('Background index refresh failed', error=str(e))
+            finally:
+                self._refreshing = False
+
+        threading.Thread(target=run, name='index-cache-refresh', daemon=True).start()
+
+    def _current(self):
+        snapshot = self._snapshot
+        if snapshot is None:
+            self.misses += 1
+            return self._refresh_or_last_good()
+        age = time.monotonic() - snapshot[2]
+        if age >= self.ttl + self.stale_ttl:
+            self.misses += 1
+            return self._refresh_or_last_good()
+        # Served from memory, even if stale while a refresh runs
+        self.hits += 1
+        if age >= self.ttl:
+            self._refresh_in_background()
+        return snapshot
+
+    def list(self):
+        """Return all cached indexes, loading or refreshing as needed."""
+        return self._current()[0]
+
+    def get(self, index_name):
+        """Return the index named ``index_name``, or None if it does not exist."""
+        _, by_name, loaded_at = self._current()
+        index = by_name.get(index_name)
+        if index is None and time.monotonic() - loaded_at >= self.miss_refresh_interval:
+            # The index may have been created since we last listed
+            index = self._refresh(fresh=True)[1].get(index_name)
+        return index
+
+    def stats(self):
+        """Return hit/miss counters (a miss waits for a listing) and the number of indexes held."""
+        snapshot = self._snapshot
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+            'entries': len(snapshot[0]) if snapshot is not None else 0,
+        }
+
+    def invalidate(self, shared=True):
+        """
+        Force the next lookup to fetch a fresh listing.
+
+        :param shared: also drop the listing shared with other processes; pass
+            False when applying another process's invalidation
+        """
+        with self._lock:
+            self._generation += 1
+            self._snapshot = None
+        if shared and self.shared is not None:
+            self.shared.invalidate()
@@ -0,0 +1,184 @@
+"""
+Bulk document ingestion.
+
+Files (or the contents of zip/tar archives) are parsed in parallel on a
+bounded pool and the resulting documents are inserted in fixed-size batches.
+Archives are checked against file-count and size limits from their listings
+before anything is extracted, so an archive bomb is refused up front.
+Only a limited number of files are parsed ahead of the inserter, so a slow
+index applies backpressure to parsing instead of letting parsed documents pile
+up in memory.
+"""
+
+import os
+import tarfile
+import time
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from web_interface.retries import carry_deadline
+
+ARCHIVE_EXTENSIONS = ('.zip', '.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2')
+
+
+def is_archive(filename):
+    """Return whether a filename looks like a supported archive."""
+    return filename.lower().endswith(ARCHIVE_EXTENSIONS)
+
+
+def _safe_destination(directory, member_name):
+    destination = os.path.realpath(os.path.join(directory, member_name))
+    root = os.path.realpath(directory)
+    if os.path.commonpath([root, destination]) != root:
+        raise ValueError(f"Archive member escapes the extraction directory: {member_name}")
+    return destination
+
+
+def _check_limits(path, members, sizes, max_files, max_bytes):
+    if max_files is not None and len(members) > max_files:
+        raise ValueError(f"{os.path.basename(path)} holds too many files: {len(members)} (the limit is {max_files})")
+    total = sum(sizes)
+    if max_bytes is not None and total > max_bytes:
+        raise ValueError(
+            f"{os.path.basename(path)} unpacks to too much data: {total} bytes (the limit is {max_bytes})"
+        )
+    return total
+
+
+def extract_archive(path, directory, max_files=None, max_bytes=None):
+    """
+    Extract a zip or tar archive into ``directory``, refusing unsafe paths.
+
+    Nothing is extracted if the archive holds more than ``max_files`` files or
+    more than ``max_bytes`` uncompressed; ``ValueError`` is raised instead.
+    (Zip extraction stops at each member's listed size, so the listing cannot
+    understate what is written.)
+
+    :returns: a tuple ``(files, bytes)`` extracted
+    """
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as archive:
+            members = [member for member in archive.infolist() if not member.is_dir()]
+            for member in members:
+                _safe_destination(directory, member.filename)
+            total = _check_limits(path, members, (member.file_size for member in members), max_files, max_bytes)
+            for member in members:
+                archive.extract(member, directory)
+    else:
+        with tarfile.open(path) as archive:
+            # Only plain files; skip links, devices and directories
+            members = [member for member in archive.getmembers() if member.isfile()]
+            for member in members:
+                _safe_destination(directory, member.name)
+            total = _check_limits(path, members, (member.size for member in members), max_files, max_bytes)
+            archive.extractall(directory, members=members)
+    return len(members), total
+
+
+def collect_files(directory):
+    """Return the files to ingest under ``directory``, skipping hidden and OS metadata files."""
+    files = []
+    for root, dirnames, filenames in os.walk(directory):
+        dirnames[:] = sorted(d for d in dirnames if not d.startswith('.') and d != '__MACOSX')
+        for filename in sorted(filenames):
+            if not filename.startswith('.'):
+                files.append(os.path.join(root, filename))
+    return files
+
+
+def ingest_files(files, parse, insert, workers=4, batch_size=50, on_progress=None):
+    """
+    Parse files in parallel and insert the documents in batches.
+
+    :param files: paths of the files to ingest
+    :param parse: callable taking a path and returning a list of documents
+    :param insert: callable taking a list of documents; returns a list of
+        ``{document_id: error}`` dicts for documents that failed, or None
+    :param workers: number of files parsed concurrently
+    :param batch_size: number of documents per insert call
+    :param on_progress: optional callable receiving a stats dict after each step
+    :returns: a tuple ``(manifest, stats)`` where ``manifest`` maps each path
+        to ``{'status', 'error', 'documents', 'parse_ms'}``
+    """
+    started = time.perf_counter()
+    manifest = {path: {'status': 'pending', 'error': None, 'documents': 0, 'parse_ms': None} for path in files}
+    stats = {'files_total': len(files), 'files_parsed': 0, 'documents_inserted': 0, 'documents_failed': 0}
+    batch = []
+
+    def report():
+        elapsed = time.perf_counter() - started
+        stats['elapsed_ms'] = round(elapsed * 1000, 1)
+        stats['docs_per_second'] = round(stats['documents_inserted'] / elapsed, 2) if elapsed else 0.0
+        if on_progress:
+            on_progress(dict(stats))
+
+    @carry_deadline
+    def timed_parse(path):
+        parse_started = time.perf_counter()
+        docs = parse(path)
+        return docs, (time.perf_counter() - parse_started) * 1000
+
+    def flush():
+        docs = [doc for doc, _ in batch]
+        paths = [path for _, path in batch]
+        batch.clear()
+        try:
+            errors = insert(docs) or []
+        except Exception as e:
+            errors = [{doc.metadata.document_id: str(e)} for doc in docs]
+        failed_ids = {document_id for error in errors for document_id in error}
+        for doc, path in zip(docs, paths):
+            if doc.metadata.document_id in failed_ids:
+                stats['documents_failed'] += 1
+                manifest[path]['status'] = 'failed'
+                manifest[path]['error'] = next(
+                    error[doc.metadata.document_id] for error in errors if doc.metadata.document_id in error
+                )
+            else:
+                stats['documents_inserted'] += 1
+        report()
+
+    pending_files = iter(files)
+    in_flight = {}
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='ingest-parse') as executor:
+        while True:
+            # Keep a bounded window of parses ahead of the inserter
+            while len(in_flight) < workers * 2:
+                path = next(pending_files, None)
+                if path is None:
+                    break
+                in_flight[executor.submit(timed_parse, path)] = path
+            if not in_flight:
+                break
+
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                path = in_flight.pop(future)
+                entry = manifest[path]
+                stats['files_parsed'] += 1
+                try:
+                    docs, parse_ms = future.result()
+                except Exception as e:
+                    entry['status'] = 'failed'
+                    entry['error'] = f"Parser error: {e}"
+                    continue
+                entry['parse_ms'] = round(parse_ms, 1)
+                entry['documents'] = len(docs)
+                if not docs:
+                    entry['status'] = 'failed'
+                    entry['error'] = "No documents were parsed"
+                    continue
+                entry['status'] = 'succeeded'
+                batch.extend((doc, path) for doc in docs)
+
+            # Inserting here blocks further parsing beyond the in-flight window
+            while len(batch) >= batch_size:
+                pending, batch[:] = batch[batch_size:], batch[:batch_size]
+                flush()
+                batch.extend(pending)
+            report()
+
+    if batch:
+        flush()
+    report()
+    return manifest, stats
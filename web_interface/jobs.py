@@ -0,0 +1,313 @@
+"""
+Persistent background job queue.
+
+Long-running work such as parsing and inserting uploaded documents runs on a
+bounded pool of worker threads instead of inside the HTTP request. Each job is
+stored as a JSON file (written atomically, like the settings file) next to a
+workspace directory holding its input files, so jobs that were queued or
+running when the process stopped are picked up again on the next start.
+
+Several worker processes can share one jobs directory: a process holds a file
+lock on every job it has queued or is running, and only resumes jobs whose
+lock it can take, so no job runs twice and jobs of a crashed worker are picked
+up by the next worker that starts. Any process can report any job's status.
+"""
+
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from web_interface.locks import try_lock, unlock
+from web_interface.logs import get_logger
+from web_interface.retries import job_deadlines
+
+log = get_logger(__name__)
+
+# Job statuses
+QUEUED = 'queued'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+
+FINISHED_STATUSES = (SUCCEEDED, FAILED)
+
+
+class QueueFullError(Exception):
+    """Raised when too many jobs are already waiting to run."""
+
+
+class Job:
+    """Handle passed to job handlers for reading inputs and reporting progress."""
+
+    def __init__(self, queue, record):
+        self._queue = queue
+        self.record = record
+
+    @property
+    def id(self):
+        return self.record['id']
+
+    @property
+    def params(self):
+        return self.record['params']
+
+    @property
+    def workspace(self):
+        """Directory holding this job's input files."""
+        return self._queue.workspace(self.id)
+
+    def progress(self, stage, **details):
+        """Record the stage the job is in (e.g. 'parsing', 'inserting')."""
+        self.record['progress'] = dict(details, stage=stage)
+        self._queue.save(self.record)
+
+    @staticmethod
+    def _file_entry(filename, status, error=None, documents=None, **timings):
+        entry = {
+            'filename': filename,
+            'status': status,
+            'error': error,
+            'timings_ms': {name: round(value, 1) for name, value in timings.items() if value is not None},
+        }
+        if documents is not None:
+            entry['documents'] = documents
+        return entry
+
+    def file_result(self, filename, status, error=None, documents=None, **timings):
+        """Record the outcome and timings (in milliseconds) for one input file."""
+        self.record['files'].append(self._file_entry(filename, status, error, documents, **timings))
+        self._queue.save(self.record)
+
+    def file_results(self, results):
+        """Record many outcomes at once; each item holds ``file_result`` keyword arguments."""
+        self.record['files'].extend(self._file_entry(**result) for result in results)
+        self._queue.save(self.record)
+
+
+class JobQueue:
+    """Bounded worker pool running jobs persisted under ``jobs_dir``."""
+
+    def __init__(self, jobs_dir, max_workers=2, max_pending=100, retention_seconds=24 * 3600):
+        self.jobs_dir = jobs_dir
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.retention_seconds = retention_seconds
+        self._handlers = {}
+        self._lock = threading.Lock()
+        self._records = {}
+        # job_id -> lock file held while this process owns the job
+        self._claims = {}
+        self._pending = 0
+        self._executor = None
+
+    def handler(self, kind):
+        """Decorator registering the function that runs jobs of ``kind``."""
+        def register(func):
+            self._handlers[kind] = func
+            return func
+        return register
+
+    def _record_path(self, job_id):
+        return os.path.join(self.jobs_dir, f"{job_id}.json")
+
+    def _lock_path(self, job_id):
+        return os.path.join(self.jobs_dir, f"{job_id}.lock")
+
+    def workspace(self, job_id):
+        return os.path.join(self.jobs_dir, job_id)
+
+    def _claim(self, job_id):
+        """Take ownership of a job; returns False if another process owns it."""
+        lock = try_lock(self._lock_path(job_id))
+        if lock is None:
+            return False
+        self._claims[job_id] = lock
+        return True
+
+    def _release(self, job_id):
+        lock = self._claims.pop(job_id, None)
+        if lock is not None:
+            unlock(lock)
+
+    def _load(self, job_id):
+        # Job IDs come from URLs; only accept the hex IDs we hand out
+        if not job_id.isalnum():
+            return None
+        try:
+            with open(self._record_path(job_id)) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def save(self, record):
+        """Atomically persist a job record."""
+        record['updated_at'] = time.time()
+        fd, temp_path = tempfile.mkstemp(dir=self.jobs_dir, prefix='.job-', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(record, f)
+            os.replace(temp_path, self._record_path(record['id']))
+        except Exception:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    def start(self):
+        """Start the worker pool and resume jobs left over from a previous run."""
+        if self._executor is not None:
+            return
+        with self._lock:
+            if self._executor is not None:
+                return
+            os.makedirs(self.jobs_dir, exist_ok=True)
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='jobs')
+
+        now = time.time()
+        resumed = []
+        for name in os.listdir(self.jobs_dir):
+            if not name.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(self.jobs_dir, name)) as f:
+                    record = json.load(f)
+            except Exception as e:
+                log.warning('Skipping unreadable job file', file=name, error=str(e))
+                continue
+
+            if record['status'] in FINISHED_STATUSES:
+                if now - record.get('finished_at', now) > self.retention_seconds:
+                    self._delete(record['id'])
+                else:
+                    self._records[record['id']] = record
+                continue
+
+            # Queued or interrupted while running: run it again from the start,
+            # unless a live worker process still owns it
+            if not self._claim(record['id']):
+                continue
+            record['status'] = QUEUED
+            record['files'] = []
+            record['progress'] = {'stage': 'queued'}
+            self._records[record['id']] = record
+            resumed.append(record)
+
+        for record in sorted(resumed, key=lambda r: r['created_at']):
+            log.info('Resuming job', job_id=record['id'], kind=record['kind'])
+            self.save(record)
+            self._enqueue(record)
+
+    def create(self, kind, params):
+        """
+        Create a queued job and its workspace; the caller then writes input files
+        into ``workspace(job_id)`` and calls ``enqueue``.
+        """
+        if kind not in self._handlers:
+            raise ValueError(f"Unknown job kind: {kind}")
+        self.start()
+        with self._lock:
+            if self._pending >= self.max_pending:
+                raise QueueFullError("Too many jobs are waiting; please try again later")
+
+        job_id = uuid.uuid4().hex
+        os.makedirs(self.workspace(job_id), exist_ok=True)
+        self._claim(job_id)
+        record = {
+            'id': job_id,
+            'kind': kind,
+            'params': params,
+            'status': QUEUED,
+            'progress': {'stage': 'queued'},
+            'files': [],
+            'result': None,
+            'error': None,
+            'created_at': time.time(),
+            'started_at': None,
+            'finished_at': None,
+        }
+        with self._lock:
+            self._records[job_id] = record
+        self.save(record)
+        return job_id
+
+    def discard(self, job_id):
+        """Delete a created job that was never enqueued, e.g. because writing its input failed."""
+        with self._lock:
+            self._records.pop(job_id, None)
+        self._release(job_id)
+        self._delete(job_id)
+
+    def enqueue(self, job_id):
+        """Hand a created job to the worker pool."""
+        self._enqueue(self._records[job_id])
+
+    def _enqueue(self, record):
+        with self._lock:
+            self._pending += 1
+        self._executor.submit(self._run, record)
+
+    def _run(self, record):
+        with self._lock:
+            self._pending -= 1
+        job = Job(self, record)
+        record['status'] = RUNNING
+        record['started_at'] = time.time()
+        record['progress'] = {'stage': 'running'}
+        self.save(record)
+
+        try:
+            with job_deadlines():
+                record['result'] = self._handlers[record['kind']](job)
+            record['status'] = SUCCEEDED
+        except Exception as e:
+            log.exception('Job failed', job_id=record['id'], kind=record['kind'])
+            record['status'] = FAILED
+            record['error'] = str(e)
+        finally:
+            record['finished_at'] = time.time()
+            record['progress'] = dict(record.get('progress') or {}, stage=record['status'])
+            self.save(record)
+            # Input files are no longer needed once the job has finished
+            shutil.rmtree(self.workspace(record['id']), ignore_errors=True)
+            self._release(record['id'])
+            self._prune()
+
+    def _prune(self):
+        """Forget and delete the finished jobs older than the retention period."""
+        cutoff = time.time() - self.retention_seconds
+        with self._lock:
+            expired = [
+                job_id for job_id, record in list(self._records.items())
+                if record['status'] in FINISHED_STATUSES and (record['finished_at'] or cutoff) < cutoff
+            ]
+            for job_id in expired:
+                del self._records[job_id]
+        for job_id in expired:
+            self._delete(job_id)
+
+    def get(self, job_id):
+        """Return a snapshot of a job's record, or None if it is unknown."""
+        record = self._records.get(job_id)
+        if record is None:
+            # Created by another worker process: read its latest saved state
+            record = self._load(job_id)
+            if record is None:
+                return None
+        snapshot = dict(record)
+        snapshot['files'] = list(record['files'])
+        if record['started_at']:
+            end = record['finished_at'] or time.time()
+            snapshot['elapsed_ms'] = round((end - record['started_at']) * 1000, 1)
+        return snapshot
+
+    def _delete(self, job_id):
+        shutil.rmtree(self.workspace(job_id), ignore_errors=True)
+        for path in (self._record_path(job_id), self._lock_path(job_id)):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
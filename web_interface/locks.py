@@ -0,0 +1,54 @@
+"""
+Advisory file locks shared between worker processes.
+
+When several worker processes serve the app, state kept on disk (job records,
+chunked uploads) needs locks that work across processes, not just threads.
+``flock`` locks are released by the kernel when the holding process exits, so a
+crashed worker never leaves a lock behind. Where ``fcntl`` is unavailable only
+a single process can serve anyway, and these locks always succeed.
+"""
+
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+def try_lock(path):
+    """
+    Take an exclusive lock on ``path`` (created if missing) without waiting.
+
+    :returns: the open lock file, to pass to ``unlock`` later, or None if
+        another process holds the lock
+    """
+    f = open(path, 'a+b')
+    if fcntl is None:
+        return f
+    try:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        f.close()
+        return None
+    return f
+
+
+def unlock(f):
+    """Release a lock taken with ``try_lock``."""
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+    f.close()
+
+
+@contextmanager
+def locked(path):
+    """Hold an exclusive lock on ``path`` for the duration of the block, waiting for it if needed."""
+    with open(path, 'a+b') as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
@@ -0,0 +1,203 @@
+"""
+Structured, leveled logging.
+
+Modules log through ``get_logger(__name__)`` with an event message plus
+keyword fields, e.g. ``log.info('Searching index', index=name, top_k=10)``.
+``configure`` writes records to stderr as one JSON object per line
+(``LOG_FORMAT=json``) or as ``key=value`` text, at ``LOG_LEVEL``. Records
+logged while handling a request also carry its route and request ID.
+
+Hot routes can be sampled: ``LOG_SAMPLE_RATES`` maps route templates to the
+fraction of their requests whose debug and info records are kept (e.g.
+``/indexes/<index_name>/search=0.1``), and ``LOG_SAMPLE_RATE`` applies to all
+other routes. The decision is made once per request, so a request's records
+are kept or dropped together; warnings and errors are always kept.
+
+Payloads are only logged as size-capped ``preview``s. Full dumps of upstream
+responses go through ``debug_dump``, which does nothing, not even formatting
+the value, unless ``LOG_DEBUG_DUMPS`` is on.
+"""
+
+import contextvars
+import json
+import logging
+import os
+import random
+import reprlib
+import sys
+import time
+import uuid
+
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'text').lower()
+LOG_SAMPLE_RATE = float(os.getenv('LOG_SAMPLE_RATE', 1.0))
+LOG_PREVIEW_CHARS = int(os.getenv('LOG_PREVIEW_CHARS', 200))
+LOG_DEBUG_DUMPS = os.getenv('LOG_DEBUG_DUMPS', 'false').lower() in ('1', 'true', 'yes', 'on')
+LOG_DEBUG_DUMP_CHARS = int(os.getenv('LOG_DEBUG_DUMP_CHARS', 100_000))
+
+
+def parse_sample_rates(value):
+    """Parse ``route=rate,route=rate`` into a dict."""
+    rates = {}
+    for item in filter(None, (part.strip() for part in value.split(','))):
+        route, _, rate = item.rpartition('=')
+        if route:
+            rates[route.strip()] = float(rate)
+    return rates
+
+
+LOG_SAMPLE_RATES = parse_sample_rates(os.getenv('LOG_SAMPLE_RATES', ''))
+
+# (route, request_id, sampled) for the request being handled, if any
+_request = contextvars.ContextVar('log_request', default=None)
+
+_preview_repr = reprlib.Repr()
+_preview_repr.maxstring = LOG_PREVIEW_CHARS
+_preview_repr.maxother = 80
+_preview_repr.maxlist = _preview_repr.maxtuple = _preview_repr.maxset = 10
+_preview_repr.maxdict = 10
+
+
+def preview(value, limit=None):
+    """
+    Return a size-capped representation of a value for logging.
+
+    Strings and plain containers are truncated while they are formatted, so a
+    large payload costs no more than a small one; other objects are shown by
+    type only, since formatting them could mean serializing a whole response.
+    """
+    limit = LOG_PREVIEW_CHARS if limit is None else limit
+    if isinstance(value, str):
+        text = value
+    elif value is None or isinstance(value, (bool, int, float, dict, list, tuple, set, frozenset)):
+        text = _preview_repr.repr(value)
+    else:
+        return f"<{type(value).__name__}>"
+    if len(text) > limit:
+        return f"{text[:limit]}…(+{len(text) - limit} chars)"
+    return text
+
+
+def start_request(route, request_id=None):
+    """Record the request being handled and decide whether its records are sampled in."""
+    rate = LOG_SAMPLE_RATES.get(route, LOG_SAMPLE_RATE)
+    sampled = rate >= 1 or random.random() < rate
+    _request.set((route, request_id or uuid.uuid4().hex[:16], sampled))
+
+
+def end_request():
+    _request.set(None)
+
+
+class _SampleFilter(logging.Filter):
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        request = _request.get()
+        return request is None or request[2]
+
+
+class _ContextFilter(logging.Filter):
+    def filter(self, record):
+        request = _request.get()
+        record.route, record.request_id = request[:2] if request is not None else (None, None)
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record, with the structured fields at the top level."""
+
+    def format(self, record):
+        entry = {
+            'ts': time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(record.created)) + f'.{int(record.msecs):03d}Z',
+            'level': record.levelname.lower(),
+            'logger': record.name,
+            'event': record.getMessage(),
+        }
+        if record.route is not None:
+            entry['route'] = record.route
+            entry['request_id'] = record.request_id
+        entry.update(getattr(record, 'fields', None) or {})
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """``time level logger event key=value ...`` lines for reading in a terminal."""
+
+    def format(self, record):
+        fields = dict(getattr(record, 'fields', None) or {})
+        if record.route is not None:
+            fields = dict(route=record.route, request_id=record.request_id, **fields)
+        line = (
+            f"{self.formatTime(record, '%Y-%m-%d %H:%M:%S')} {record.levelname:<7} {record.name} "
+            f"{record.getMessage()}"
+        )
+        if fields:
+            line += ' ' + ' '.join(f"{key}={json.dumps(value, default=str)}" for key, value in fields.items())
+        if record.exc_info:
+            line += '\n' + self.formatException(record.exc_info)
+        return line
+
+
+class StructuredLogger:
+    """Thin wrapper over a ``logging.Logger`` taking structured fields as keyword arguments."""
+
+    def __init__(self, name):
+        self.logger = logging.getLogger(name)
+
+    def is_enabled_for(self, level):
+        return self.logger.isEnabledFor(level)
+
+    def _log(self, level, event, fields, exc_info=False):
+        if self.logger.isEnabledFor(level):
+            self.logger.log(level, event, exc_info=exc_info, extra={'fields': fields}, stacklevel=3)
+
+    def debug(self, event, **fields):
+        self._log(logging.DEBUG, event, fields)
+
+    def info(self, event, **fields):
+        self._log(logging.INFO, event, fields)
+
+    def warning(self, event, **fields):
+        self._log(logging.WARNING, event, fields)
+
+    def error(self, event, **fields):
+        self._log(logging.ERROR, event, fields)
+
+    def exception(self, event, **fields):
+        """Log an error with the traceback of the exception being handled."""
+        self._log(logging.ERROR, event, fields, exc_info=True)
+
+
+def get_logger(name):
+    return StructuredLogger(name)
+
+
+def debug_dump(log, event, value, **fields):
+    """Log a full upstream payload at debug level, only if ``LOG_DEBUG_DUMPS`` is on."""
+    if not LOG_DEBUG_DUMPS or not log.is_enabled_for(logging.DEBUG):
+        return
+    if hasattr(value, 'model_dump'):
+        value = value.model_dump()
+    elif hasattr(value, '__dict__'):
+        value = vars(value)
+    text = json.dumps(value, default=str)
+    log.debug(event, dump=preview(text, LOG_DEBUG_DUMP_CHARS), **fields)
+
+
+def configure():
+    """Set up the ``web_interface`` loggers; safe to call more than once."""
+    logger = logging.getLogger('web_interface')
+    if getattr(logger, '_configured', False):
+        return
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(JsonFormatter() if LOG_FORMAT == 'json' else TextFormatter())
+    handler.addFilter(_ContextFilter())
+    handler.addFilter(_SampleFilter())
+    logger.addHandler(handler)
+    logger.setLevel(LOG_LEVEL)
+    # The servers (gunicorn, uvicorn) configure their own loggers
+    logger.propagate = False
+    logger._configured = True
@@ -0,0 +1,318 @@
+"""
+Prometheus metrics.
+
+A small, dependency-free implementation of counters, gauges and histograms
+rendered in the Prometheus text exposition format for the ``/metrics`` route.
+Values that already live elsewhere (cache statistics, breaker states) are read
+at scrape time by collector functions rather than being copied on every change.
+
+Metrics live in each process. With several worker processes, ``SharedMetrics``
+has every worker publish its metrics to the ``SharedStore`` every
+``publish_interval`` seconds, and a scrape of any worker reports all of them:
+counters and histograms are summed over workers, including ones that have
+exited, and gauges are reported per live worker with a ``worker`` label (its
+PID), since a sum or maximum is only meaningful for some of them. Other
+workers' values can be up to ``publish_interval`` seconds old.
+"""
+
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from web_interface.logs import get_logger
+
+log = get_logger(__name__)
+
+# Seconds; includes the 2s / 5s / 10s latency targets
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def family(self):
+        """Return ``(name, kind, documentation, [(sample_name, labels_dict, value), ...])``."""
+        return self.name, self.kind, self.documentation, self.samples()
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        return [(self.name, dict(zip(self.labelnames, key)), value) for key, value in values]
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    @contextmanager
+    def track_in_progress(self, **labels):
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # Per-bucket (non-cumulative) counts, sum
+                state = self._values[key] = [[0] * len(self.buckets), 0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+                    break
+            state[1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self):
+        with self._lock:
+            values = sorted((key, (list(state[0]), state[1])) for key, state in self._values.items())
+        samples = []
+        for key, (counts, total) in values:
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                samples.append((f'{self.name}_bucket', dict(labels, le=_format_value(bound)), cumulative))
+            samples.append((f'{self.name}_sum', labels, total))
+            samples.append((f'{self.name}_count', labels, cumulative))
+        return samples
+
+
+class MetricsRegistry:
+    """Holds metrics and scrape-time collectors and renders them all."""
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def collector(self, func):
+        """
+        Register a function called at scrape time; it returns an iterable of
+        ``(name, kind, documentation, [(labels_dict, value), ...])``.
+        """
+        self._collectors.append(func)
+        return func
+
+    def families(self):
+        """Return every metric of this process as ``(name, kind, documentation, samples)``."""
+        families = [metric.family() for metric in self._metrics]
+        for collect in self._collectors:
+            try:
+                collected = list(collect())
+            except Exception as e:
+                log.warning('Metrics collector failed', collector=collect.__name__, error=str(e))
+                continue
+            families.extend(
+                (name, kind, documentation, [(name, labels, value) for labels, value in samples])
+                for name, kind, documentation, samples in collected
+            )
+        return families
+
+    def render(self, families=None):
+        """Render families (by default, this process's) in the Prometheus text format."""
+        lines = []
+        for name, kind, documentation, samples in (self.families() if families is None else families):
+            lines.append(f'# HELP {name} {documentation}')
+            lines.append(f'# TYPE {name} {kind}')
+            for sample_name, labels, value in samples:
+                lines.append(f'{sample_name}{_format_labels(labels.keys(), labels.values())} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+def merge_families(snapshots):
+    """
+    Merge the families of several workers, given as ``(worker, families)``.
+
+    Samples of counters and histograms are summed; gauge samples get a
+    ``worker`` label instead.
+    """
+    merged = {}
+    for worker, families in snapshots:
+        for name, kind, documentation, samples in families:
+            values = merged.setdefault(name, (kind, documentation, {}))[2]
+            for sample_name, labels, value in samples:
+                if kind == 'gauge':
+                    labels = dict(labels, worker=str(worker))
+                key = (sample_name, tuple(labels.items()))
+                values[key] = values.get(key, 0) + value
+    return [
+        (name, kind, documentation, [(sample_name, dict(labels), value) for (sample_name, labels), value in values.items()])
+        for name, (kind, documentation, values) in merged.items()
+    ]
+
+
+def _process_exists(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class SharedMetrics:
+    """Publishes this worker's metrics to a ``SharedStore`` and merges every worker's for a scrape."""
+
+    def __init__(self, registry, store, publish_interval=5.0):
+        """
+        :param registry: the ``MetricsRegistry`` of this process
+        :param publish_interval: seconds between publications of this worker's metrics
+        """
+        self.registry = registry
+        self.store = store
+        self.publish_interval = publish_interval
+        self._lock = threading.Lock()
+        self._publisher_pid = None
+
+    def publish(self):
+        """Publish this worker's metrics now."""
+        self.store.save_metrics(os.getpid(), json.dumps(self.registry.families()))
+
+    def _publish_periodically(self):
+        while True:
+            try:
+                self.publish()
+            except Exception as e:
+                log.warning('Publishing metrics failed', error=str(e))
+            time.sleep(self.publish_interval)
+
+    def start(self):
+        """
+        Start publishing from a background thread in this process; cheap enough
+        to call on every request, and needed after a fork, which only keeps the
+        calling thread.
+        """
+        if self._publisher_pid == os.getpid():
+            return
+        with self._lock:
+            if self._publisher_pid == os.getpid():
+                return
+            self._publisher_pid = os.getpid()
+            threading.Thread(target=self._publish_periodically, name='metrics-publisher', daemon=True).start()
+
+    @staticmethod
+    def _retire(retired, exited):
+        # An exited worker's gauges are gone, but its counts stay in the totals
+        families = [family for family in json.loads(exited) if family[1] != 'gauge']
+        return json.dumps(merge_families([(None, json.loads(retired) if retired else []), (None, families)]))
+
+    def families(self):
+        """Return the families of every worker, with this one's as of now."""
+        self.publish()
+        snapshots = self.store.metrics_snapshots()
+        for pid in snapshots:
+            if pid != self.store.RETIRED_METRICS and not _process_exists(pid):
+                self.store.retire_metrics(pid, self._retire)
+        snapshots = self.store.metrics_snapshots()
+        return merge_families([
+            (pid, json.loads(snapshot)) for pid, snapshot in sorted(snapshots.items())
+        ])
+
+
+metrics = MetricsRegistry()
+
+HTTP_REQUESTS = metrics.counter(
+    'compass_web_http_requests_total', 'HTTP requests handled.', ('route', 'method', 'status'))
+HTTP_ERRORS = metrics.counter(
+    'compass_web_http_request_errors_total', 'HTTP requests answered with a 5xx status.', ('route', 'method'))
+HTTP_LATENCY = metrics.histogram(
+    'compass_web_http_request_duration_seconds', 'Time to produce an HTTP response.', ('route', 'method'))
+HTTP_IN_FLIGHT = metrics.gauge(
+    'compass_web_http_requests_in_flight', 'HTTP requests currently being handled.')
+
+UPSTREAM_LATENCY = metrics.histogram(
+    'compass_web_upstream_request_duration_seconds',
+    'Duration of each upstream call attempt.', ('upstream', 'operation', 'outcome'))
+UPSTREAM_IN_FLIGHT = metrics.gauge(
+    'compass_web_upstream_requests_in_flight', 'Upstream calls currently in progress.', ('upstream',))
+
+CHAT_TIME_TO_FIRST_TOKEN = metrics.histogram(
+    'compass_web_chat_time_to_first_token_seconds',
+    'Time from a streaming chat request to its first token, including retrieval.')
+CHAT_STREAM_DURATION = metrics.histogram(
+    'compass_web_chat_stream_duration_seconds', 'Total duration of streaming chat responses.')
+
+CHAT_CONTEXT_TOKENS = metrics.histogram(
+    'compass_web_chat_context_tokens', 'Estimated tokens of grounding context sent with each chat.',
+    buckets=(250, 500, 1000, 2000, 4000, 8000, 16000, 32000, 64000, 128000))
+CHAT_CONTEXT_PASSAGES_DROPPED = metrics.counter(
+    'compass_web_chat_context_passages_dropped_total',
+    'Retrieved passages left out of chat context, by reason (duplicate or over_budget).', ('reason',))
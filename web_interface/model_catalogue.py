@@ -0,0 +1,159 @@
+"""
+Cached Cohere chat-model catalogue.
+
+The list of chat models changes rarely, so it is fetched once per API key and
+kept for a long TTL. Entries are keyed by a hash of the API key so keys are
+never held as dictionary keys. After ``refresh_after`` seconds a background
+thread refreshes the listing while the cached one is still served; only after
+``ttl`` does a request wait for a fresh listing. Each entry holds the models
+with their context length and capabilities already extracted, plus the
+serialized JSON body and its ETag so unchanged listings can be answered with
+``304 Not Modified``.
+"""
+
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from web_interface.logs import get_logger
+
+log = get_logger(__name__)
+
+
+def hash_api_key(api_key):
+    return hashlib.sha256(api_key.encode('utf-8')).hexdigest()
+
+
+def describe_model(model):
+    """Reduce a Cohere model object to the fields the UI and chat code need."""
+    endpoints = list(getattr(model, 'endpoints', None) or [])
+    features = list(getattr(model, 'features', None) or [])
+    return {
+        'name': model.name,
+        'description': getattr(model, 'description', ''),
+        'endpoints': endpoints,
+        'context_length': int(getattr(model, 'context_length', None) or 0),
+        'capabilities': sorted(set(features) | {f'endpoint:{endpoint}' for endpoint in endpoints}),
+        'deprecated': bool(getattr(model, 'is_deprecated', False)),
+    }
+
+
+class CatalogueEntry:
+    """One API key's chat models, ready to serve."""
+
+    def __init__(self, models):
+        self.models = models
+        self.by_name = {model['name']: model for model in models}
+        self.body = json.dumps({'models': models})
+        self.etag = hashlib.sha256(self.body.encode('utf-8')).hexdigest()[:32]
+        self.loaded_at = time.monotonic()
+
+
+class ModelCatalogue:
+    """Chat-model listings per (hashed) API key with background refresh."""
+
+    def __init__(self, loader, ttl=7 * 24 * 3600.0, refresh_after=3600.0, max_keys=32):
+        """
+        :param loader: callable taking an API key and returning Cohere model objects
+        :param ttl: seconds before a listing must be reloaded before use
+        :param refresh_after: seconds before a listing is refreshed in the background
+        :param max_keys: most API keys kept
+        """
+        self.loader = loader
+        self.ttl = ttl
+        self.refresh_after = refresh_after
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._refreshing = set()
+        self.hits = 0
+        self.misses = 0
+
+    def _load(self, api_key, key):
+        models = sorted(
+            (
+                describe_model(model) for model in self.loader(api_key)
+                if 'chat' in (getattr(model, 'endpoints', None) or [])
+            ),
+            key=lambda model: model['name']
+        )
+        entry = CatalogueEntry(models)
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_keys:
+                self._entries.popitem(last=False)
+        return entry
+
+    def _refresh_in_background(self, api_key, key):
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        def run():
+            try:
+                self._load(api_key, key)
+            except Exception as e:
+                log.warning('Background model catalogue refresh failed', error=str(e))
+            finally:
+                self._refreshing.discard(key)
+
+        threading.Thread(target=run, name='model-catalogue-refresh', daemon=True).start()
+
+    def get(self, api_key):
+        """Return the ``CatalogueEntry`` for an API key, loading it if needed."""
+        key = hash_api_key(api_key)
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return self._load(api_key, key)
+        age = time.monotonic() - entry.loaded_at
+        if age >= self.ttl:
+            self.misses += 1
+            try:
+                return self._load(api_key, key)
+            except Exception as e:
+                # An outdated catalogue is better than none
+                log.warning('Model catalogue refresh failed, serving the cached one', error=str(e))
+                return entry
+        self.hits += 1
+        if age >= self.refresh_after:
+            self._refresh_in_background(api_key, key)
+        return entry
+
+    def model(self, api_key, name):
+        """Return the precomputed description of one chat model, or None."""
+        return self.get(api_key).by_name.get(name)
+
+    def peek(self, api_key, name):
+        """
+        Like ``model``, but never waits for a listing: if the API key's listing
+        is not loaded (or is due a refresh) it is loaded in the background and
+        None is returned meanwhile.
+        """
+        key = hash_api_key(api_key)
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        if entry is None or time.monotonic() - entry.loaded_at >= self.refresh_after:
+            self._refresh_in_background(api_key, key)
+        return entry.by_name.get(name) if entry is not None else None
+
+    def stats(self):
+        """Return hit/miss counters and the number of API keys with a listing."""
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+            'entries': len(self._entries),
+        }
+
+    def invalidate(self):
+        with self._lock:
+            self._entries.clear()
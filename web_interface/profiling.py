@@ -0,0 +1,172 @@
+"""
+Opt-in per-request profiling.
+
+``ProfilerMiddleware`` wraps the WSGI app only when profiling is switched on in
+the configuration, so normal requests pay nothing when it is off. Even then a
+request is profiled only if it carries the admin token, in the
+``X-Profile-Token`` header or the ``__profile`` query parameter. Two modes are
+available:
+
+- ``sample``: a background thread samples the request thread's stack every few
+  milliseconds and writes collapsed stacks (``*.folded``), which flamegraph.pl
+  or speedscope turn into a flame graph.
+- ``cprofile``: the deterministic profiler, written as a ``*.pstats`` file for
+  ``pstats``, snakeviz or ``flameprof``.
+
+The file name is returned in the ``X-Profile-File`` response header. Streamed
+responses are profiled until the stream ends.
+"""
+
+import cProfile
+import hmac
+import os
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from urllib.parse import parse_qs
+
+from web_interface.logs import get_logger
+
+log = get_logger(__name__)
+
+MODES = ('sample', 'cprofile')
+
+
+class StackSampler:
+    """Samples one thread's Python stack at a fixed interval into collapsed stacks."""
+
+    def __init__(self, thread_id, interval=0.005):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='profile-sampler', daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            self.stacks[';'.join(reversed(names))] += 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def write(self, path):
+        with open(path, 'w') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+class _ProfiledResponse:
+    """Response iterable that keeps profiling until the server closes it."""
+
+    def __init__(self, iterable, resume, pause, stop):
+        self._iterable = iterable
+        self._resume = resume
+        self._pause = pause
+        self._stop = stop
+
+    def __iter__(self):
+        # Only time spent producing chunks is profiled, not time the server
+        # spends writing them
+        iterator = iter(self._iterable)
+        while True:
+            self._resume()
+            try:
+                chunk = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                self._pause()
+            yield chunk
+
+    def close(self):
+        try:
+            if hasattr(self._iterable, 'close'):
+                self._iterable.close()
+        finally:
+            self._stop()
+
+
+class ProfilerMiddleware:
+    """WSGI middleware profiling requests that present the admin token."""
+
+    def __init__(self, app, token, output_dir, mode='sample', sample_interval=0.005):
+        if mode not in MODES:
+            raise ValueError(f"Unknown profiling mode '{mode}' (expected one of {', '.join(MODES)})")
+        self.app = app
+        self.token = token
+        self.output_dir = output_dir
+        self.mode = mode
+        self.sample_interval = sample_interval
+        os.makedirs(output_dir, exist_ok=True)
+
+    def _requested_token(self, environ):
+        token = environ.get('HTTP_X_PROFILE_TOKEN')
+        if token is None and '__profile' in environ.get('QUERY_STRING', ''):
+            token = parse_qs(environ['QUERY_STRING']).get('__profile', [None])[0]
+        return token
+
+    def __call__(self, environ, start_response):
+        token = self._requested_token(environ)
+        if token is None or not hmac.compare_digest(token.encode(), self.token.encode()):
+            return self.app(environ, start_response)
+
+        mode = environ.get('HTTP_X_PROFILE_MODE', self.mode)
+        if mode not in MODES:
+            mode = self.mode
+        path = re.sub(r'[^A-Za-z0-9]+', '_', environ.get('PATH_INFO', '')).strip('_') or 'root'
+        filename = (
+            f"{time.strftime('%Y%m%d-%H%M%S')}-{environ.get('REQUEST_METHOD', 'GET')}-{path[:80]}-"
+            f"{uuid.uuid4().hex[:8]}.{'folded' if mode == 'sample' else 'pstats'}"
+        )
+        output_path = os.path.join(self.output_dir, filename)
+
+        def start_profiled_response(status, headers, exc_info=None):
+            return start_response(status, list(headers) + [('X-Profile-File', filename)], exc_info)
+
+        if mode == 'sample':
+            sampler = StackSampler(threading.get_ident(), self.sample_interval)
+            sampler.start()
+
+            def finish():
+                sampler.stop()
+                sampler.write(output_path)
+                log.info('Wrote sampled profile', path=output_path)
+
+            try:
+                iterable = self.app(environ, start_profiled_response)
+            except Exception:
+                finish()
+                raise
+            # The sampler keeps running while the response is streamed
+            return _ProfiledResponse(iterable, lambda: None, lambda: None, finish)
+
+        profiler = cProfile.Profile()
+
+        def finish():
+            profiler.dump_stats(output_path)
+            log.info('Wrote cProfile stats', path=output_path)
+
+        profiler.enable()
+        try:
+            iterable = self.app(environ, start_profiled_response)
+        except Exception:
+            profiler.disable()
+            finish()
+            raise
+        profiler.disable()
+        return _ProfiledResponse(iterable, profiler.enable, profiler.disable, finish)
@@ -0,0 +1,89 @@
+"""
+Short-lived server-side search result sets with cursor pagination.
+
+A search with a large ``top_k`` can return hundreds of hits. Rather than
+rendering them all into one page, the search page
+renders only the first page and keeps the formatted hits as a result set for a
+few minutes. The browser then fetches the remaining hits one page at a time
+with an opaque cursor naming the result set and the offset of the next page.
+Result sets live in any cache with the ``LRUCache`` interface, so with several
+worker processes a ``SharedCache`` lets any worker serve the next page.
+"""
+
+import base64
+import binascii
+import uuid
+
+
+class CursorError(Exception):
+    """Raised for a malformed or expired cursor; ``status_code`` is the HTTP status to return."""
+
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def encode_cursor(result_set_id, offset):
+    return base64.urlsafe_b64encode(f"{result_set_id}:{offset}".encode('ascii')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Return ``(result_set_id, offset)`` for a cursor made by ``encode_cursor``."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode('ascii')
+        result_set_id, offset = raw.split(':')
+        offset = int(offset)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise CursorError("Invalid cursor")
+    if not result_set_id.isalnum() or offset < 0:
+        raise CursorError("Invalid cursor")
+    return result_set_id, offset
+
+
+class ResultSets:
+    """Formatted search hits kept in a cache and served a page at a time."""
+
+    def __init__(self, cache, page_size=10, max_page_size=100):
+        """
+        :param cache: cache holding the result sets; its TTL is how long a
+            cursor stays valid
+        :param page_size: hits per page unless the caller asks for another size
+        :param max_page_size: largest page a caller may ask for
+        """
+        self.cache = cache
+        self.page_size = page_size
+        self.max_page_size = max_page_size
+
+    def _limit(self, limit):
+        return min(max(int(limit or self.page_size), 1), self.max_page_size)
+
+    @staticmethod
+    def _page(result_set_id, hits, offset, limit):
+        end = offset + limit
+        return {
+            'results': hits[offset:end],
+            'next_cursor': encode_cursor(result_set_id, end) if end < len(hits) else None,
+            'total': len(hits),
+        }
+
+    def first_page(self, index_name, query, hits, limit=None):
+        """
+        Return the first page of already formatted (JSON-ready) hits; the rest
+        are stored for ``next_page`` only if they do not fit on it.
+
+        :returns: dict with ``results``, ``next_cursor`` (None on the last
+            page) and ``total``
+        """
+        limit = self._limit(limit)
+        result_set_id = uuid.uuid4().hex
+        if len(hits) > limit:
+            self.cache.set(result_set_id, {'index_name': index_name, 'query': query, 'hits': hits})
+        return self._page(result_set_id, hits, 0, limit)
+
+    def next_page(self, index_name, cursor, limit=None):
+        """Return the page a cursor points at; raises ``CursorError`` if it is invalid or has expired."""
+        result_set_id, offset = decode_cursor(cursor)
+        result_set = self.cache.get(result_set_id)
+        if result_set is None or result_set['index_name'] != index_name:
+            raise CursorError("These search results have expired; please search again", 404)
+        return self._page(result_set_id, result_set['hits'], offset, self._limit(limit))
@@ -0,0 +1,327 @@
+"""
+Shared retry policy for upstream calls.
+
+Every call to Compass, the Compass parser or Cohere goes through
+``call_with_retry``: failures that are worth retrying (connection errors,
+timeouts, 429s and 5xx responses, but never other 4xx errors) are retried with
+exponential backoff and full jitter, so clients that failed together do not
+retry together. Retries are bounded three ways: a maximum number of attempts,
+a deadline after which no further attempt is started, and a process-wide retry
+budget that lets retries add only a fraction of extra load during an outage.
+
+The deadline also bounds the attempt in flight: while an attempt runs,
+``attempt_timeout`` gives the time left, and the shared HTTP clients in
+clients.py cap each request's timeouts to it.
+"""
+
+import contextlib
+import contextvars
+import functools
+import os
+import threading
+import time
+
+import httpx
+import requests
+from flask import g, has_request_context
+from cohere_compass.exceptions import CompassClientError, CompassError
+from tenacity import AsyncRetrying, RetryError, Retrying, retry_if_exception, retry_if_result, wait_random_exponential
+
+from web_interface.breakers import CircuitOpenError, breakers
+from web_interface.metrics import UPSTREAM_IN_FLIGHT, UPSTREAM_LATENCY
+
+RETRY_MAX_ATTEMPTS = int(os.getenv('RETRY_MAX_ATTEMPTS', 3))
+RETRY_INITIAL_WAIT_SECONDS = float(os.getenv('RETRY_INITIAL_WAIT_SECONDS', 0.5))
+RETRY_MAX_WAIT_SECONDS = float(os.getenv('RETRY_MAX_WAIT_SECONDS', 8))
+RETRY_DEADLINE_SECONDS = float(os.getenv('RETRY_DEADLINE_SECONDS', 30))
+RETRY_JOB_DEADLINE_SECONDS = float(os.getenv('RETRY_JOB_DEADLINE_SECONDS', 600))
+RETRY_MIN_ATTEMPT_TIMEOUT_SECONDS = float(os.getenv('RETRY_MIN_ATTEMPT_TIMEOUT_SECONDS', 2))
+RETRY_BUDGET_RATIO = float(os.getenv('RETRY_BUDGET_RATIO', 0.2))
+RETRY_BUDGET_MIN_PER_SECOND = float(os.getenv('RETRY_BUDGET_MIN_PER_SECOND', 1))
+
+
+class RetryBudget:
+    """
+    Token bucket shared by every retrying call.
+
+    Each first attempt deposits ``ratio`` tokens and each retry spends one, so
+    retries can add at most about ``ratio`` extra load; ``min_per_second``
+    tokens trickle in regardless so retries still work when traffic is light.
+    """
+
+    def __init__(self, ratio=0.2, min_per_second=1.0, max_tokens=None):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.max_tokens = max_tokens if max_tokens is not None else max(10.0, 10 * min_per_second)
+        self._tokens = self.max_tokens
+        self._refilled_at = time.monotonic()
+        self._lock = threading.Lock()
+        self.exhausted = 0
+
+    def _refill(self, now):
+        self._tokens = min(self.max_tokens, self._tokens + (now - self._refilled_at) * self.min_per_second)
+        self._refilled_at = now
+
+    def record_call(self):
+        """Credit the budget for a first attempt."""
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens = min(self.max_tokens, self._tokens + self.ratio)
+
+    def try_spend(self):
+        """Take one retry from the budget; returns False if it is exhausted."""
+        with self._lock:
+            self._refill(time.monotonic())
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return True
+            self.exhausted += 1
+            return False
+
+    def stats(self):
+        with self._lock:
+            self._refill(time.monotonic())
+            return {'tokens': round(self._tokens, 2), 'max_tokens': self.max_tokens, 'exhausted': self.exhausted}
+
+
+retry_budget = RetryBudget(RETRY_BUDGET_RATIO, RETRY_BUDGET_MIN_PER_SECOND)
+
+# Deadline of the upstream call attempt running in this context, if any
+_attempt_deadline = contextvars.ContextVar('attempt_deadline', default=None)
+
+
+def attempt_timeout():
+    """
+    Return the seconds left before the deadline of the upstream call attempt in
+    progress, or None outside one. Never less than
+    ``RETRY_MIN_ATTEMPT_TIMEOUT_SECONDS``, so an attempt started just before
+    the deadline still has a chance to finish.
+    """
+    deadline = _attempt_deadline.get()
+    if deadline is None:
+        return None
+    return max(deadline - time.monotonic(), RETRY_MIN_ATTEMPT_TIMEOUT_SECONDS)
+
+
+def is_retryable(error):
+    """Return whether an upstream error is transient and worth retrying."""
+    if isinstance(error, RetryError):
+        # An SDK call that retried on its own and gave up: judge its last error
+        last_error = error.last_attempt.exception()
+        return last_error is None or is_retryable(last_error)
+    if isinstance(error, CompassClientError):
+        # Other 4xx from Compass (including bad credentials): retrying cannot help
+        return error.code == 429
+    if isinstance(error, CompassError):
+        # The SDK reports 5xx responses and connection failures this way
+        return True
+    if isinstance(error, (requests.ConnectionError, requests.Timeout, httpx.TransportError)):
+        return True
+    response = getattr(error, 'response', None)
+    status_code = getattr(error, 'status_code', None) or getattr(response, 'status_code', None)
+    if isinstance(status_code, int):
+        return status_code == 429 or status_code >= 500
+    return False
+
+
+def has_error_result(result):
+    """Return whether an SDK call reported a failure in its result instead of raising."""
+    return isinstance(result, str) or bool(getattr(result, 'error', None))
+
+
+def deadline_after(seconds=None):
+    """Return a ``time.monotonic()`` deadline ``seconds`` from now."""
+    return time.monotonic() + (RETRY_DEADLINE_SECONDS if seconds is None else seconds)
+
+
+# Deadline shared by the upstream calls of request work handed to another
+# thread (see ``carry_deadline``), where there is no request context to keep it
+_shared_deadline = contextvars.ContextVar('shared_deadline', default=None)
+# Seconds each upstream call gets when there is no shared deadline; set for jobs
+_call_deadline_seconds = contextvars.ContextVar('call_deadline_seconds', default=None)
+
+
+def request_deadline():
+    """
+    Return the deadline shared by every upstream call made while handling the
+    current HTTP request, including on threads it handed work to, or a fresh
+    one outside a request: ``RETRY_DEADLINE_SECONDS`` from now, or
+    ``RETRY_JOB_DEADLINE_SECONDS`` in jobs, where nobody is waiting on a
+    response and a parse can take minutes.
+    """
+    deadline = _shared_deadline.get()
+    if deadline is not None:
+        return deadline
+    if not has_request_context():
+        return deadline_after(_call_deadline_seconds.get())
+    if 'retry_deadline' not in g:
+        g.retry_deadline = deadline_after()
+    return g.retry_deadline
+
+
+@contextlib.contextmanager
+def job_deadlines():
+    """Give each upstream call made in this block the job deadline."""
+    token = _call_deadline_seconds.set(RETRY_JOB_DEADLINE_SECONDS)
+    try:
+        yield
+    finally:
+        _call_deadline_seconds.reset(token)
+
+
+def carry_deadline(func, deadline=None):
+    """
+    Wrap ``func`` to run on another thread under the caller's deadlines.
+
+    Pool threads have neither the request context nor the context variables
+    of the thread submitting work to them, so without this the upstream calls
+    of a request's work would get a deadline of their own.
+
+    :param deadline: deadline shared by the calls of ``func``; defaults to the
+        caller's request deadline (in jobs, each call still gets its own)
+    """
+    seconds = _call_deadline_seconds.get()
+    if deadline is None and seconds is None:
+        deadline = request_deadline()
+
+    @functools.wraps(func)
+    def run(*args, **kwargs):
+        tokens = _shared_deadline.set(deadline), _call_deadline_seconds.set(seconds)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _shared_deadline.reset(tokens[0])
+            _call_deadline_seconds.reset(tokens[1])
+
+    return run
+
+
+def _retry_policy(deadline, max_attempts, retry_on_result):
+    """Build the stop, wait, retry and give-up arguments shared by both retry loops."""
+    max_attempts = min(max_attempts or RETRY_MAX_ATTEMPTS, RETRY_MAX_ATTEMPTS)
+    backoff = wait_random_exponential(multiplier=RETRY_INITIAL_WAIT_SECONDS, max=RETRY_MAX_WAIT_SECONDS)
+
+    planned = {}
+
+    def planned_sleep(retry_state):
+        # Draw the jittered sleep once per attempt, whether stop or wait asks first
+        if retry_state.attempt_number not in planned:
+            planned[retry_state.attempt_number] = backoff(retry_state)
+        return planned[retry_state.attempt_number]
+
+    def wait(retry_state):
+        return planned_sleep(retry_state)
+
+    def stop(retry_state):
+        if retry_state.attempt_number >= max_attempts:
+            return True
+        # Only retry if the next attempt would start before the deadline
+        if time.monotonic() + planned_sleep(retry_state) >= deadline:
+            return True
+        return not retry_budget.try_spend()
+
+    retry = retry_if_exception(is_retryable)
+    if retry_on_result is not None:
+        retry = retry | retry_if_result(retry_on_result)
+
+    return {
+        'stop': stop,
+        'wait': wait,
+        'retry': retry,
+        # Give up with the last outcome: re-raise its exception or return its result
+        'retry_error_callback': lambda retry_state: retry_state.outcome.result(),
+    }
+
+
+def _metric_labels(func, upstream, operation):
+    return {'upstream': upstream or 'other', 'operation': operation or getattr(func, '__name__', 'call')}
+
+
+def call_with_retry(func, *args, upstream=None, operation=None, deadline=None, max_attempts=None,
+                    retry_on_result=None, **kwargs):
+    """
+    Call ``func(*args, **kwargs)`` under the shared retry policy.
+
+    :param upstream: name of the service called ('compass', 'parser' or
+        'cohere'); each attempt then goes through its circuit breaker, which
+        fails fast with ``CircuitOpenError`` while the service is down
+    :param operation: name for the latency metrics; defaults to the function name
+    :param deadline: ``time.monotonic()`` value after which no new attempt is
+        started, and which caps the HTTP timeouts of the attempt in flight;
+        defaults to the current request's deadline
+    :param max_attempts: total attempts, at most ``RETRY_MAX_ATTEMPTS``
+    :param retry_on_result: optional predicate marking a returned value as a
+        retryable failure (for SDK calls that report errors in their result)
+    :returns: the result of the last attempt; the last exception is re-raised
+        if every attempt failed with one
+    """
+    deadline = request_deadline() if deadline is None else deadline
+    breaker = breakers[upstream] if upstream is not None else None
+    labels = _metric_labels(func, upstream, operation)
+    target = func
+
+    def func(*args, **kwargs):
+        # Time every attempt, including ones the breaker rejects
+        started = time.perf_counter()
+        outcome = 'error'
+        token = _attempt_deadline.set(deadline)
+        try:
+            with UPSTREAM_IN_FLIGHT.track_in_progress(upstream=labels['upstream']):
+                if breaker is not None:
+                    result = breaker.call(target, *args, is_failure=is_retryable, failure_result=retry_on_result, **kwargs)
+                else:
+                    result = target(*args, **kwargs)
+            if retry_on_result is None or not retry_on_result(result):
+                outcome = 'success'
+            return result
+        except CircuitOpenError:
+            outcome = 'rejected'
+            raise
+        finally:
+            _attempt_deadline.reset(token)
+            UPSTREAM_LATENCY.observe(time.perf_counter() - started, outcome=outcome, **labels)
+
+    retry_budget.record_call()
+    retrying = Retrying(**_retry_policy(deadline, max_attempts, retry_on_result))
+    return retrying(func, *args, **kwargs)
+
+
+async def async_call_with_retry(func, *args, upstream=None, operation=None, deadline=None, max_attempts=None,
+                                retry_on_result=None, **kwargs):
+    """
+    Await ``func(*args, **kwargs)`` under the shared retry policy.
+
+    The asyncio counterpart of ``call_with_retry`` for async clients; backoff
+    sleeps do not block the event loop. There is no request context to share
+    a deadline through, so pass ``deadline`` to bound several calls together.
+    """
+    deadline = deadline_after() if deadline is None else deadline
+    breaker = breakers[upstream] if upstream is not None else None
+    labels = _metric_labels(func, upstream, operation)
+    target = func
+
+    async def func(*args, **kwargs):
+        started = time.perf_counter()
+        outcome = 'error'
+        token = _attempt_deadline.set(deadline)
+        try:
+            with UPSTREAM_IN_FLIGHT.track_in_progress(upstream=labels['upstream']):
+                if breaker is not None:
+                    result = await breaker.call_async(
+                        target, *args, is_failure=is_retryable, failure_result=retry_on_result, **kwargs
+                    )
+                else:
+                    result = await target(*args, **kwargs)
+            if retry_on_result is None or not retry_on_result(result):
+                outcome = 'success'
+            return result
+        except CircuitOpenError:
+            outcome = 'rejected'
+            raise
+        finally:
+            _attempt_deadline.reset(token)
+            UPSTREAM_LATENCY.observe(time.perf_counter() - started, outcome=outcome, **labels)
+
+    retry_budget.record_call()
+    retrying = AsyncRetrying(**_retry_policy(deadline, max_attempts, retry_on_result))
+    return await retrying(func, *args, **kwargs)
@@ -0,0 +1,163 @@
+"""
+Parallel retrieval across several indexes.
+
+Chat answers can be grounded in more than one index. Each index is searched on
+a shared, bounded thread pool so total retrieval time tracks the slowest index
+rather than the sum of all of them. Results are merged by score, de-duplicated
+by document ID and trimmed to a global top-k. ``search_indexes_async`` does the
+same with coroutines for the asyncio serving mode.
+
+``extract_hits`` finds the hits in any shape of search response. Where a
+response type keeps its hits is worked out from the first response of that
+type and reused, so the hot path does not probe attributes on every response.
+"""
+
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from web_interface.logs import get_logger
+from web_interface.retries import carry_deadline, deadline_after, request_deadline
+
+log = get_logger(__name__)
+
+# Shared pool for fan-out searches, sized for the expected number of
+# concurrent chats times the indexes per chat
+RETRIEVAL_MAX_WORKERS = int(os.getenv('RETRIEVAL_MAX_WORKERS', 16))
+RETRIEVAL_TIMEOUT_SECONDS = float(os.getenv('RETRIEVAL_TIMEOUT_SECONDS', 10))
+
+_executor = ThreadPoolExecutor(
+    max_workers=RETRIEVAL_MAX_WORKERS,
+    thread_name_prefix='retrieval'
+)
+
+
+def _hit_attr(hit, name, default=None):
+    if isinstance(hit, dict):
+        return hit.get(name, default)
+    return getattr(hit, name, default)
+
+
+# Response type -> function returning the hits of a response of that type
+_hit_extractors = {}
+
+
+def _hit_extractor(response):
+    """Return a function extracting the hits from responses of this response's type."""
+    if hasattr(response, 'hits'):
+        # SearchDocumentsResponse / SearchChunksResponse
+        return lambda r: r.hits or []
+    if hasattr(response, 'result'):
+        return lambda r: extract_hits(r.result)
+    if hasattr(response, 'documents'):
+        return lambda r: r.documents or []
+    if hasattr(response, 'results'):
+        return lambda r: extract_hits(r.results)
+    return lambda r: []
+
+
+def extract_hits(response):
+    """Return the list of hits in a search response (SDK object or dict)."""
+    if not response:
+        return []
+    if isinstance(response, dict):
+        # Dicts of one type can have different keys, so they are looked up each time
+        for key in ('hits', 'documents'):
+            if key in response:
+                return response[key] or []
+        return extract_hits(response.get('result'))
+    extractor = _hit_extractors.get(type(response))
+    if extractor is None:
+        extractor = _hit_extractors[type(response)] = _hit_extractor(response)
+    return extractor(response)
+
+
+def fan_out(search, index_names, timeout=None):
+    """
+    Run ``search(index_name)`` for every index in parallel.
+
+    :param search: callable taking an index name and returning a list of hits
+    :param index_names: the indexes to search
+    :param timeout: seconds to wait for each index; slower indexes are skipped
+    :returns: a tuple ``(hits_by_index, errors_by_index)``
+    """
+    timeout = RETRIEVAL_TIMEOUT_SECONDS if timeout is None else timeout
+    # The searches share the request's deadline, cut to the wait below, so a
+    # search that is given up on does not keep its pool thread much longer
+    search = carry_deadline(search, deadline=min(request_deadline(), deadline_after(timeout)))
+    futures = {_executor.submit(search, name): name for name in index_names}
+    done, not_done = wait(futures, timeout=timeout)
+
+    hits_by_index = {}
+    errors_by_index = {}
+    for future in done:
+        name = futures[future]
+        try:
+            hits_by_index[name] = future.result()
+        except Exception as e:
+            errors_by_index[name] = str(e)
+    for future in not_done:
+        future.cancel()
+        errors_by_index[futures[future]] = f"Search timed out after {timeout} seconds"
+    return hits_by_index, errors_by_index
+
+
+def merge_hits(hit_lists, top_k):
+    """Merge hit lists by descending score, keeping the best hit per document ID."""
+    best = {}
+    for hits in hit_lists:
+        for hit in hits:
+            document_id = _hit_attr(hit, 'document_id') or id(hit)
+            score = _hit_attr(hit, 'score') or 0.0
+            current = best.get(document_id)
+            if current is None or score > current[0]:
+                best[document_id] = (score, hit)
+    ranked = sorted(best.values(), key=lambda pair: pair[0], reverse=True)
+    return [hit for _, hit in ranked[:top_k]]
+
+
+def search_indexes(search, index_names, top_k, timeout=None):
+    """
+    Search several indexes in parallel and merge the results.
+
+    Failing or slow indexes are reported and skipped; an exception is raised
+    only if every index fails.
+    """
+    if len(index_names) == 1:
+        return list(search(index_names[0]))[:top_k]
+
+    hits_by_index, errors_by_index = fan_out(search, index_names, timeout=timeout)
+    for name, error in errors_by_index.items():
+        log.warning('Search failed', index=name, error=error)
+    if not hits_by_index and errors_by_index:
+        raise RuntimeError("; ".join(f"{name}: {error}" for name, error in errors_by_index.items()))
+    return merge_hits(hits_by_index.values(), top_k)
+
+
+async def search_indexes_async(search, index_names, top_k, timeout=None):
+    """
+    Coroutine version of ``search_indexes``: ``search`` is a coroutine function
+    and the indexes are searched concurrently on the event loop.
+    """
+    if len(index_names) == 1:
+        return list(await search(index_names[0]))[:top_k]
+
+    timeout = RETRIEVAL_TIMEOUT_SECONDS if timeout is None else timeout
+    results = await asyncio.gather(
+        *(asyncio.wait_for(search(name), timeout) for name in index_names),
+        return_exceptions=True
+    )
+    hits_by_index = {}
+    errors_by_index = {}
+    for name, result in zip(index_names, results):
+        if isinstance(result, asyncio.TimeoutError):
+            errors_by_index[name] = f"Search timed out after {timeout} seconds"
+        elif isinstance(result, Exception):
+            errors_by_index[name] = str(result)
+        else:
+            hits_by_index[name] = result
+    for name, error in errors_by_index.items():
+        log.warning('Search failed', index=name, error=error)
+    if not hits_by_index and errors_by_index:
+        raise RuntimeError("; ".join(f"{name}: {error}" for name, error in errors_by_index.items()))
+    return merge_hits(hits_by_index.values(), top_k)
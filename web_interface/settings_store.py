@@ -0,0 +1,89 @@
+"""
+In-memory settings store backed by the pickled settings file.
+
+Settings are read on nearly every request, so the store keeps them in memory
+and only goes back to disk when the file on disk has changed (checked at most
+once every ``check_interval`` seconds). Writes go to a temporary file that is
+atomically renamed over the settings file, so readers never see a partial write.
+"""
+
+import os
+import pickle
+import tempfile
+import threading
+import time
+
+from web_interface.logs import get_logger
+
+log = get_logger(__name__)
+
+
+class SettingsStore:
+    """Cache of the settings file with mtime-based change detection."""
+
+    def __init__(self, path, check_interval=2.0):
+        self.path = path
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._settings = None
+        self._signature = None
+        self._next_check = 0.0
+        self.version = 0
+
+    def _file_signature(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def _reload(self, signature):
+        settings = {}
+        if signature is not None:
+            try:
+                with open(self.path, 'rb') as f:
+                    settings = pickle.load(f)
+            except Exception as e:
+                log.warning('Error loading settings', error=str(e))
+                # Keep serving what we had rather than wiping the settings
+                if self._settings is not None:
+                    return
+        self._settings = settings
+        self._signature = signature
+        self.version += 1
+
+    def get(self):
+        """Return a copy of the current settings."""
+        now = time.monotonic()
+        if self._settings is None or now >= self._next_check:
+            with self._lock:
+                if self._settings is None or now >= self._next_check:
+                    signature = self._file_signature()
+                    if self._settings is None or signature != self._signature:
+                        self._reload(signature)
+                    self._next_check = now + self.check_interval
+        return dict(self._settings)
+
+    def invalidate(self):
+        """Re-check the settings file on the next ``get``, e.g. after another process saved it."""
+        self._next_check = 0.0
+
+    def save(self, settings):
+        """Atomically write settings to disk and update the in-memory copy."""
+        directory = os.path.dirname(self.path) or '.'
+        with self._lock:
+            fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.settings-', suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    pickle.dump(settings, f)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(temp_path, self.path)
+            except Exception:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+                raise
+            self._settings = dict(settings)
+            self._signature = self._file_signature()
+            self._next_check = time.monotonic() + self.check_interval
+            self.version += 1
@@ -0,0 +1,348 @@
+"""
+Caches shared by the worker processes on one host.
+
+With several preforked workers (see ``gunicorn.conf.py``), per-process caches
+would each hold their own copy of the same data and never see each other's
+invalidations. ``SharedStore`` is a SQLite database in WAL mode, so no extra
+service is needed and readers never wait for the writer. It holds:
+
+- ``SharedCache`` entries, with the same interface as ``LRUCache`` (entry and
+  byte limits, TTL, tags, ``get_stale``), so every worker reads the same data
+  and an invalidation in one worker removes the entries for all of them.
+- A log of published invalidations. ``InvalidationListener`` polls it (at most
+  every ``check_interval`` seconds) and applies other workers' invalidations to
+  whatever this process still caches in memory.
+- Each worker's latest metrics, published by ``metrics.SharedMetrics``.
+
+Values are pickled, so the database must only be writable by the app itself.
+Errors from the database are logged and treated as cache misses.
+"""
+
+import json
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from web_interface.logs import get_logger
+
+log = get_logger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    namespace TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    expires_at REAL NOT NULL,
+    used_at REAL NOT NULL,
+    PRIMARY KEY (namespace, key)
+);
+CREATE INDEX IF NOT EXISTS entries_by_use ON entries (namespace, used_at);
+CREATE TABLE IF NOT EXISTS entry_tags (
+    namespace TEXT NOT NULL,
+    tag TEXT NOT NULL,
+    key TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entry_tags_by_tag ON entry_tags (namespace, tag);
+CREATE INDEX IF NOT EXISTS entry_tags_by_key ON entry_tags (namespace, key);
+CREATE TABLE IF NOT EXISTS invalidations (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    topic TEXT NOT NULL,
+    tag TEXT,
+    origin INTEGER NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS metrics (
+    pid INTEGER PRIMARY KEY,
+    snapshot TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+"""
+
+
+class SharedStore:
+    """SQLite database (WAL mode) shared by every worker process."""
+
+    # Metrics row holding the summed counts of workers that have exited
+    RETIRED_METRICS = 0
+
+    def __init__(self, path, busy_timeout=5.0, invalidation_retention=3600.0):
+        """
+        :param path: database file; created with its directory if missing
+        :param busy_timeout: seconds a writer waits for another writer
+        :param invalidation_retention: seconds published invalidations are kept
+        """
+        self.path = path
+        self.busy_timeout = busy_timeout
+        self.invalidation_retention = invalidation_retention
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    def connection(self):
+        """Return this thread's connection, opening a new one after a fork."""
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            # isolation_level=None: statements autocommit unless in transaction()
+            connection = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            # WAL commits then skip the fsync; a crash can only lose cache entries
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.executescript(SCHEMA)
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    @contextmanager
+    def transaction(self):
+        """Run the block as one write transaction, taking the write lock up front."""
+        connection = self.connection()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            yield connection
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        connection.execute('COMMIT')
+
+    def publish(self, topic, tag=None):
+        """Record an invalidation for the other worker processes to apply."""
+        now = time.time()
+        with self.transaction() as connection:
+            connection.execute(
+                'INSERT INTO invalidations (topic, tag, origin, created_at) VALUES (?, ?, ?, ?)',
+                (topic, tag, os.getpid(), now)
+            )
+            connection.execute('DELETE FROM invalidations WHERE created_at < ?', (now - self.invalidation_retention,))
+
+    def save_metrics(self, pid, snapshot):
+        """Store a worker's metrics snapshot (JSON), replacing its previous one."""
+        self.connection().execute(
+            'INSERT OR REPLACE INTO metrics (pid, snapshot, updated_at) VALUES (?, ?, ?)',
+            (pid, snapshot, time.time())
+        )
+
+    def metrics_snapshots(self):
+        """Return ``{pid: snapshot}`` for every worker, plus ``RETIRED_METRICS``."""
+        return dict(self.connection().execute('SELECT pid, snapshot FROM metrics'))
+
+    def retire_metrics(self, pid, fold):
+        """
+        Replace an exited worker's snapshot by folding it into the retired one
+        with ``fold(retired_snapshot_or_None, snapshot)``, in one transaction
+        so concurrent scrapes fold it only once.
+        """
+        with self.transaction() as connection:
+            row = connection.execute('SELECT snapshot FROM metrics WHERE pid = ?', (pid,)).fetchone()
+            if row is None:
+                return
+            retired = connection.execute(
+                'SELECT snapshot FROM metrics WHERE pid = ?', (self.RETIRED_METRICS,)
+            ).fetchone()
+            connection.execute(
+                'INSERT OR REPLACE INTO metrics (pid, snapshot, updated_at) VALUES (?, ?, ?)',
+                (self.RETIRED_METRICS, fold(retired[0] if retired else None, row[0]), time.time())
+            )
+            connection.execute('DELETE FROM metrics WHERE pid = ?', (pid,))
+
+    def last_invalidation_id(self):
+        return self.connection().execute('SELECT COALESCE(MAX(id), 0) FROM invalidations').fetchone()[0]
+
+    def invalidations_since(self, after_id):
+        """Return ``(id, topic, tag, from_this_process)`` for invalidations published after ``after_id``."""
+        pid = os.getpid()
+        return [
+            (invalidation_id, topic, tag, origin == pid)
+            for invalidation_id, topic, tag, origin in self.connection().execute(
+                'SELECT id, topic, tag, origin FROM invalidations WHERE id > ? ORDER BY id', (after_id,)
+            )
+        ]
+
+
+class SharedCache:
+    """``LRUCache`` counterpart keeping its entries in a ``SharedStore``."""
+
+    # Least-recently-used order is only refreshed when this much older, to
+    # avoid a write on every hit
+    TOUCH_INTERVAL = 1.0
+
+    def __init__(self, store, namespace, max_entries=1024, max_bytes=64 * 1024 * 1024, ttl=300.0):
+        self.store = store
+        self.namespace = namespace
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        # Counters are per process, like the rest of the metrics
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _key(key):
+        return json.dumps(key, default=str)
+
+    def _lookup(self, key):
+        row = self.store.connection().execute(
+            'SELECT value, expires_at, used_at FROM entries WHERE namespace = ? AND key = ?',
+            (self.namespace, self._key(key))
+        ).fetchone()
+        if row is None:
+            return None
+        # An entry pickled by an older version of the app is just a miss
+        return pickle.loads(row[0]), row[1], row[2]
+
+    def get(self, key, default=None):
+        """Return the cached value for ``key``, or ``default`` on a miss."""
+        try:
+            entry = self._lookup(key)
+            now = time.time()
+            if entry is None or entry[1] <= now:
+                self.misses += 1
+                return default
+            if now - entry[2] >= self.TOUCH_INTERVAL:
+                self.store.connection().execute(
+                    'UPDATE entries SET used_at = ? WHERE namespace = ? AND key = ?',
+                    (now, self.namespace, self._key(key))
+                )
+        except Exception as e:
+            log.warning('Shared cache read failed', namespace=self.namespace, error=str(e))
+            self.misses += 1
+            return default
+        self.hits += 1
+        return entry[0]
+
+    def get_stale(self, key, default=None):
+        """Return the value for ``key`` even if it has expired, e.g. while its source is down."""
+        try:
+            entry = self._lookup(key)
+        except Exception as e:
+            log.warning('Shared cache read failed', namespace=self.namespace, error=str(e))
+            return default
+        return default if entry is None else entry[0]
+
+    def set(self, key, value, tags=(), ttl=None):
+        """Cache ``value`` under ``key``, evicting least recently used entries as needed."""
+        value = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        if len(value) > self.max_bytes:
+            return
+        key = self._key(key)
+        now = time.time()
+        expires_at = now + (self.ttl if ttl is None else ttl)
+        try:
+            with self.store.transaction() as connection:
+                connection.execute(
+                    'INSERT OR REPLACE INTO entries (namespace, key, value, size, expires_at, used_at) '
+                    'VALUES (?, ?, ?, ?, ?, ?)',
+                    (self.namespace, key, value, len(value), expires_at, now)
+                )
+                connection.execute('DELETE FROM entry_tags WHERE namespace = ? AND key = ?', (self.namespace, key))
+                connection.executemany(
+                    'INSERT INTO entry_tags (namespace, tag, key) VALUES (?, ?, ?)',
+                    [(self.namespace, str(tag), key) for tag in set(tags)]
+                )
+                self._evict(connection)
+        except Exception as e:
+            log.warning('Shared cache write failed', namespace=self.namespace, error=str(e))
+
+    def _evict(self, connection):
+        entries, size = connection.execute(
+            'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries WHERE namespace = ?', (self.namespace,)
+        ).fetchone()
+        if entries <= self.max_entries and size <= self.max_bytes:
+            return
+        evicted = []
+        for key, entry_size in connection.execute(
+            'SELECT key, size FROM entries WHERE namespace = ? ORDER BY used_at', (self.namespace,)
+        ):
+            if entries <= self.max_entries and size <= self.max_bytes:
+                break
+            evicted.append((self.namespace, key))
+            entries -= 1
+            size -= entry_size
+        connection.executemany('DELETE FROM entries WHERE namespace = ? AND key = ?', evicted)
+        connection.executemany('DELETE FROM entry_tags WHERE namespace = ? AND key = ?', evicted)
+        self.evictions += len(evicted)
+
+    def invalidate(self, tag=None):
+        """Drop every entry with the given tag, or every entry if no tag is given, in all processes."""
+        try:
+            with self.store.transaction() as connection:
+                if tag is None:
+                    connection.execute('DELETE FROM entries WHERE namespace = ?', (self.namespace,))
+                    connection.execute('DELETE FROM entry_tags WHERE namespace = ?', (self.namespace,))
+                    return
+                tagged = 'SELECT key FROM entry_tags WHERE namespace = ? AND tag = ?'
+                connection.execute(
+                    f'DELETE FROM entries WHERE namespace = ? AND key IN ({tagged})',
+                    (self.namespace, self.namespace, str(tag))
+                )
+                connection.execute(
+                    f'DELETE FROM entry_tags WHERE namespace = ? AND key IN ({tagged})',
+                    (self.namespace, self.namespace, str(tag))
+                )
+        except Exception as e:
+            log.warning('Shared cache invalidation failed', namespace=self.namespace, error=str(e))
+
+    def stats(self):
+        """Return this process's hit/miss counters and the shared usage."""
+        try:
+            entries, size = self.store.connection().execute(
+                'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries WHERE namespace = ?', (self.namespace,)
+            ).fetchone()
+        except Exception as e:
+            log.warning('Shared cache read failed', namespace=self.namespace, error=str(e))
+            entries, size = 0, 0
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+            'evictions': self.evictions,
+            'entries': entries,
+            'bytes': size,
+            'max_entries': self.max_entries,
+            'max_bytes': self.max_bytes,
+        }
+
+
+class InvalidationListener:
+    """Applies invalidations published by other worker processes to this one."""
+
+    def __init__(self, store, handler, check_interval=0.5):
+        """
+        :param handler: called with ``(topic, tag)`` for each invalidation
+        :param check_interval: minimum seconds between polls of the store
+        """
+        self.store = store
+        self.handler = handler
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._last_id = None
+        self._next_check = 0.0
+
+    def due(self):
+        """Return whether ``check`` would look for new invalidations now."""
+        return time.monotonic() >= self._next_check
+
+    def check(self):
+        """Apply any new invalidations; cheap enough to call on every request."""
+        now = time.monotonic()
+        if now < self._next_check or not self._lock.acquire(blocking=False):
+            return
+        try:
+            self._next_check = now + self.check_interval
+            if self._last_id is None:
+                # Nothing is cached yet in a new process, so history is irrelevant
+                self._last_id = self.store.last_invalidation_id()
+                return
+            for invalidation_id, topic, tag, from_this_process in self.store.invalidations_since(self._last_id):
+                self._last_id = invalidation_id
+                # The publishing process has already invalidated its own caches
+                if not from_this_process:
+                    self.handler(topic, tag)
+        except Exception as e:
+            log.warning('Checking shared invalidations failed', error=str(e))
+        finally:
+            self._lock.release()
@@ -0,0 +1,131 @@
+"""
+Snippet-first search result payloads.
+
+Users open the full text of only a few hits, so search and chat payloads carry
+a short snippet of each hit instead: a window around the first query term,
+with the positions of every matched term for highlighting. Each hit also has a
+handle for its full text. The texts of one response are stored together in a
+cache under a random group ID, and a handle is that ID plus the hit's position.
+The full-text endpoint looks texts up by handle. A handle always names the
+same text, so the browser can cache the endpoint's responses.
+"""
+
+import re
+import uuid
+
+from markupsafe import Markup, escape
+
+WORD = re.compile(r'\w+')
+
+
+def _field(hit, name):
+    if isinstance(hit, dict):
+        return hit.get(name)
+    return getattr(hit, name, None)
+
+
+def hit_text(hit):
+    """Return the full text of a search hit (SDK object or dict)."""
+    text = _field(hit, 'text')
+    if text is None:
+        content = _field(hit, 'content')
+        # A document's content is its fields; without a text field its text is in its chunks
+        text = content.get('text') if isinstance(content, dict) else content
+    if not text and _field(hit, 'chunks'):
+        # Document hits from search_documents carry their text in the matching chunks
+        return '\n\n'.join(filter(None, (hit_text(chunk) for chunk in _field(hit, 'chunks'))))
+    return str(text) if text else ''
+
+
+class Highlighter:
+    """Cuts snippets around a query's terms and reports where the terms matched."""
+
+    def __init__(self, query, max_chars=240):
+        self.max_chars = max_chars
+        # Longest terms first, so a term is not shadowed by its own prefix
+        terms = sorted({term.casefold() for term in WORD.findall(query or '') if len(term) > 1}, key=len, reverse=True)
+        self.pattern = re.compile('|'.join(re.escape(term) for term in terms), re.IGNORECASE) if terms else None
+
+    def snippet(self, text):
+        """Return ``(snippet, highlights)``, where highlights are ``[start, end]`` offsets into the snippet."""
+        text = ' '.join(text.split())
+        match = self.pattern.search(text) if self.pattern is not None else None
+        start = 0
+        if match is not None and match.end() > self.max_chars:
+            # Show some context before the first match, starting at a word
+            start = max(0, match.start() - self.max_chars // 3)
+            space = text.find(' ', start, match.start())
+            if space != -1:
+                start = space + 1
+        end = start + self.max_chars
+        if end < len(text):
+            space = text.rfind(' ', start, end)
+            if space > start:
+                end = space
+        snippet = ('… ' if start > 0 else '') + text[start:end] + (' …' if end < len(text) else '')
+        highlights = []
+        if self.pattern is not None:
+            highlights = [[m.start(), m.end()] for m in self.pattern.finditer(snippet)]
+        return snippet, highlights
+
+
+def highlight_html(snippet, highlights):
+    """Render a snippet as HTML with its matched terms wrapped in ``<mark>``."""
+    parts = []
+    position = 0
+    for start, end in highlights:
+        parts.append(escape(snippet[position:start]))
+        parts.append(Markup('<mark>%s</mark>') % snippet[start:end])
+        position = end
+    parts.append(escape(snippet[position:]))
+    return Markup('').join(parts)
+
+
+class ChunkTexts:
+    """Full texts of search hits, stored per response and looked up by handle."""
+
+    def __init__(self, cache, snippet_chars=240):
+        """
+        :param cache: cache holding the texts; its TTL is how long a handle stays valid
+        :param snippet_chars: approximate snippet length
+        """
+        self.cache = cache
+        self.snippet_chars = snippet_chars
+
+    def register(self, texts):
+        """Store a response's texts and return one handle per text."""
+        if not texts:
+            return []
+        group = uuid.uuid4().hex
+        self.cache.set(group, list(texts))
+        return [f"{group}-{position}" for position in range(len(texts))]
+
+    def get(self, handle):
+        """Return the text for a handle, or None if it is malformed or has expired."""
+        group, _, position = handle.partition('-')
+        if not group.isalnum() or not position.isdigit():
+            return None
+        texts = self.cache.get(group)
+        if texts is None or int(position) >= len(texts):
+            return None
+        return texts[int(position)]
+
+    def format_hits(self, hits, query):
+        """Reduce search hits to JSON-ready snippet payloads, registering their full texts."""
+        highlighter = Highlighter(query, self.snippet_chars)
+        texts = [hit_text(hit) for hit in hits]
+        formatted = []
+        for hit, text, handle in zip(hits, texts, self.register(texts)):
+            snippet, highlights = highlighter.snippet(text)
+            score = _field(hit, 'score')
+            formatted.append({
+                'document_id': _field(hit, 'document_id'),
+                'chunk_id': _field(hit, 'chunk_id'),
+                'path': _field(hit, 'path'),
+                'score': float(score) if score is not None else None,
+                'snippet': snippet,
+                'highlights': highlights,
+                'handle': handle,
+                'length': len(text),
+            })
+        return formatted
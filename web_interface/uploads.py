@@ -0,0 +1,233 @@
+"""
+Resumable chunked uploads.
+
+Browsers slice large files into fixed-size chunks and send them one request at
+a time. Each chunk is streamed to a temporary file while its SHA-256 is
+checked and only then copied to its offset in a partial file, so memory use per
+upload is bounded by the copy buffer rather than the file size, and a corrupt
+resend never overwrites a chunk that was already received intact. The set of
+received chunks is persisted with the upload, so an interrupted upload can ask
+which chunks are missing and resume from there.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import time
+import uuid
+from contextlib import contextmanager
+
+from web_interface.locks import locked
+
+COPY_BUFFER_SIZE = 64 * 1024
+
+
+class UploadError(Exception):
+    """Raised for invalid chunk uploads; ``status_code`` is the HTTP status to return."""
+
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class ChunkedUploads:
+    """Partial uploads stored under ``uploads_dir`` as a data file plus a JSON record."""
+
+    def __init__(self, uploads_dir, chunk_size=8 * 1024 * 1024, max_chunk_size=64 * 1024 * 1024,
+                 max_size=2 * 1024 ** 3, ttl=24 * 3600):
+        self.uploads_dir = uploads_dir
+        self.chunk_size = chunk_size
+        self.max_chunk_size = max_chunk_size
+        self.max_size = max_size
+        self.ttl = ttl
+
+    def _record_path(self, upload_id):
+        return os.path.join(self.uploads_dir, f"{upload_id}.json")
+
+    def data_path(self, upload_id):
+        return os.path.join(self.uploads_dir, f"{upload_id}.part")
+
+    def _lock_path(self, upload_id):
+        # Not the data file itself: locking opens the path, which would
+        # recreate the data file after completion moved it away
+        return os.path.join(self.uploads_dir, f"{upload_id}.lock")
+
+    def _save(self, record):
+        record['updated_at'] = time.time()
+        fd, temp_path = tempfile.mkstemp(dir=self.uploads_dir, prefix='.upload-', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(record, f)
+            os.replace(temp_path, self._record_path(record['id']))
+        except Exception:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    def _load(self, upload_id):
+        # Upload IDs come from URLs; only accept the hex IDs we hand out
+        if not upload_id.isalnum():
+            raise UploadError(f"Upload '{upload_id}' not found", 404)
+        try:
+            with open(self._record_path(upload_id)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            raise UploadError(f"Upload '{upload_id}' not found", 404)
+
+    def create(self, filename, size, content_type=None, chunk_size=None, sha256=None, **extra):
+        """
+        Start an upload of ``size`` bytes and return its status.
+
+        :param sha256: optional hex digest of the whole file, checked on completion
+        :param extra: values stored with the upload for whoever completes it
+        """
+        chunk_size = int(chunk_size or self.chunk_size)
+        size = int(size)
+        if not filename:
+            raise UploadError("Missing filename")
+        if size <= 0:
+            raise UploadError("File is empty")
+        if size > self.max_size:
+            raise UploadError(f"File is larger than the {self.max_size} byte limit", 413)
+        if not 0 < chunk_size <= self.max_chunk_size:
+            raise UploadError(f"Chunk size must be between 1 and {self.max_chunk_size} bytes")
+
+        os.makedirs(self.uploads_dir, exist_ok=True)
+        self.prune()
+
+        upload_id = uuid.uuid4().hex
+        with open(self.data_path(upload_id), 'wb') as f:
+            f.truncate(size)
+        record = dict(
+            extra,
+            id=upload_id,
+            filename=filename,
+            content_type=content_type or 'application/octet-stream',
+            size=size,
+            chunk_size=chunk_size,
+            total_chunks=(size + chunk_size - 1) // chunk_size,
+            sha256=sha256.lower() if sha256 else None,
+            received=[],
+            created_at=time.time(),
+        )
+        self._save(record)
+        return self.status(upload_id, record)
+
+    def status(self, upload_id, record=None):
+        """Return which chunks of an upload have been received and which are missing."""
+        record = record or self._load(upload_id)
+        received = set(record['received'])
+        missing = [i for i in range(record['total_chunks']) if i not in received]
+        return {
+            'upload_id': record['id'],
+            'filename': record['filename'],
+            'size': record['size'],
+            'chunk_size': record['chunk_size'],
+            'total_chunks': record['total_chunks'],
+            'received_chunks': sorted(received),
+            'next_chunk': missing[0] if missing else None,
+            'complete': not missing,
+        }
+
+    def write_chunk(self, upload_id, index, stream, sha256=None):
+        """
+        Stream chunk ``index`` from a file-like object to disk.
+
+        The chunk must have exactly the expected length and, if ``sha256`` is
+        given, match that digest; otherwise it is rejected, the partial file is
+        left untouched and the chunk can be resent.
+        """
+        record = self._load(upload_id)
+        if not 0 <= index < record['total_chunks']:
+            raise UploadError(f"Chunk {index} is out of range (0-{record['total_chunks'] - 1})")
+        offset = index * record['chunk_size']
+        expected = min(record['chunk_size'], record['size'] - offset)
+
+        digest = hashlib.sha256()
+        written = 0
+        with tempfile.TemporaryFile(dir=self.uploads_dir, prefix='.chunk-') as chunk:
+            while written <= expected:
+                block = stream.read(COPY_BUFFER_SIZE)
+                if not block:
+                    break
+                written += len(block)
+                if written > expected:
+                    break
+                digest.update(block)
+                chunk.write(block)
+            if written != expected:
+                raise UploadError(f"Chunk {index} should be {expected} bytes")
+            if sha256 and digest.hexdigest() != sha256.lower():
+                raise UploadError(f"Chunk {index} failed its SHA-256 check", 422)
+
+            # Chunks of one upload may arrive at different worker processes
+            with locked(self._lock_path(upload_id)):
+                # Reloaded under the lock: the upload may have been completed meanwhile
+                record = self._load(upload_id)
+                chunk.seek(0)
+                with open(self.data_path(upload_id), 'r+b') as f:
+                    f.seek(offset)
+                    for block in iter(lambda: chunk.read(COPY_BUFFER_SIZE), b''):
+                        f.write(block)
+                if index not in record['received']:
+                    record['received'].append(index)
+                    self._save(record)
+        return self.status(upload_id, record)
+
+    @contextmanager
+    def complete(self, upload_id):
+        """
+        Check that every chunk (and the whole-file hash, if one was given) is in
+        place and yield ``(record, data_path)`` for the caller to take the data
+        file.
+
+        The upload is locked for the whole block, so a concurrent completion
+        waits and then finds the upload gone. It is discarded if the block
+        succeeds and kept, to be completed again, if the block raises.
+        """
+        # Checked before locking too, so completing a finished upload does not
+        # leave a new lock file behind
+        self._load(upload_id)
+        with locked(self._lock_path(upload_id)):
+            record = self._load(upload_id)
+            status = self.status(upload_id, record)
+            if not status['complete']:
+                raise UploadError(f"Upload is missing {record['total_chunks'] - len(status['received_chunks'])} chunks", 409)
+            if record['sha256']:
+                digest = hashlib.sha256()
+                with open(self.data_path(upload_id), 'rb') as f:
+                    for block in iter(lambda: f.read(COPY_BUFFER_SIZE), b''):
+                        digest.update(block)
+                if digest.hexdigest() != record['sha256']:
+                    raise UploadError("File failed its SHA-256 check", 422)
+            yield record, self.data_path(upload_id)
+            self.discard(upload_id)
+
+    def discard(self, upload_id):
+        """Remove an upload's record and any data left behind."""
+        for path in (self._record_path(upload_id), self.data_path(upload_id), self._lock_path(upload_id)):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def prune(self):
+        """Discard uploads that have not received a chunk within the TTL, and stray lock files."""
+        now = time.time()
+        for name in os.listdir(self.uploads_dir):
+            if name.endswith('.lock') and not os.path.exists(self._record_path(name[:-len('.lock')])):
+                try:
+                    os.remove(os.path.join(self.uploads_dir, name))
+                except FileNotFoundError:
+                    pass
+            if not name.endswith('.json'):
+                continue
+            path = os.path.join(self.uploads_dir, name)
+            try:
+                with open(path) as f:
+                    record = json.load(f)
+            except Exception:
+                continue
+            if now - record.get('updated_at', now) > self.ttl:
+                self.discard(record['id'])